@@ -0,0 +1,20 @@
+-- Takes the tables of create.sql to the schema the numbered migrations are written against. Every column and
+-- index the scheduler added before the migrations existed is here, so an existing database catches up with it.
+
+-- PBKDF2 cost of the hash, the existing hashes were made with 100000 iterations.
+ALTER TABLE Caregivers ADD Iterations INT NOT NULL DEFAULT 100000;
+ALTER TABLE Patients ADD Iterations INT NOT NULL DEFAULT 100000;
+
+-- Appointments of the caregiver, counted once on their row. Among the caregivers free on a date, the least
+-- booked one is assigned first.
+ALTER TABLE Caregivers ADD Booked INT NOT NULL DEFAULT 0;
+
+-- Bumped by every write, the vaccine catalog reloads only the rows past its version.
+ALTER TABLE Vaccines ADD Version ROWVERSION;
+GO
+
+UPDATE Caregivers SET Booked = (
+    SELECT COUNT(*) FROM Appointments WHERE Appointments.CareGiverName = Caregivers.Username
+);
+
+CREATE INDEX IX_Vaccines_Version ON Vaccines (Version);
@@ -0,0 +1,9 @@
+-- The appointment listings seek their user and read the page in Id order straight from the index, without
+-- touching the table or sorting. The date lookups find the appointments of a date, and of a caregiver on a date.
+CREATE INDEX IX_Appointments_Patient ON Appointments (PatientName, Id)
+    INCLUDE (CareGiverName, AppointmentDate, VaccineType);
+
+CREATE INDEX IX_Appointments_Caregiver ON Appointments (CareGiverName, Id)
+    INCLUDE (PatientName, AppointmentDate, VaccineType);
+
+CREATE INDEX IX_Appointments_Date_Caregiver ON Appointments (AppointmentDate, CareGiverName);
@@ -0,0 +1,15 @@
+-- Patients waiting for a date when reserve found no caregiver or no doses. They are booked first come, first
+-- served as soon as availabilities or doses are added, see Waitlist.match.
+CREATE TABLE Waitlist (
+    Id INT NOT NULL IDENTITY(1,1),  -- the order of arrival.
+    PatientName VARCHAR(255) NOT NULL REFERENCES Patients,
+    AppointmentDate DATE NOT NULL,
+    VaccineType VARCHAR(255) NOT NULL REFERENCES Vaccines,
+    QueuedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (Id)
+);
+
+-- A patient waits once for a vaccine on a date, the position in the queue is counted on this index.
+CREATE UNIQUE INDEX IX_Waitlist_Date_Vaccine_Patient ON Waitlist (AppointmentDate, VaccineType, PatientName);
+-- A patient booked for a vaccine leaves its waitlist on every date, the entries are found by patient.
+CREATE INDEX IX_Waitlist_Patient_Vaccine ON Waitlist (PatientName, VaccineType);
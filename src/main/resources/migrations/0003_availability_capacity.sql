@@ -0,0 +1,7 @@
+-- The appointments a caregiver still takes on a date. reserve takes one from the slot, a full slot stays with
+-- a capacity of 0 so the date isn't uploaded again. The caregivers of a date are allocated by the most remaining
+-- capacity, then the least booked, see the Booked column of Caregivers.
+ALTER TABLE Availabilities ADD Capacity INT NOT NULL DEFAULT 1;
+GO
+
+CREATE INDEX IX_Availabilities_Time_Capacity ON Availabilities (Time, Capacity DESC, Username);
@@ -0,0 +1,498 @@
+import os
+import sys
+import csv
+import json
+import time
+import random
+import argparse
+import datetime
+import threading
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+import Scheduler
+from model.Patient import Patient
+from model.Caregiver import Caregiver
+from model.Appointment import Appointment
+from util.Util import Util
+from util.Session import Session
+from util.OutputCapture import capture_output
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError
+from db.Migrations import Migrations
+from util.HashService import HashService
+
+
+'''
+Replays reproducible mixes of scheduler commands against a freshly seeded database and reports, per command:
+throughput, p50/p95/p99 latency and database round trips.
+Usage, from src/main/scheduler:
+    BACKEND=sqlite python Benchmark.py                        # run every workload
+    BACKEND=sqlite python Benchmark.py reservation_storm      # run some of them
+    BACKEND=sqlite python Benchmark.py --save                 # write the baseline
+    BACKEND=sqlite python Benchmark.py --compare              # fail when a command regressed against it
+    BACKEND=sqlite python Benchmark.py appointment_readers --schema-version 0   # without the covering indexes
+    BACKEND=sqlite python Benchmark.py --rows 100000          # memory and time of the row representations
+Overview:
+    * The seed and the operations only depend on --seed and the sizes, two runs replay the same commands.
+    * Seeded users share one password and skip the login command, so workloads measure the commands they are
+    about and not PBKDF2, except for the registrations which hash with the HASHITERATIONS cost.
+    * A round trip is a statement sent through a database cursor, executemany counts one per row since
+    pymssql runs them one by one. The reserve batch of the MSSQL backend is a single round trip.
+    * The workloads run one after the other on the same database, in the order they are given.
+    * Reservations need the Capacity column of the migration 0003, run the other workloads to compare older
+    schema versions.
+    * A p95 latency is a regression when it's worse than the baseline by more than --tolerance and by more than
+    --floor milliseconds, the sub millisecond commands jitter by more than the tolerance from run to run.
+'''
+
+CONST_BASELINE_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "resources", "benchmarks", "baseline.json"
+)
+CONST_SEED_PASSWORD = "Bench!Passw0rd"
+CONST_FIRST_DATE = datetime.date(2030, 1, 1)
+CONST_VACCINES = ("pfizer", "moderna", "janssen")
+
+
+class RoundTrips:
+    """
+        Counts the statements every thread sends to the database, by wrapping the cursors of the backend.
+    """
+
+    Local = threading.local()
+
+    class Cursor:
+
+        def __init__(self, cursor):
+            self.cursor = cursor
+
+        def execute(self, sql, params=None):
+            RoundTrips.add(1)
+            return self.cursor.execute(sql, params)
+
+        def executemany(self, sql, seq_of_params):
+            seq_of_params = list(seq_of_params)
+            RoundTrips.add(len(seq_of_params))
+            return self.cursor.executemany(sql, seq_of_params)
+
+        def __iter__(self):
+            return iter(self.cursor)
+
+        def __getattr__(self, name):
+            return getattr(self.cursor, name)
+
+    @staticmethod
+    def install():
+        Backend = ConnectionManager.get_backend()
+        if getattr(Backend, "RoundTripsInstalled", False):
+            return None
+        Original = Backend.cursor
+        Backend.cursor = lambda conn, as_dict=False: RoundTrips.Cursor(Original(conn, as_dict=as_dict))
+        Backend.RoundTripsInstalled = True
+        return None
+
+    @staticmethod
+    def add(count):
+        RoundTrips.Local.count = RoundTrips.count() + count
+        return None
+
+    @staticmethod
+    def count():
+        return getattr(RoundTrips.Local, "count", 0)
+
+
+class Seed:
+    """
+        The users, slots, vaccines and appointments a benchmark starts from.
+    """
+
+    def __init__(self, caregivers, patients, days, appointments, doses, rng, popular_capacity=1):
+        self.caregivers = [f"bench_caregiver_{i}" for i in range(caregivers)]
+        self.patients = [f"bench_patient_{i}" for i in range(patients)]
+        self.dates = [CONST_FIRST_DATE + datetime.timedelta(days=i) for i in range(days)]
+        self.popular_date = self.dates[0]
+        self.popular_capacity = popular_capacity  # of every slot of the popular date.
+        self.vaccines = list(CONST_VACCINES)
+        self.appointments = appointments
+        self.doses = doses
+        self.rng = rng
+
+    @staticmethod
+    def applied(version):
+        """
+            Whether the migration of a version is applied to the schema the benchmark runs on.
+        """
+        Target = Migrations.target()
+        return Target is None or Target >= version
+
+    def load(self):
+        """
+            Insert the seed in one transaction, straight into the tables. The columns are the ones of the schema
+            version: Iterations and Booked come with the migration 0000, Capacity with 0003.
+        """
+        Salt = Util.generate_salt()
+        Hash = Util.generate_hash(CONST_SEED_PASSWORD, Salt)
+        Booked = {name: 0 for name in self.caregivers}
+        Appointments = []
+        for patient in self.patients:
+            for _ in range(self.appointments):
+                caregiver = self.rng.choice(self.caregivers)
+                Booked[caregiver] += 1
+                Appointments.append(
+                    (patient, caregiver, str(self.rng.choice(self.dates[1:] or self.dates)),
+                     self.rng.choice(self.vaccines))
+                )
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = cm.cursor()
+        try:
+            if Seed.applied(0):
+                cursor.executemany(
+                    "INSERT INTO Caregivers (Username, Salt, Hash, Iterations, Booked) VALUES (%s, %s, %s, %d, %d)",
+                    [(name, Salt, Hash, Util.HashIterations, Booked[name]) for name in self.caregivers]
+                )
+                cursor.executemany(
+                    "INSERT INTO Patients (Username, Salt, Hash, Iterations) VALUES (%s, %s, %s, %d)",
+                    [(name, Salt, Hash, Util.HashIterations) for name in self.patients]
+                )
+            else:
+                cursor.executemany(
+                    "INSERT INTO Caregivers (Username, Salt, Hash) VALUES (%s, %s, %s)",
+                    [(name, Salt, Hash) for name in self.caregivers]
+                )
+                cursor.executemany(
+                    "INSERT INTO Patients (Username, Salt, Hash) VALUES (%s, %s, %s)",
+                    [(name, Salt, Hash) for name in self.patients]
+                )
+            cursor.executemany(
+                "INSERT INTO Availabilities (Time, Username) VALUES (%s, %s)",
+                [(str(d), name) for d in self.dates[1:] for name in self.caregivers]
+            )
+            if Seed.applied(3):
+                cursor.executemany(
+                    "INSERT INTO Availabilities (Time, Username, Capacity) VALUES (%s, %s, %d)",
+                    [(str(self.popular_date), name, self.popular_capacity) for name in self.caregivers]
+                )
+            else:
+                cursor.executemany(
+                    "INSERT INTO Availabilities (Time, Username) VALUES (%s, %s)",
+                    [(str(self.popular_date), name) for name in self.caregivers]
+                )
+            cursor.executemany(
+                "INSERT INTO Vaccines (Name, Doses) VALUES (%s, %d)",
+                [(name, self.doses) for name in self.vaccines]
+            )
+            cursor.executemany(
+                "INSERT INTO Appointments (PatientName, CareGiverName, AppointmentDate, VaccineType) "
+                "VALUES (%s, %s, %s, %s)",
+                Appointments
+            )
+            conn.commit()
+        finally:
+            cm.close_connection()
+        return None
+
+    def patient_session(self, name=None):
+        session = Session()
+        session.patient = Patient(self.rng.choice(self.patients) if name is None else name)
+        return session
+
+    def caregiver_session(self, name=None):
+        session = Session()
+        session.caregiver = Caregiver(self.rng.choice(self.caregivers) if name is None else name)
+        return session
+
+
+def registration_burst(seed, operations):
+    """
+        New patients and caregivers signing up at once, bound by the password hashing.
+    """
+    Ops = []
+    for i in range(operations):
+        command = "create_patient" if seed.rng.random() < 0.8 else "create_caregiver"
+        Ops.append(([command, f"bench_new_{i}", CONST_SEED_PASSWORD], Session()))
+    return Ops
+
+
+def reservation_storm(seed, operations):
+    """
+        Patients racing for the slots of one popular date, some of them searching it first. The slots of the
+        date are sized by popular_capacity() so every reservation books one, the storm measures reserve and not
+        the answer to a full date.
+    """
+    Ops = []
+    for _ in range(operations):
+        session = seed.patient_session()
+        if seed.rng.random() < 0.2:
+            Ops.append((["search_caregiver_schedule", str(seed.popular_date)], session))
+        else:
+            Ops.append((["reserve", seed.rng.choice(seed.vaccines), str(seed.popular_date)], session))
+    return Ops
+
+
+def popular_capacity(caregivers, operations):
+    """
+        The capacity of the slots of the popular date, for a storm of operations to find one left for every
+        reservation.
+    """
+    return max(1, -(-operations // max(1, caregivers)))
+
+
+def appointment_readers(seed, operations):
+    """
+        Patients and caregivers listing their appointments, mostly patients.
+    """
+    Ops = []
+    for _ in range(operations):
+        session = seed.patient_session() if seed.rng.random() < 0.8 else seed.caregiver_session()
+        Ops.append((["show_appointments"], session))
+    return Ops
+
+
+# The workloads, by name. A workload gets the seed and a number of operations and returns (tokens, session) pairs.
+WORKLOADS = {
+    "registration_burst": (registration_burst, 200),
+    "reservation_storm": (reservation_storm, 2000),
+    "appointment_readers": (appointment_readers, 2000),
+}
+
+
+def percentile(values, p):
+    """
+        Nearest rank percentile of sorted values.
+    """
+    if len(values) == 0:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(p/100*len(values) + 0.5)) - 1))]
+
+
+def run_operation(operation):
+    tokens, session = operation
+    Before = RoundTrips.count()
+    Start = time.perf_counter()
+    with capture_output():
+        try:
+            Scheduler.COMMANDS[tokens[0]](tokens, session)
+        except DatabaseError:
+            pass  # reported by the handler, the operation is still timed.
+    return tokens[0], time.perf_counter() - Start, RoundTrips.count() - Before
+
+
+def run_workload(name, ops, threads):
+    """
+        Run the operations of a workload, return its report:
+            {"elapsed_s", "operations_per_s", "commands": {command: {"count", "p50_ms", ...}}}
+    """
+    Start = time.perf_counter()
+    if threads <= 1:
+        Results = [run_operation(op) for op in ops]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            Results = list(executor.map(run_operation, ops))
+    Elapsed = time.perf_counter() - Start
+    Commands = {}
+    for command, latency, trips in Results:
+        Latencies, Trips = Commands.setdefault(command, ([], []))
+        Latencies.append(latency*1000)
+        Trips.append(trips)
+    Report = {
+        "elapsed_s": round(Elapsed, 3),
+        "operations_per_s": round(len(ops)/Elapsed, 1) if Elapsed > 0 else None,
+        "commands": {}
+    }
+    for command, (Latencies, Trips) in sorted(Commands.items()):
+        Latencies.sort()
+        Report["commands"][command] = {
+            "count": len(Latencies),
+            "p50_ms": round(percentile(Latencies, 50), 3),
+            "p95_ms": round(percentile(Latencies, 95), 3),
+            "p99_ms": round(percentile(Latencies, 99), 3),
+            "round_trips": round(sum(Trips)/len(Trips), 2)
+        }
+    return Report
+
+
+def print_report(results):
+    print(f"{'workload':<22}{'command':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'trips':>8}")
+    for workload, Report in results.items():
+        for command, Stats in Report["commands"].items():
+            print(f"{workload:<22}{command:<28}{Stats['count']:>7}{Stats['p50_ms']:>10.3f}"
+                  f"{Stats['p95_ms']:>10.3f}{Stats['p99_ms']:>10.3f}{Stats['round_trips']:>8.2f}")
+        print(f"{workload:<22}{'(throughput)':<28}{Report['operations_per_s']:>7} ops/s")
+    return None
+
+
+def compare(results, baseline, tolerance, floor=1.0):
+    """
+        List the regressions against a baseline: a p95 latency worse by more than tolerance and by more than floor
+        milliseconds, or any extra round trip.
+    """
+    Regressions = []
+    for workload, Report in results.items():
+        for command, Stats in Report["commands"].items():
+            Base = baseline.get("results", {}).get(workload, {}).get("commands", {}).get(command)
+            if Base is None:
+                continue
+            if Stats["p95_ms"] > Base["p95_ms"]*(1 + tolerance) and Stats["p95_ms"] - Base["p95_ms"] > floor:
+                Regressions.append(f"{workload}/{command}: p95 {Base['p95_ms']}ms -> {Stats['p95_ms']}ms")
+            if Stats["round_trips"] > Base["round_trips"]:
+                Regressions.append(
+                    f"{workload}/{command}: round trips {Base['round_trips']} -> {Stats['round_trips']}"
+                )
+    return Regressions
+
+
+def list_dict_rows(caregiver):
+    cm = ConnectionManager()
+    with cm as cursor:
+        cursor.execute(Appointment.SelectAppointmentsForCaregiver + Appointment.OrderById, (caregiver, ))
+        return list(cursor)
+
+
+def list_record_rows(caregiver):
+    return list(Appointment.stream(Appointment.SelectAppointmentsForCaregiver, caregiver))
+
+
+def export_record_rows(caregiver):
+    with open(os.devnull, "w", newline="") as f:
+        Writer = csv.writer(f)
+        for row in Appointment.stream(Appointment.SelectAppointmentsForCaregiver, caregiver):
+            Writer.writerow(row)
+    return None
+
+
+# What a history of appointments costs in memory, by the way its rows are represented and consumed.
+ROW_REPRESENTATIONS = {
+    "dict rows, listed": list_dict_rows,
+    "AppointmentRow, listed": list_record_rows,
+    "AppointmentRow, streamed to csv": export_record_rows,
+}
+
+
+def row_representations(seed, count):
+    """
+        Give the first caregiver count more appointments and read them back with every representation.
+        Return:
+            {representation: {"rows", "elapsed_ms", "peak_kb"}}, the peak is the memory traced while reading.
+    """
+    Caregiver = seed.caregivers[0]
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    cursor = cm.cursor()
+    try:
+        cursor.executemany(
+            "INSERT INTO Appointments (PatientName, CareGiverName, AppointmentDate, VaccineType) "
+            "VALUES (%s, %s, %s, %s)",
+            [(seed.rng.choice(seed.patients), Caregiver, str(seed.rng.choice(seed.dates)),
+              seed.rng.choice(seed.vaccines)) for _ in range(count)]
+        )
+        conn.commit()
+    finally:
+        cm.close_connection()
+    Report = {}
+    for name, Read in ROW_REPRESENTATIONS.items():
+        Read(Caregiver)  # warm up the pool and the statement caches.
+        Start = time.perf_counter()
+        Rows = Read(Caregiver)
+        Elapsed = time.perf_counter() - Start
+        del Rows
+        tracemalloc.start()
+        Read(Caregiver)
+        _, Peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        Report[name] = {"elapsed_ms": round(Elapsed*1000, 1), "peak_kb": round(Peak/1024)}
+    print(f"{'representation':<36}{'ms':>10}{'peak KB':>12}")
+    for name, Stats in Report.items():
+        print(f"{name:<36}{Stats['elapsed_ms']:>10.1f}{Stats['peak_kb']:>12}")
+    return Report
+
+
+def main(argv=None):
+    Parser = argparse.ArgumentParser(description="Benchmark the scheduler commands on a seeded database.")
+    Parser.add_argument("workloads", nargs="*", metavar="WORKLOAD",
+                        help=f"workloads to run, all of them by default: {', '.join(WORKLOADS)}.")
+    Parser.add_argument("--seed", type=int, default=414)
+    Parser.add_argument("--caregivers", type=int, default=200)
+    Parser.add_argument("--patients", type=int, default=2000)
+    Parser.add_argument("--days", type=int, default=30)
+    Parser.add_argument("--appointments", type=int, default=3, help="seeded appointments per patient.")
+    Parser.add_argument("--doses", type=int, default=1000000, help="seeded doses per vaccine.")
+    Parser.add_argument("--operations", type=int, default=None,
+                        help="operations per workload, each workload has its own default.")
+    Parser.add_argument("--schema-version", type=int, default=None,
+                        help="apply the migrations up to this version only, all of them by default.")
+    Parser.add_argument("--rows", type=int, default=None,
+                        help="measure the row representations over this many appointments, instead of the workloads.")
+    Parser.add_argument("--threads", type=int, default=1, help="clients running the operations at once.")
+    Parser.add_argument("--save", nargs="?", const=CONST_BASELINE_PATH, metavar="FILE",
+                        help="write the results as the baseline.")
+    Parser.add_argument("--compare", nargs="?", const=CONST_BASELINE_PATH, metavar="FILE",
+                        help="compare the results with a baseline, exit with 1 on regressions.")
+    Parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="allowed p95 slow down against the baseline, as a fraction.")
+    Parser.add_argument("--floor", type=float, default=1.0,
+                        help="p95 slow downs of at most this many milliseconds are never a regression.")
+    Args = Parser.parse_args(argv)
+    for name in Args.workloads:
+        if name not in WORKLOADS:
+            Parser.error(f"unknown workload: {name}")
+
+    if Args.schema_version is not None:
+        os.environ["SCHEMAVERSION"] = str(Args.schema_version)  # read when the backend loads the schema.
+    rng = random.Random(Args.seed)
+    Capacity = 1
+    if "reservation_storm" in (Args.workloads or WORKLOADS) and Args.rows is None:
+        Capacity = popular_capacity(Args.caregivers, Args.operations or WORKLOADS["reservation_storm"][1])
+    TheSeed = Seed(Args.caregivers, Args.patients, Args.days, Args.appointments, Args.doses, rng, Capacity)
+    TheSeed.load()
+    if Args.rows is not None:
+        TheSeed.rng = random.Random(f"{Args.seed}/rows")
+        row_representations(TheSeed, Args.rows)
+        ConnectionManager.close_pool()
+        return 0
+    RoundTrips.install()
+    Results = {}
+    for name in Args.workloads or list(WORKLOADS):
+        Workload, Operations = WORKLOADS[name]
+        # every workload draws from its own generator, so it replays the same operations whatever runs before it.
+        TheSeed.rng = random.Random(f"{Args.seed}/{name}")
+        Ops = Workload(TheSeed, Args.operations or Operations)
+        Results[name] = run_workload(name, Ops, Args.threads)
+    ConnectionManager.close_pool()
+    HashService.shutdown()
+    print_report(Results)
+
+    Config = {
+        "backend": ConnectionManager.get_backend().Name,
+        "hash_iterations": Util.HashIterations,
+        "threads": Args.threads,
+        "schema_version": Args.schema_version,
+        "seed": Args.seed,
+        "caregivers": Args.caregivers,
+        "patients": Args.patients,
+        "days": Args.days,
+        "appointments": Args.appointments,
+        "operations": Args.operations,
+    }
+    if Args.save is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(Args.save)), exist_ok=True)
+        with open(Args.save, "w") as f:
+            json.dump({"config": Config, "results": Results}, f, indent=2)
+            f.write("\n")
+        print(f"Baseline saved to {Args.save}")
+    if Args.compare is not None:
+        with open(Args.compare) as f:
+            Baseline = json.load(f)
+        if Baseline.get("config") != Config:
+            print(f"Warning: the baseline ran with a different configuration: {Baseline.get('config')}")
+        Regressions = compare(Results, Baseline, Args.tolerance, Args.floor)
+        for regression in Regressions:
+            print(f"REGRESSION {regression}")
+        if Regressions:
+            return 1
+        print("No regression against the baseline. ")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
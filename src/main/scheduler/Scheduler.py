@@ -1,27 +1,66 @@
 import re
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import functools
 
 from model.Vaccine import Vaccine
 from model.Caregiver import Caregiver
 from model.Patient import Patient
 from model.Appointment import Appointment
+from model.VaccineCatalog import VaccineCatalog
+from model.Waitlist import Waitlist
+from model.SlotIndex import SlotIndex
 from util.Util import Util
+from util.HashService import HashService
+from util.Cache import TTLCache
+from util.Session import Session
+from util.LoginTokens import LoginTokens
+from util.OutputCapture import capture_output
+from util.Metrics import Metrics
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.SlowQueryLog import SlowQueryLog
+from db.Queries import Queries
 import datetime
 
 
 '''
-objects to keep track of the currently logged-in user
-Note: it is always true that at most one of currentCaregiver and currentPatient is not null
-        since only one user can be logged-in at a time
+Every command handler takes the tokens of the command and the Session of the user running it, which keeps track
+of the currently logged-in user. Handlers don't share any login state, so the commands of different sessions can
+run in parallel threads.
 '''
-CURRENT_PATIENT = None
-CURRENT_CAREGIVER = None
 
 # Used SQL Dry Statements.
-CONST_SELECT_CAREGIVER_USERNAME = "SELECT * FROM Caregivers WHERE Username = %s"
-CONST_GET_ALL_VACCINE = "SELECT * FROM Vaccines"
-CONST_SELECT_CAREGIVER_AVAILABLE_FOR_DATE = "SELECT * FROM Availabilities WHERE Time = %s"
+CONST_SELECT_CAREGIVER_USERNAME = Queries.register(
+    "caregiver.exists", "SELECT * FROM Caregivers WHERE Username = %s", types=("VARCHAR(255)", ))
+CONST_SELECT_CAREGIVER_AVAILABLE_FOR_DATE = Queries.register(
+    "schedule.caregivers", "SELECT * FROM Availabilities WHERE Time = %s AND Capacity > 0", types=("DATE", ))
+CONST_COUNT_CAREGIVERS_AVAILABLE_BY_DATE = Queries.register(
+    "schedule.caregiver_counts",
+    "SELECT Time, COUNT(*) AS Caregivers FROM Availabilities WHERE Time BETWEEN %s AND %s AND Capacity > 0 " +
+    "GROUP BY Time",
+    types=("DATE", "DATE"))
+
+# The longest date range search_caregiver_schedule accepts, in days.
+CONST_SEARCH_MAX_DAYS = 366
+# The longest date range upload_availability accepts, in days, a range is written in one transaction.
+CONST_UPLOAD_MAX_DAYS = 366
+# Width of the longest bar of the search heatmap.
+CONST_HEATMAP_WIDTH = 40
+
+# Rows of the csv file checked, hashed and inserted together by import_users.
+CONST_IMPORT_BATCH_SIZE = 500
+
+# Caregivers found by search_caregiver_schedule, keyed by ("caregivers", date).
+# Entries are dropped by the commands that change them: upload_availability and reserve.
+SCHEDULE_CACHE = TTLCache(
+    maxsize=int(os.getenv("SCHEDULECACHESIZE", "256")),
+    ttl=float(os.getenv("SCHEDULECACHETTL", "30"))
+)
 
 
 class bcolors:  # Enum for text warning.
@@ -42,7 +81,7 @@ def warn(message, exception):
         print(f"{bcolors.WARNING}{exception}{bcolors.ENDC}")
     pass
 
-def create_patient(tokens):
+def create_patient(tokens, session):
     """
         Handles the command of creating a new patient in the database,
         given the name and password for the patient.
@@ -65,19 +104,18 @@ def create_patient(tokens):
         hash = Util.generate_hash(password, salt)
         ThePatient.salt, ThePatient.hash = salt, hash
         ThePatient.save_to_db()
-    except pymssql.Error as dbe:
+    except DatabaseError as dbe:
         warn("Unable to save created patient to the database. ", dbe)
         return None
     except Exception as e:
         # traceback.print_exc()
-        print(e)
-        warn("Exception occurred while saving the account created. ")
+        warn("Exception occurred while saving the account created. ", e)
         return None
     print(" *** Patient's Account Registered. ***")
     return
 
 
-def create_caregiver(tokens):
+def create_caregiver(tokens, session):
     """
         Static method that create a caregiver instance to the care_giver table.
     """
@@ -102,10 +140,9 @@ def create_caregiver(tokens):
     # save to caregiver information to our database
     try:
         caregiver.save_to_db()
-    except pymssql.Error as e:
+    except DatabaseError as e:
         warn("Create caregiver failed, Cannot save", e)
-        quit()
-        return None
+        raise
     except Exception as e:
         print("Error:", e)
         return None
@@ -117,16 +154,15 @@ def username_exists_caregiver(username):
     conn = cm.create_connection()
     select_username = CONST_SELECT_CAREGIVER_USERNAME
     try:
-        cursor = conn.cursor(as_dict=True)
+        cursor = cm.cursor(as_dict=True)
         cursor.execute(select_username, username)
         #  returns false if the cursor is not before the first record or if there are no rows in the ResultSet.
         for row in cursor:
             return row['Username'] is not None
-    except pymssql.Error as e:
+    except DatabaseError as e:
         print("Error occurred when checking username")
         print("Db-Error:", e)
-        quit()
-        return None
+        raise
     except Exception as e:
         print("Error:", e)
         return None
@@ -135,30 +171,134 @@ def username_exists_caregiver(username):
     return False
 
 
-def login_patient(tokens):
+def import_users(tokens, session):
+    """
+        Register the patients and caregivers listed in a csv file, accept tokens of the format:
+        import_users <csv>
+        * Each row is: patient|caregiver, username, password. A header row starting with "role" is skipped.
+        * The file is streamed in batches, each batch is checked with one query per role, hashed in parallel
+        and inserted with one batched insert per role.
+        * Rows that fail are reported with their line number, they don't stop the rest of the file.
+    """
+    if len(tokens) != 2:
+        print(f"Tokenization failed, expect 2 tokens: import_users <csv>, but got: {tokens}")
+        return None
+    Added, Failed = 0, 0
+    try:
+        with open(tokens[1], newline="") as f:
+            Reader = csv.reader(f)
+            Batch = []
+            for row in Reader:
+                if len(row) == 0 or (Reader.line_num == 1 and row[0].strip().lower() == "role"):
+                    continue
+                Batch.append((Reader.line_num, row))
+                if len(Batch) == CONST_IMPORT_BATCH_SIZE:
+                    BatchAdded, BatchFailed = import_users_batch(Batch)
+                    Added, Failed, Batch = Added + BatchAdded, Failed + BatchFailed, []
+            BatchAdded, BatchFailed = import_users_batch(Batch)
+            Added, Failed = Added + BatchAdded, Failed + BatchFailed
+    except OSError as e:
+        warn(f"Unable to read the file: {tokens[1]}", e)
+        return None
+    except DatabaseError as e:
+        warn("A database error occurred while importing the users. ", e)
+        raise
+    print(f" *** Imported {Added} account(s), {Failed} row(s) failed. ***")
+    return None
+
+
+def import_users_batch(batch):
+    """
+        Check, hash and save one batch of the rows of import_users.
+        Return:
+            The number of accounts created, and the number of rows that failed.
+        Exception:
+            The caller handles database errors.
+    """
+    Models = {"patient": Patient, "caregiver": Caregiver}
+    Accepted = {"patient": {}, "caregiver": {}}  # username -> (line, password), per role.
+    Failed = 0
+    for line, row in batch:
+        if len(row) != 3:
+            print(f"Row {line}: expect 3 fields: role, username, password, but got {len(row)}. ")
+            Failed += 1
+            continue
+        role, username, password = row[0].strip().lower(), row[1].strip(), row[2]
+        if role not in Models:
+            print(f"Row {line}: unknown role \"{role}\", expect patient or caregiver. ")
+            Failed += 1
+            continue
+        Problem = Util.CheckIfGoodPassword(password)
+        if Problem is not None:
+            print(f"Row {line}: {Problem}")
+            Failed += 1
+            continue
+        if username in Accepted[role]:
+            print(f"Row {line}: username \"{username}\" is repeated in the file. ")
+            Failed += 1
+            continue
+        Accepted[role][username] = (line, password)
+
+    Added = 0
+    for role, Rows in Accepted.items():
+        for username in Models[role].existing_usernames(Rows.keys()):
+            print(f"Row {Rows[username][0]}: username \"{username}\" already exists. ")
+            Failed += 1
+            del Rows[username]
+        if len(Rows) == 0:
+            continue
+        Usernames = list(Rows.keys())
+        Salts = [Util.generate_salt() for _ in Usernames]
+        Hashes = HashService.hash_many([Rows[username][1] for username in Usernames], Salts)
+        Users = [Models[role](username, salt=salt, hash=hash) for username, salt, hash in zip(Usernames, Salts, Hashes)]
+        try:
+            Models[role].save_many_to_db(Users)
+            Added += len(Users)
+        except DatabaseError:
+            # Someone else registered one of the usernames in the meantime, find out which one row by row.
+            for User in Users:
+                try:
+                    User.save_to_db()
+                    Added += 1
+                except DatabaseError as e:
+                    print(f"Row {Rows[User.username][0]}: unable to save \"{User.username}\": {e}")
+                    Failed += 1
+    return Added, Failed
+
+
+def login_patient(tokens, session):
     """
         accept tokens of the format:
         login_patient <username> <password>
     """
-    global CURRENT_PATIENT
-    if not(CURRENT_PATIENT is None and CURRENT_PATIENT is None):
-        if CURRENT_PATIENT is not None:
-            print(f"Can't login because {CURRENT_PATIENT} is currently logged in. Please logout first.")
+    if session.LoggedIn:
+        if session.patient is not None:
+            print(f"Can't login because {session.patient} is currently logged in. Please logout first.")
         else:
-            print(f"Can't login because {CURRENT_CAREGIVER} is currently logged in. Please logout first.")
+            print(f"Can't login because {session.caregiver} is currently logged in. Please logout first.")
         return None
 
     if len(tokens) != 3:
         print(f"Tokenization failed, expect 3 tokens from the command input, but gotten: \n{tokens}")
+        return None
     username, password = tokens[1], tokens[2]
     try:   # try logging in and store the session for the login.
-        ThePatient = Patient(username, password=password).get()
+        # a login verified a moment ago skips the database and the hash.
+        Token = LoginTokens.check("patient", username, password)
+        if Token is None:
+            ThePatient = Patient(username, password=password).get()
+            if ThePatient is None:
+                print("Error occurred when logging in. Please try again!")
+                return None
+            Token = LoginTokens.issue("patient", username, password)
+        else:
+            ThePatient = Patient(username, password=password)
         print(f"Current login patient: {username}")
-        CURRENT_PATIENT = ThePatient
-    except pymssql.Error as e:
+        session.patient = ThePatient
+        session.login_token = Token
+    except DatabaseError as e:
         warn("An database error occurred when trying to login the patient. ", e)
-        quit()
-        return None
+        raise
     except Exception as e:
         # traceback.print_exc()
         warn("Another non database error has occurred while processing the login of the patient. ", e)
@@ -166,13 +306,12 @@ def login_patient(tokens):
     return None
 
 
-def login_caregiver(tokens):
+def login_caregiver(tokens, session):
     """
         login_caregiver <username> <password>
     """
     # check 1: if someone's (caregiver or patient or whoever) already logged-in, they need to log out first
-    global CURRENT_CAREGIVER
-    if CURRENT_CAREGIVER is not None or CURRENT_PATIENT is not None:
+    if session.caregiver is not None or session.patient is not None:
         print("Already logged-in!")
         return
     # check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
@@ -181,14 +320,18 @@ def login_caregiver(tokens):
         return
     username = tokens[1]
     password = tokens[2]
-    caregiver = None
+    caregiver, Token = None, LoginTokens.check("caregiver", username, password)
     try:
-        caregiver = Caregiver(username, password=password).get()
-    except pymssql.Error as e:
+        if Token is not None:  # a login verified a moment ago skips the database and the hash.
+            caregiver = Caregiver(username, password=password)
+        else:
+            caregiver = Caregiver(username, password=password).get()
+            if caregiver is not None:
+                Token = LoginTokens.issue("caregiver", username, password)
+    except DatabaseError as e:
         print("Login caregiver failed")
         print("Db-Error:", e)
-        quit()
-        return None
+        raise
     except Exception as e:
         print("Error occurred when logging in. Please try again!")
         print("Error:", e)
@@ -198,152 +341,364 @@ def login_caregiver(tokens):
         print("Error occurred when logging in. Please try again!")
     else:
         print("Caregiver logged in as: " + username)
-        CURRENT_CAREGIVER = caregiver
+        session.caregiver = caregiver
+        session.login_token = Token
 
 
-def search_caregiver_schedule(tokens):
+def show_login_token(tokens, session):
     """
-        Directly communicates with the database and pull out all the available caregivers for the given
-        date.
-        * Output the username for the caregivers that are available for the date.
-        * along with the number of available doses left for each vaccine.
+        Print the login token of the session, resume_login takes it to log in another session until it expires
+        or the user logs out. It's a bearer credential, it's only printed when asked for.
     """
+    if session.login_token is None:
+        print("Please login first!")
+        return None
+    print(f"Login token: {session.login_token}")
+    return None
+
 
+def resume_login(tokens, session):
+    """
+        Log in with the token printed by show_login_token, without the password.
+        resume_login <token>
+        * The token is checked against its signature and the verified logins, no query and no hash.
+    """
+    if session.LoggedIn:
+        print("Already logged-in!")
+        return None
     if len(tokens) != 2:
-        print(f"Tokenization failed, except 2 tokens but we got: {tokens}")
+        print("Please try again!")
+        return None
+    Login = LoginTokens.verify(tokens[1])
+    if Login is None:
+        print("The login token is invalid or has expired. Please login again!")
         return None
-    date = tokens[1]
-    if len(re.findall(r"\d{4}-\d{1,2}-\d{1,2}", date)) != 1:
-        print(f"Don't give that, date should be in the formate of YYYY-MM-DD, but I got: {date}")
+    role, username = Login
+    if role == "patient":
+        session.patient = Patient(username)
+        print(f"Current login patient: {username}")
+    else:
+        session.caregiver = Caregiver(username)
+        print("Caregiver logged in as: " + username)
+    session.login_token = tokens[1]
+    return None
+
+
+def search_caregiver_schedule(tokens, session):
+    """
+        Pull out all the available caregivers for the given date.
+        * Output the username for the caregivers that are available for the date.
+        * along with the number of available doses left for each vaccine.
+        * The caregivers are read through SCHEDULE_CACHE and the vaccines come from the VaccineCatalog, repeated
+        searches don't touch the database.
+        * search_caregiver_schedule <from> <to> shows the number of free caregivers of every date of the range
+        instead, as a heatmap, counted by a single query.
+    """
+
+    if len(tokens) not in (2, 3):
+        print(f"Tokenization failed, except 2 or 3 tokens but we got: {tokens}")
         return None
-    if CURRENT_CAREGIVER is None and CURRENT_PATIENT is None:
+    for date in tokens[1:]:
+        if len(re.findall(r"\d{4}-\d{1,2}-\d{1,2}", date)) != 1:
+            print(f"Don't give that, date should be in the formate of YYYY-MM-DD, but I got: {date}")
+            return None
+    if session.caregiver is None and session.patient is None:
         print("You haven't login, please login to retrieve schedule info. ")
         return None
-    if not Util.CheckDateCorrect(date):
+    Days = [Util.ParseDate(date) for date in tokens[1:]]
+    if None in Days:
         print("The date you pass in is not a valid date to search for. ")
-    cm = ConnectionManager()
+        return None
+    if len(Days) == 2:
+        return search_caregiver_schedule_range(Days[0], Days[1])
+    date, Day = tokens[1], Days[0]
     try:
-        with cm as cursor:
-            cursor.execute(CONST_SELECT_CAREGIVER_AVAILABLE_FOR_DATE, (date, ))
-            print("------------------------------------------")
-            print(f"Caregivers Available for Date: {date}")
-            for row in cursor:
-                print(f"- {row['Username']}")
-            cursor.execute(CONST_GET_ALL_VACCINE)
-            print("------------------------------------------")
-            print("Vaccines         |  Dosages               ")
-            for row in cursor:
-                print(f"{row['Name']}  |  {row['Doses']}")
-    except pymssql.Error as sqle:
+        Caregivers = SCHEDULE_CACHE.get_or_load(("caregivers", Day), lambda: load_caregivers_available(Day))
+        Vaccines = VaccineCatalog.get().all()
+        print("------------------------------------------")
+        print(f"Caregivers Available for Date: {date}")
+        for Username in Caregivers:
+            print(f"- {Username}")
+        print("------------------------------------------")
+        print("Vaccines         |  Dosages               ")
+        for Name, Doses in Vaccines:
+            print(f"{Name}  |  {Doses}")
+    except DatabaseError as sqle:
         warn("SQL database exceptions when getting available schedules. Below is the Error.", sqle)
-        quit()
+        raise
+    except Exception as e:
+        warn("Non SQL database exceptions when getting available schedules.", e)
+        return None
+    return None
+
+
+def search_caregiver_schedule_range(start, end):
+    """
+        Print the number of free caregivers of every date from start to end, and the doses left of the vaccines.
+    """
+    if end < start:
+        print(f"The range ends before it starts: {start} to {end}")
         return None
+    if (end - start).days + 1 > CONST_SEARCH_MAX_DAYS:
+        print(f"Search at most {CONST_SEARCH_MAX_DAYS} days at once. ")
+        return None
+    try:
+        Counts = load_caregiver_counts(start, end)
+        Vaccines = VaccineCatalog.get().all()
+    except DatabaseError as sqle:
+        warn("SQL database exceptions when getting available schedules. Below is the Error.", sqle)
+        raise
     except Exception as e:
         warn("Non SQL database exceptions when getting available schedules.", e)
         return None
+    Most = max(Counts.values(), default=0)
+    print("------------------------------------------")
+    print(f"Caregivers Available from {start} to {end}")
+    Day = start
+    while Day <= end:
+        Count = Counts.get(Day, 0)
+        Bar = "#"*max(1, round(Count/Most*CONST_HEATMAP_WIDTH)) if Count > 0 else "."
+        print(f"{Day} {Util.WeekdayNames[Day.weekday()].capitalize()}  | {Count:>4}  {Bar}")
+        Day += datetime.timedelta(days=1)
+    Open = sorted(Counts)
+    print(f"First open date: {Open[0]}" if Open else "No caregiver is available in the range. ")
+    print("------------------------------------------")
+    print("Vaccines         |  Dosages               ")
+    for Name, Doses in Vaccines:
+        print(f"{Name}  |  {Doses}")
+    return None
+
+
+def load_caregiver_counts(start, end):
+    """
+        Count the free caregivers of the dates from start to end, in one query.
+        Return:
+            A dictionary of the dates with at least one free caregiver to their counts.
+    """
+    cm = ConnectionManager()
+    with cm as cursor:
+        cursor.execute(CONST_COUNT_CAREGIVERS_AVAILABLE_BY_DATE, (start, end))
+        return {Util.ParseDate(str(row['Time'])[:10]): row['Caregivers'] for row in cursor}
+
+
+def load_caregivers_available(day):
+    """
+        Get the usernames of the caregivers available for the date, as a tuple.
+    """
+    cm = ConnectionManager()
+    with cm as cursor:
+        cursor.execute(CONST_SELECT_CAREGIVER_AVAILABLE_FOR_DATE, (day, ))
+        return tuple(row['Username'] for row in cursor)
+
+
+def show_cache_stats(tokens, session):
+    """
+        Print the hit and miss counters of the schedule search cache.
+    """
+    Stats = SCHEDULE_CACHE.stats()
+    print(f"Schedule cache: {Stats['hits']} hits, {Stats['misses']} misses, {Stats['hit_rate']:.1%} hit rate, " +
+          f"{Stats['size']}/{Stats['maxsize']} entries, {Stats['evictions']} evictions.")
     return None
 
 
-def reserve(tokens):
+def reserve(tokens, session):
     """
         1. Patient performs this operation.
-        2. Randomly assign a caregiver that is available at that given Date.
+        2. Assign the caregiver with the most remaining capacity at that given Date, picked by the SlotIndex,
+        one capacity of the slot of the caregiver is taken and one dose of the vaccine is used, all in one
+        transaction.
         3. Output the assigned caregiver and the appointment ID.
-        TODO: Part 2
+        4. With --wait, the patient joins the waitlist when no caregiver or no dose is left, see leave_waitlist.
     """
-    global CURRENT_PATIENT
-    if CURRENT_PATIENT is None:
+    if session.patient is None:
         print("Please login as a patient first. ")
         return None
-    if len(tokens) != 3:
-        print(f"Expect 3 tokens: Commands, Vaccine, date, but we got: {tokens}")
+    Wait = len(tokens) == 4 and tokens[3].lower() == "--wait"
+    if len(tokens) != 3 and not Wait:
+        print(f"Expect 3 tokens: Commands, Vaccine, date, and an optional --wait, but we got: {tokens}")
         return None
     Vac, AppointmentDate = tokens[1], tokens[2]
 
-    # validate appointment.
+    # validate and book the appointment in one transaction.
     try:
-        TheAppointment = Appointment(Vac, AppointmentDate, patient_instance=CURRENT_PATIENT)
-        ValidationResults = TheAppointment.validate_appointment()
-        if ValidationResults is not None:   # appointment validations failed.
-            print(ValidationResults)
+        TheAppointment = Appointment(Vac, AppointmentDate, patient_instance=session.patient)
+        ReservationResults = TheAppointment.reserve(wait=Wait)
+        if ReservationResults is not None:   # appointment validations failed.
+            print(ReservationResults)
             return None
-    except pymssql.Error as sqle:
-        warn("A Database error has occurred when trying to validate the appointment.", sqle)
-        return None
+    except DatabaseError as sqle:
+        warn("A database error has occured while trying to reserve the current appointment. ", sqle)
+        raise
     except Exception as e:
-        warn("A none database has occurred while trying to validate the appointment. ", e)
+        warn("A non database error has occured while trying to reserve the current appointment. ", e)
         return None
+    SCHEDULE_CACHE.invalidate(("caregivers", Util.ParseDate(AppointmentDate)))
+    VaccineCatalog.get().invalidate()
+    print("***** Appointment Added ******")
+    print(f"Appointment ID: {TheAppointment.AppointmentID}, Caregiver: {TheAppointment.CaregiverName}")
+    return None
 
-    # Add appointment:
-    try:
-        TheAppointment.add_appointment()
-    except pymssql.Error as sqle:
-        warn("A database error has occured while trying to add the current appointment. ", sqle)
-        quit()
+
+def leave_waitlist(tokens, session):
+    """
+        1. Patient performs this operation.
+        2. Take the patient off the waitlist of a vaccine on a date, joined with reserve --wait.
+    """
+    if session.patient is None:
+        print("Please login as a patient first. ")
         return None
-    except Exception as e:
-        warn("A non database error has occured while trying to add the current appointment. ", e)
+    if len(tokens) != 3:
+        print(f"Expect 3 tokens: Commands, Vaccine, date, but we got: {tokens}")
         return None
-    print("***** Appointment Added ******")
+    Vac, AppointmentDate = tokens[1], tokens[2]
+    if Util.ParseDate(AppointmentDate) is None:
+        print("Please enter a valid date! ")
+        return None
+    if not Waitlist.enabled():
+        print("The waitlist is not available. ")
+        return None
+    try:
+        Left = Waitlist.leave(session.patient.UserName, Vac, AppointmentDate)
+    except DatabaseError as sqle:
+        warn("A database error has occurred while leaving the waitlist. ", sqle)
+        raise
+    if Left == 0:
+        print(f"You are not on the waitlist for {Vac} on {AppointmentDate}. ")
+        return None
+    print(f"You left the waitlist for {Vac} on {AppointmentDate}. ")
     return None
 
 
-def upload_availability(tokens):
+def upload_availability(tokens, session):
     """
-        Upload the availability for a caregiver who is currently logged in.
+        Upload the availability for a caregiver who is currently logged in, for one date or a range of dates.
+        upload_availability <date>
+        upload_availability <from> <to> [daily|weekdays|weekends|mon,tue,...]
+        Both take an optional --capacity <N> at the end, the number of patients taken on each date, 1 by default.
+        * Dates are in the format of YYYY-MM-DD, the range includes both ends and defaults to daily.
+        * All the dates are written in one transaction, dates already uploaded are skipped. A range spans at most
+        CONST_UPLOAD_MAX_DAYS days.
     """
-    #  upload_availability <date>
     #  check 1: check if the current logged-in user is a caregiver
-    global CURRENT_CAREGIVER
-    if CURRENT_CAREGIVER is None:
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
 
-    # check 2: the length for tokens need to be exactly 2 to include all information (with the operation name)
-    if len(tokens) != 2:
+    Capacity = 1
+    if "--capacity" in tokens:
+        Flags = parse_flags(tokens[tokens.index("--capacity"):], {"capacity": int})
+        if Flags is None:
+            return None
+        Capacity, tokens = Flags["capacity"], tokens[:tokens.index("--capacity")]
+        if Capacity < 1:
+            print(f"The capacity should be at least 1, but we got: {Capacity}")
+            return None
+
+    # check 2: one date, or a range with an optional recurrence rule.
+    if len(tokens) not in (2, 3, 4):
         print("Please try again!")
         return
 
-    date = tokens[1]
-    # assume input is hyphenated in the format mm-dd-yyyy
-    date_tokens = date.split("-")
-    month = int(date_tokens[0])
-    day = int(date_tokens[1])
-    year = int(date_tokens[2])
-    if len(re.findall(r"\d{4}-\d{1,2}-\d{1,2}", date)) != 1:
-        print(f"Don't give that, date should be in the formate of YYYY-MM-DD, but I got: {date}")
+    Start = Util.ParseDate(tokens[1])
+    End = Start if len(tokens) == 2 else Util.ParseDate(tokens[2])
+    if Start is None or End is None:
+        print(f"Don't give that, date should be in the formate of YYYY-MM-DD, but I got: {tokens[1:3]}")
+        return None
+    if (End - Start).days + 1 > CONST_UPLOAD_MAX_DAYS:
+        print(f"Upload at most {CONST_UPLOAD_MAX_DAYS} days at once. ")
         return None
     try:
-        d = datetime.datetime(year, month, day)
-        CURRENT_CAREGIVER.upload_availability(d)
-    except pymssql.Error as e:
+        Dates = Util.ExpandDates(Start, End, tokens[3] if len(tokens) == 4 else "daily")
+        Added = session.caregiver.upload_availabilities(Dates, Capacity)
+    except DatabaseError as e:
         print("Upload Availability Failed")
         print("Db-Error:", e)
-        quit()
-    except ValueError:
-        print("Please enter a valid date!")
+        raise
+    except ValueError as e:
+        print("Please enter a valid date range!")
+        print("Error:", e)
         return
     except Exception as e:
         print("Error occurred when uploading availability")
         print("Error:", e)
         return
-    print("Availability uploaded!")
+    for Day in Dates:
+        SCHEDULE_CACHE.invalidate(("caregivers", Day))
+    SlotIndex.get().invalidate(Dates)
+    print(f"Availability uploaded! {Added} new date(s), {len(Dates) - Added} already uploaded.")
+    if Added > 0:
+        match_waitlist()
 
 
-def cancel(tokens):
+def cancel(tokens, session):
     """
-        TODO: Extra Credit
+        Cancel appointments, the doses go back to the vaccines, all in one transaction.
+        cancel <appointment_id>
+            An appointment of the patient or the caregiver logged in, the slot of the caregiver is available again.
+        cancel --caregiver <name> --date <date>
+            All the appointments of the caregiver logged in on the date, e.g: a sick day. They are not available on
+            the date anymore, their slot is not restored.
     """
+    if not session.LoggedIn:
+        print("Please login first!")
+        return None
+    if len(tokens) == 2:
+        try:
+            AppointmentId = int(tokens[1])
+        except ValueError:
+            print(f"The appointment id should be a number, but we got: {tokens[1]}")
+            return None
+        TheAppointment = Appointment(
+            appointment_id=AppointmentId, patient_instance=session.patient, caregiver_instance=session.caregiver
+        )
+        Cancel = TheAppointment.cancel
+    else:
+        Flags = parse_flags(tokens[1:], {"caregiver": str, "date": Util.ParseDate})
+        if Flags is None:
+            return None
+        if "caregiver" not in Flags or Flags.get("date") is None:
+            print("Expect: cancel <appointment_id> or cancel --caregiver <name> --date <YYYY-MM-DD>")
+            return None
+        if session.caregiver is None or session.caregiver.UserName != Flags["caregiver"]:
+            print("Only the caregiver logged in can cancel their own day. ")
+            return None
+        Cancel = functools.partial(Appointment.cancel_caregiver_day, Flags["caregiver"], Flags["date"])
+    try:
+        Result = Cancel()
+    except DatabaseError as e:
+        warn("A database error has occurred while trying to cancel the appointments. ", e)
+        raise
+    except Exception as e:
+        warn("A non database error has occurred while trying to cancel the appointments. ", e)
+        return None
+    if Result["Cancelled"] == 0 and len(tokens) == 2:
+        print(f"There is no appointment {tokens[1]} of yours to cancel. ")
+        return None
+    # the free caregivers and the doses changed.
+    SCHEDULE_CACHE.clear()
+    if len(tokens) == 2:
+        SlotIndex.get().invalidate(Result["Dates"])
+    else:
+        # a sick day removes the slot of the caregiver even when they had no appointment on it.
+        SlotIndex.get().invalidate([Flags["date"]])
+    VaccineCatalog.get().invalidate()
+    print(f"***** {Result['Cancelled']} Appointment(s) Cancelled ******")
+    for Vaccine, Doses in sorted(Result["Doses"].items()):
+        print(f"{Doses} dose(s) of {Vaccine} returned. ")
+    if Result["Slots"] > 0:
+        print(f"{Result['Slots']} caregiver slot(s) available again. ")
+    if Result["Cancelled"] > 0:
+        match_waitlist()
+    return None
 
 
-    pass
-
-
-def add_doses(tokens):
-    #  add_doses <vaccine> <number>
+def add_doses(tokens, session):
+    """
+        add_doses <vaccine> <number>
+        * The doses are added with one atomic update, the vaccine is created if it's new.
+    """
     #  check 1: check if the current logged-in user is a caregiver
-    global CURRENT_CAREGIVER
-    if CURRENT_CAREGIVER is None:
+    if session.caregiver is None:
         print("Please login as a caregiver first!")
         return
     #  check 2: the length for tokens need to be exactly 3 to include all information (with the operation name)
@@ -351,102 +706,172 @@ def add_doses(tokens):
         print("Please try again!")
         return
     vaccine_name = tokens[1]
-    doses = int(tokens[2])
-    vaccine = None
     try:
-        vaccine = Vaccine(vaccine_name, doses).get()
-    except pymssql.Error as e:
-        print("Failed to get Vaccine information")
+        doses = int(tokens[2])
+        Vaccine(vaccine_name, doses).add_doses()
+    except DatabaseError as e:
+        print("Failed to add doses to Vaccine")
         print("Db-Error:", e)
-        quit()
+        raise
     except Exception as e:
-        print("Failed to get Vaccine information")
+        print("Failed to add doses to Vaccine")
         print("Error:", e)
         return
-    # if the vaccine is not found in the database, add a new (vaccine, doses) entry.
-    # else, update the existing entry by adding the new doses
-    if vaccine is None:
-        vaccine = Vaccine(vaccine_name, doses)
-        try:
-            vaccine.save_to_db()
-        except pymssql.Error as e:
-            print("Failed to add new Vaccine to database")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Failed to add new Vaccine to database")
-            print("Error:", e)
-            return
-    else:
-        # if the vaccine is not null, meaning that the vaccine already exists in our table
-        try:
-            vaccine.increase_available_doses(doses)
-        except pymssql.Error as e:
-            print("Failed to increase available doses for Vaccine")
-            print("Db-Error:", e)
-            quit()
-        except Exception as e:
-            print("Failed to increase available doses for Vaccine")
-            print("Error:", e)
-            return
+    VaccineCatalog.get().invalidate()
     print("Doses updated!")
+    match_waitlist()
+
 
+def match_waitlist():
+    """
+        Book the patients of the waitlist on the capacity just added, and report how many were booked.
+    """
+    try:
+        Result = Waitlist.match()
+    except DatabaseError as e:
+        warn("A database error has occurred while matching the waitlist. ", e)
+        raise
+    Matched = Result["Matched"]
+    if Matched > 0:
+        # the free caregivers and the doses changed.
+        SCHEDULE_CACHE.clear()
+        SlotIndex.get().invalidate(Result["Dates"])
+        VaccineCatalog.get().invalidate()
+    print(f"Waitlist: {Matched} waiting patient(s) booked.")
+    return Matched
 
-def show_appointments(tokens):
+
+def parse_flags(tokens, flags):
+    """
+        Parse the "--name value" pairs of a command.
+        flags:
+            The accepted names, without the dashes, mapped to the function converting their values, e.g: int.
+        Return:
+            A dictionary of the given flags, or None when the tokens are wrong, the error is printed then.
+    """
+    Values = {}
+    if len(tokens) % 2 != 0:
+        print(f"Expect --name value pairs after the command, but we got: {tokens}")
+        return None
+    for name, value in zip(tokens[0::2], tokens[1::2]):
+        Convert = flags.get(name[2:]) if name.startswith("--") else None
+        if Convert is None:
+            print(f"Unknown option: {name}, expect one of: {', '.join('--' + f for f in flags)}")
+            return None
+        try:
+            Values[name[2:]] = Convert(value)
+        except ValueError:
+            print(f"Wrong value for {name}: {value}")
+            return None
+    return Values
+
+
+def show_appointments(tokens, session):
     """
         Show info about appointment only for the current user.
         * If user is a caregiver then:
             you should print the appointment ID, vaccine name, date, and patient name.
         * if the user is a patient then:
             For patients, you should print the appointment ID, vaccine name, date, and caregiver name.
-        TODO: TEST IT.
+        * show_appointments [--after <id>] [--limit <N>] [--order id|date] shows a page: the appointments after
+        the given one. The rows are printed as they come from the database.
     """
-    if CURRENT_PATIENT is None and CURRENT_CAREGIVER is None:
+    if session.patient is None and session.caregiver is None:
         print("Please at least loging as a caregiver, or a patient to executed this command. ")
-    if len(tokens) > 1:
-        print(f"Extra string after the commands are ignored. {tokens[1:]} are ignored. ")
-    App = Appointment(patient_instance=CURRENT_PATIENT, caregiver_instance=CURRENT_CAREGIVER)
-    if CURRENT_CAREGIVER is None:
-        try:
-            Results = App.show_appointments_patient()
-            print("Appointment ID  | Caregiver Name  | Date  | Vaccine")
-            for row in Results:
-                print(f"{row['id']}  | {row['CareGiverName']}  | {row['AppointmentDate']}  | {row['VaccineType']}")
-            return None
-        except pymssql.Error as sqle:
-            warn("A database error occurred while trying to show list of appointment for a patient. ", sqle)
-            quit()
-            return None
-        except Exception as e:
-            warn("A non database error as occured while trying to show a list of appointment for a patient. ", e)
-            return None
+        return None
+    Options = parse_flags(tokens[1:], {"after": int, "limit": int, "order": str.lower})
+    if Options is None:
+        return None
+    if Options.get("limit") is not None and Options["limit"] <= 0:
+        print("The limit must be a positive number. ")
+        return None
+    if Options.setdefault("order", "id") not in ("id", "date"):
+        print(f"Appointments are ordered by id or date, not by: {Options['order']}")
+        return None
+    App = Appointment(patient_instance=session.patient, caregiver_instance=session.caregiver)
+    if session.caregiver is None:
+        Who, Header, Column = "patient", "Appointment ID  | Caregiver Name  | Date  | Vaccine", "CareGiverName"
     else:
-        try:
-            Results = App.show_appointments_caregiver()
-            print("Appointment ID  | Patient Name  | Date   | Vaccine")
-            for row in Results:
-                print(f"{row['id']}  | {row['PatientName']}  | {row['AppointmentDate']}  | {row['VaccineType']}")
-        except pymssql.Error as sqle:
-            warn("A database error occurred while trying to show list of appointment for a caregiver. ", sqle)
-            quit()
-            return None
-        except Exception as e:
-            warn("A non database error as occurred while trying to show a list of appointment for a caregiver. ", e)
-            return None
+        Who, Header, Column = "caregiver", "Appointment ID  | Patient Name  | Date   | Vaccine", "PatientName"
+    try:
+        if session.caregiver is None:
+            Results = App.show_appointments_patient(**Options)
+        else:
+            Results = App.show_appointments_caregiver(**Options)
+        print(Header)
+        Count, LastId = 0, None
+        for row in Results:
+            print(f"{row.Id}  | {getattr(row, Column)}  | {row.AppointmentDate}  | {row.VaccineType}")
+            Count, LastId = Count + 1, row.Id
+    except DatabaseError as sqle:
+        warn(f"A database error occurred while trying to show list of appointment for a {Who}. ", sqle)
+        raise
+    except Exception as e:
+        warn(f"A non database error as occurred while trying to show a list of appointment for a {Who}. ", e)
+        return None
+    if Options.get("limit") is not None and Count == Options["limit"]:
+        print(f"Next page: show_appointments --after {LastId} --limit {Options['limit']} --order {Options['order']}")
+    return None
+
+
+def metrics(tokens, session):
+    """
+        Print the latency histograms recorded so far, see util.Metrics.
+        * metrics [json|prometheus], json by default.
+    """
+    if not Metrics.Enabled:
+        print("Metrics are disabled, set the METRICS Env Var to record them. ")
+        return None
+    Format = tokens[1].lower() if len(tokens) > 1 else "json"
+    if Format not in ("json", "prometheus"):
+        print(f"Unknown format: {tokens[1]}, expect json or prometheus. ")
+        return None
+    print(Metrics.to_json() if Format == "json" else Metrics.to_prometheus(), end="")
+    print()
     return None
 
 
-def logout(tokens):
+def slow_queries(tokens, session):
+    """
+        Print the statements that took the most database time so far, grouped by fingerprint.
+        * slow_queries [limit], the 10 most expensive by default.
+    """
+    if not SlowQueryLog.enabled():
+        print("The slow query log is disabled, set the SLOWQUERYMS Env Var to enable it. ")
+        return None
+    try:
+        Limit = int(tokens[1]) if len(tokens) > 1 else 10
+    except ValueError:
+        print(f"Expect a number of statements, but we got: {tokens[1]}")
+        return None
+    print("Count  | Total ms  | Mean ms  | Max ms  | Slow  | Statement")
+    for row in SlowQueryLog.report(Limit):
+        print(f"{row['count']}  | {row['total_ms']}  | {row['mean_ms']}  | {row['max_ms']}  | {row['slow']}  | "
+              f"{row['fingerprint']}")
+    return None
+
+
+def query_stats(tokens, session):
+    """
+        Print how many times every registered statement ran in this process, see db.Queries.
+    """
+    print("Executions  | Statement")
+    for Name, Executions in Queries.stats():
+        print(f"{Executions}  | {Name}")
+    return None
+
+
+def logout(tokens, session):
     """
         TODO: Part 2
     """
 
-    global CURRENT_CAREGIVER, CURRENT_PATIENT
-    if not (CURRENT_PATIENT is None and CURRENT_CAREGIVER is None):
-        print(f"Logging out: {CURRENT_CAREGIVER}")
-        print(f"Logging out: {CURRENT_PATIENT}")
-        CURRENT_PATIENT = None
-        CURRENT_CAREGIVER = None
+    if not (session.patient is None and session.caregiver is None):
+        print(f"Logging out: {session.caregiver}")
+        print(f"Logging out: {session.patient}")
+        if session.login_token is not None:
+            LoginTokens.revoke(session.login_token)  # the token and the cached password don't log in anymore.
+        session.logout()
     else:
         print("No account is currently login, so logout does nothing. ")
 
@@ -454,20 +879,29 @@ def logout(tokens):
 
 
 def start():
+    session = Session()
     stop = False
     while not stop:
         print()
         print(" *** Please enter one of the following commands *** ")
         print("> create_patient <username> <password>")  # DONE: implement create_patient (Part 1)
         print("> create_caregiver <username> <password>")
+        print("> import_users <csv>")
         print("> login_patient <username> <password>")  # DONE: implement login_patient (Part 1)
         print("> login_caregiver <username> <password>")
-        print("> search_caregiver_schedule <date>")  # DONE: implement search_caregiver_schedule (Part 2)
-        print("> reserve <date> <vaccine>") # DONE: implement reserve (Part 2)
-        print("> upload_availability <date>")
-        print("> cancel <appointment_id>") # TODO: implement cancel (extra credit)
+        print("> show_login_token")
+        print("> resume_login <token>")
+        print("> search_caregiver_schedule <date> | <from> <to>")  # DONE: implement search_caregiver_schedule (Part 2)
+        print("> reserve <date> <vaccine> [--wait]") # DONE: implement reserve (Part 2)
+        print("> leave_waitlist <vaccine> <date>")
+        print("> upload_availability <date> | <from> <to> [daily|weekdays|weekends|mon,tue,...] [--capacity <N>]")
+        print("> cancel <appointment_id> | --caregiver <name> --date <date>")
         print("> add_doses <vaccine> <number>")
-        print("> show_appointments")  # TODO: implement show_appointments (Part 2)
+        print("> show_appointments [--after <id>] [--limit <N>] [--order id|date]")  # TODO: implement show_appointments (Part 2)
+        print("> show_cache_stats")
+        print("> metrics [json|prometheus]")
+        print("> slow_queries [limit]")
+        print("> query_stats")
         print("> logout") # DONE: implement logout (Part 2)
         print("> Quit")
         print()
@@ -488,39 +922,114 @@ def start():
             continue
 
         operation = tokens[0]
-        if operation == "create_patient":
-            create_patient(tokens)
-        elif operation == "create_caregiver":
-            create_caregiver(tokens)
-        elif operation == "login_patient":
-            login_patient(tokens)
-        elif operation == "login_caregiver":
-            login_caregiver(tokens)
-        elif operation == "search_caregiver_schedule":
-            search_caregiver_schedule(tokens)
-        elif operation == "reserve":
-            reserve(tokens)
-        elif operation == "upload_availability":
-            upload_availability(tokens)
-        elif operation == cancel:
-            cancel(tokens)
-        elif operation == "add_doses":
-            add_doses(tokens)
-        elif operation == "show_appointments":
-            show_appointments(tokens)
-        elif operation == "logout":
-            logout(tokens)
-        elif operation == "quit":
+        if operation == "quit":
             print("Thank you for using the scheduler, Goodbye!")
+            ConnectionManager.close_pool()
+            HashService.shutdown()
             stop = True
+        elif operation in COMMANDS:
+            try:
+                COMMANDS[operation](tokens, session)
+            except DatabaseError:
+                # the handler reported the error, the interactive scheduler stops on it.
+                ConnectionManager.close_pool()
+                HashService.shutdown()
+                stop = True
         else:
             print("Invalid Argument")
 
 
+def run_batch(stream, out=sys.stdout):
+    """
+        Run the commands of a stream, one per line, without the menu. Made for replaying and scripting
+        many commands, e.g: python Scheduler.py --batch commands.txt
+        Overview:
+            * Every command writes one JSON line to out: {"line", "command", "ok", "output", "elapsed_ms"}.
+            ok is false when the command is unknown or aborted by an error, output is what it printed.
+            * Blank lines and lines starting with # are skipped, "quit" stops the run.
+            * A summary line {"summary": {...}} with the totals and the throughput comes last.
+        Return:
+            The number of commands that failed.
+    """
+    session = Session()
+    Count, Failed = 0, 0
+    Start = time.perf_counter()
+    for Number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if line == "" or line.startswith("#"):
+            continue
+        tokens = line.split(" ")
+        tokens[0] = tokens[0].lower()
+        if tokens[0] == "quit":
+            break
+        Handler = COMMANDS.get(tokens[0])
+        Ok = Handler is not None
+        CommandStart = time.perf_counter()
+        with capture_output() as Output:
+            if Handler is None:
+                print("Invalid Argument")
+            else:
+                try:
+                    Handler(tokens, session)
+                except DatabaseError:
+                    # the handler reported it, in a batch only this command is given up.
+                    Ok = False
+                except Exception as e:
+                    print(f"{type(e).__name__}: {e}")
+                    Ok = False
+        Elapsed = time.perf_counter() - CommandStart
+        Count += 1
+        Failed += 0 if Ok else 1
+        out.write(json.dumps({
+            "line": Number,
+            "command": tokens[0],
+            "ok": Ok,
+            "output": Output.getvalue(),
+            "elapsed_ms": round(Elapsed*1000, 3)
+        }) + "\n")
+    Total = time.perf_counter() - Start
+    out.write(json.dumps({"summary": {
+        "commands": Count,
+        "failed": Failed,
+        "elapsed_s": round(Total, 3),
+        "commands_per_s": round(Count/Total, 1) if Total > 0 else None
+    }}) + "\n")
+    out.flush()
+    ConnectionManager.close_pool()
+    HashService.shutdown()
+    return Failed
+
+
+# The commands of the scheduler, by name. Every handler takes (tokens, session).
+COMMANDS = {
+    "create_patient": create_patient,
+    "create_caregiver": create_caregiver,
+    "import_users": import_users,
+    "login_patient": login_patient,
+    "login_caregiver": login_caregiver,
+    "show_login_token": show_login_token,
+    "resume_login": resume_login,
+    "search_caregiver_schedule": search_caregiver_schedule,
+    "reserve": reserve,
+    "leave_waitlist": leave_waitlist,
+    "upload_availability": upload_availability,
+    "cancel": cancel,
+    "add_doses": add_doses,
+    "show_appointments": show_appointments,
+    "show_cache_stats": show_cache_stats,
+    "metrics": metrics,
+    "slow_queries": slow_queries,
+    "query_stats": query_stats,
+    "logout": logout,
+}
+# Every command is timed into scheduler_command_seconds when the metrics are enabled.
+COMMANDS = {name: Metrics.timed("scheduler_command_seconds", handler, name) for name, handler in COMMANDS.items()}
+
+
 def Test():
     print("--- Test Creating Caregiver --- ")
     print("Inserting a new care giver to the system. ")
-    create_caregiver(["", "test", "test"])
+    create_caregiver(["", "test", "test"], Session())
     return
 
 
@@ -531,6 +1040,15 @@ if __name__ == "__main__":
     // for the simplicity of this assignment
     // and then construct a map of vaccineName -> vaccineObject
     '''
+    Parser = argparse.ArgumentParser(description="The COVID-19 vaccine reservation scheduler.")
+    Parser.add_argument("--batch", nargs="?", const="-", metavar="FILE",
+                        help="run the commands of FILE, or of stdin, and print a JSON line per command.")
+    Args = Parser.parse_args()
+    if Args.batch is not None:
+        if Args.batch == "-":
+            sys.exit(1 if run_batch(sys.stdin) > 0 else 0)
+        with open(Args.batch) as f:
+            sys.exit(1 if run_batch(f) > 0 else 0)
     # start command line
     Test()
     print()
@@ -0,0 +1,180 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
+import Scheduler
+from db.ConnectionManager import ConnectionManager
+from db.Backend import DatabaseError
+from util.HashService import HashService
+from util.Session import SessionRegistry
+from util.OutputCapture import capture_output
+
+
+'''
+Serves the scheduler commands to many clinic terminals at once, over TCP.
+Protocol, one line each way:
+    * The client sends a command as it would type it, e.g: "login_patient alice Passw0rd!". A JSON object
+    {"command": "..."} is accepted as well.
+    * The server answers with one JSON object: {"command": ..., "output": ..., "elapsed_ms": ...}, output is
+    what the command printed. A command aborted by an error has an "error" as well, the session goes on.
+    * "quit" closes the connection.
+    * Only the commands of REMOTE_COMMANDS are served, the others are answered as invalid.
+Every connection gets a session, its token is sent in the greeting: {"session": "<token>"}. After a reconnect,
+"resume <token>" picks the session and its login up again, until it expires after SESSIONTTL idle seconds.
+The blocking command handlers run on a thread pool so the event loop keeps serving the other connections while
+the database and PBKDF2 work, commands of different sessions run in parallel.
+'''
+
+# The commands a terminal may run, a new scheduler command is not served until it's added here. import_users
+# reads files of the server, the metrics and the caches statistics are for the operators of the server.
+REMOTE_COMMANDS = (
+    "create_patient", "create_caregiver", "login_patient", "login_caregiver", "show_login_token", "resume_login",
+    "search_caregiver_schedule", "reserve", "leave_waitlist", "upload_availability", "cancel", "add_doses",
+    "show_appointments", "logout"
+)
+COMMANDS = {name: Scheduler.COMMANDS[name] for name in REMOTE_COMMANDS}
+
+SESSIONS = SessionRegistry(
+    ttl=float(os.getenv("SESSIONTTL", "1800")),
+    maxsize=int(os.getenv("SESSIONLIMIT", "10000"))
+)
+
+# Seconds between two sweeps of the expired sessions.
+CONST_EVICTION_INTERVAL = 60
+
+
+def log(message):
+    print(f"[{time.strftime('%H:%M:%S')}] {message}", file=sys.__stdout__, flush=True)
+
+
+def run_command(session, tokens):
+    """
+        Run one command for a session, on a worker thread. An error aborts the command, never the session.
+        Return:
+            What the command printed, and the error that aborted it or None.
+    """
+    Handler = COMMANDS.get(tokens[0])
+    if Handler is None:
+        return "Invalid Argument\n", None
+    Error = None
+    with session.lock, capture_output() as Output:
+        session.touch()
+        try:
+            Handler(tokens, session)
+        except DatabaseError:
+            # the handler reported it, only this command is given up.
+            print("The command was aborted by a database error. ")
+            Error = "database error"
+        except Exception as e:
+            print(f"{type(e).__name__}: {e}")
+            Error = type(e).__name__
+    return Output.getvalue(), Error
+
+
+def parse_request(line):
+    """
+        Get the tokens of a request line, the same way the interactive scheduler splits them.
+    """
+    line = line.strip()
+    if line.startswith("{") or line.startswith("["):
+        Request = json.loads(line)
+        if not isinstance(Request, dict):
+            raise ValueError("a JSON request is an object, e.g: {\"command\": \"...\"}")
+        line = str(Request.get("command", "")).strip()
+    tokens = line.split(" ")
+    tokens[0] = tokens[0].lower()
+    return tokens
+
+
+async def send(writer, response):
+    writer.write((json.dumps(response) + "\n").encode("utf-8"))
+    await writer.drain()
+    return None
+
+
+async def handle_client(reader, writer, executor):
+    peer = writer.get_extra_info("peername")
+    session = SESSIONS.create()
+    loop = asyncio.get_running_loop()
+    log(f"Connected: {peer}")
+    try:
+        await send(writer, {"session": session.token})
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                tokens = parse_request(line.decode("utf-8"))
+            except (UnicodeDecodeError, ValueError) as e:
+                await send(writer, {"error": f"Malformed request: {e}"})
+                continue
+            if tokens[0] == "":
+                continue
+            if tokens[0] == "quit":
+                break
+            if tokens[0] == "resume":
+                Resumed = SESSIONS.get(tokens[1]) if len(tokens) == 2 else None
+                if Resumed is None:
+                    await send(writer, {"error": "Unknown or expired session. "})
+                else:
+                    SESSIONS.remove(session.token)
+                    session = Resumed
+                    await send(writer, {"session": session.token, "output": f"Resumed: {session}\n"})
+                continue
+            Start = time.perf_counter()
+            Output, Error = await loop.run_in_executor(executor, run_command, session, tokens)
+            Response = {
+                "command": tokens[0],
+                "output": Output,
+                "elapsed_ms": round((time.perf_counter() - Start)*1000, 3)
+            }
+            if Error is not None:
+                Response["error"] = Error
+            await send(writer, Response)
+    except ConnectionError:
+        pass
+    finally:
+        log(f"Disconnected: {peer}")
+        writer.close()
+    return None
+
+
+async def evict_sessions():
+    while True:
+        await asyncio.sleep(CONST_EVICTION_INTERVAL)
+        Evicted = SESSIONS.evict_expired()
+        if Evicted > 0:
+            log(f"Evicted {Evicted} expired session(s), {len(SESSIONS)} left.")
+
+
+async def serve(host, port, workers):
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scheduler")
+    server = await asyncio.start_server(lambda r, w: handle_client(r, w, executor), host, port)
+    log(f"Scheduler server listening on {', '.join(str(s.getsockname()) for s in server.sockets)}")
+    eviction = asyncio.create_task(evict_sessions())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        eviction.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
+        ConnectionManager.close_pool()
+        HashService.shutdown()
+    return None
+
+
+if __name__ == "__main__":
+    Parser = argparse.ArgumentParser(description="Serve the vaccine scheduler to many terminals over TCP.")
+    Parser.add_argument("--host", default=os.getenv("SCHEDULERHOST", "127.0.0.1"))
+    Parser.add_argument("--port", type=int, default=int(os.getenv("SCHEDULERPORT", "5414")))
+    Parser.add_argument("--workers", type=int, default=int(os.getenv("SCHEDULERWORKERS", "32")),
+                        help="threads running the blocking command handlers.")
+    Args = Parser.parse_args()
+    try:
+        asyncio.run(serve(Args.host, Args.port, Args.workers))
+    except KeyboardInterrupt:
+        log("Scheduler server stopped.")
@@ -0,0 +1,151 @@
+import os
+import re
+import sqlite3
+from db.ConnectionPool import PoolTimeout
+
+try:
+    import pymssql
+except ImportError:  # the driver is only needed by the MSSQL backend.
+    pymssql = None
+
+
+# Catch this instead of a driver specific error class, it covers every backend available in the process, and
+# the pool running out of connections.
+DatabaseError = (sqlite3.Error, PoolTimeout) if pymssql is None else (pymssql.Error, sqlite3.Error, PoolTimeout)
+
+
+class Backend:
+    """
+        A storage engine the ConnectionManager can pool connections for.
+        Overview:
+            * The queries of the models are written in T-SQL with %s, %d placeholders, which is the dialect of
+            the MSSQL backend. Other backends translate them into their own dialect.
+            * Statements that can't be translated mechanically are overridden in `Statements`, keyed by their
+            T-SQL text.
+    """
+
+    Name = None
+    Statements = {}
+
+    def check_environment(self):
+        """
+            Warn about missing configurations, returns whether everything is in place.
+        """
+        return True
+
+    def connect(self):
+        """
+            Open a brand-new raw connection, with autocommit disabled.
+        """
+        raise NotImplementedError()
+
+    def set_autocommit(self, conn, autocommit):
+        raise NotImplementedError()
+
+    def forget(self, conn):
+        """
+            Drop what the backend keeps about a connection, the pool calls it when the connection is closed.
+        """
+        return None
+
+    def cursor(self, conn, as_dict=False):
+        """
+            Get a cursor of the connection that accepts the T-SQL queries of the models.
+            * When as_dict is True, rows are dictionaries keyed by the column names.
+        """
+        raise NotImplementedError()
+
+    def translate(self, sql):
+        """
+            Get the statement in the dialect of the backend.
+        """
+        return self.Statements.get(sql, sql)
+
+    def split_script(self, script):
+        """
+            Split a T-SQL script into the batches to execute one by one, they are separated by GO lines.
+        """
+        return [batch.strip() for batch in re.split(r"^\s*GO\s*$", script, flags=re.I | re.M) if batch.strip()]
+
+    def add_doses(self, cursor, vaccine, doses):
+        """
+            Add doses to a vaccine with a single atomic upsert, the vaccine is inserted when it's new. Two
+            concurrent calls for a new vaccine can't both try to insert it.
+            * The cursor must be an auto-commit cursor.
+        """
+        raise NotImplementedError()
+
+    def reserve_appointment(self, cursor, patient_name, vaccine, date, preferred=None):
+        """
+            Book an appointment atomically: check the vaccine has doses left, claim the availability slot of a
+            caregiver on the date, insert the appointment and take one dose from the vaccine.
+            * The preferred caregiver is assigned when they still have a slot on the date, see SlotIndex.
+            Otherwise, the caregiver with the most remaining capacity is, then the one with the fewest
+            appointments, ties go to the first username.
+            * The slot loses one capacity, a full slot stays with a capacity of 0 so the date isn't uploaded
+            again, the Booked count of the caregiver goes up by one. Only slots with capacity left are allocated.
+            * The patient leaves the waitlist of the vaccine, on every date, so match_waitlist can't book them
+            a second time.
+            * The cursor must be an auto-commit cursor returning dictionaries, the backend manages the
+            transaction.
+            Return:
+                A dictionary with "Status", "Id", "Caregiver". Status is one of "OK", "NO_VACCINE", "NO_DOSES",
+                "NO_CAREGIVER", nothing is changed in the database unless it's "OK".
+        """
+        raise NotImplementedError()
+
+    def cancel_appointment(self, cursor, appointment_id, patient_name=None, caregiver_name=None):
+        """
+            Cancel one appointment of a patient or a caregiver atomically: the appointment is deleted, its dose
+            goes back to the vaccine, the Booked count of the caregiver goes down by one and the availability
+            slot of the caregiver on the date gets one capacity back, it's recreated when it's missing.
+            * Only an appointment of the given patient or caregiver is cancelled, the other one is None.
+            * The cursor must be an auto-commit cursor returning dictionaries, the backend manages the
+            transaction.
+            Return:
+                A dictionary with "Cancelled", the number of appointments, "Doses", the doses returned by
+                vaccine, "Slots", the number of availability slots restored, and "Dates", the first and the last
+                date of the appointments, None when there is none.
+        """
+        raise NotImplementedError()
+
+    def cancel_caregiver_day(self, cursor, caregiver_name, date):
+        """
+            Cancel all the appointments of a caregiver on a date, e.g: a sick day, with set based statements in one
+            transaction. The doses go back to the vaccines and the Booked count goes down, like a single cancel,
+            but the slots are not restored: the remaining availability of the caregiver on the date is removed
+            too, so nobody is booked with them again.
+            Return:
+                The same dictionary as cancel_appointment.
+        """
+        raise NotImplementedError()
+
+    def match_waitlist(self, cursor, today):
+        """
+            Book the patients of the Waitlist on the free slots and the doses left, first come first served, in
+            one transaction.
+            * The waiting patients are taken in the order they arrived. A patient is booked with the caregiver
+            reserve would assign on the date, as long as the vaccine has doses left. The others keep
+            their place in the queue.
+            * The entries for dates before today are dropped.
+            * The cursor must be an auto-commit cursor returning dictionaries, the backend manages the
+            transaction.
+            Return:
+                A dictionary with "Matched", the number of patients booked, and "Dates", the first and the last
+                date they were booked on, None when nobody was.
+        """
+        raise NotImplementedError()
+
+
+def get_backend():
+    """
+        Make the backend chosen by the BACKEND Env Var, "mssql" (default) or "sqlite".
+    """
+    name = os.getenv("BACKEND", "mssql").lower()
+    if name == "mssql":
+        from db.MSSQLBackend import MSSQLBackend
+        return MSSQLBackend()
+    if name == "sqlite":
+        from db.SQLiteBackend import SQLiteBackend
+        return SQLiteBackend()
+    raise ValueError(f"Unknown BACKEND Env Var: \"{name}\", expect \"mssql\" or \"sqlite\". ")
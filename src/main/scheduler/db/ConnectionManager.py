@@ -1,54 +1,99 @@
-import pymssql
 import os
-import warnings
+import time
+import threading
+from db.ConnectionPool import ConnectionPool
+from db.Backend import get_backend, DatabaseError
+from db.SlowQueryLog import SlowQueryLog
+from util.Metrics import Metrics
 
 
 class ConnectionManager:
+    """
+        Hands out database connections from a process wide pool, so the TCP, TLS and login handshakes are
+        paid once per pooled connection instead of once per query.
+        * The storage engine is chosen by the BACKEND Env Var, see db.Backend.
+        * The pool size and the idle timeout are read from the POOLSIZE and POOLIDLETIMEOUT Env Vars, connections
+        idle for more than POOLHEALTHCHECKIDLE seconds (default 30) are health checked on checkout.
+        * Connecting, checking out and the statements of the cursors are timed by util.Metrics when enabled.
+        * The statements are fingerprinted and the slow ones logged by db.SlowQueryLog when enabled.
+    """
+
+    Backend = None
+    Pool = None
+    PoolLock = threading.Lock()
 
     def __init__(self):
-        self.server_name = os.getenv("SERVER")
-        self.db_name = os.getenv("DBNAME")
-        self.user = os.getenv("USERID")
-        self.password = os.getenv("PASSWORD")
         self.conn = None
 
+    @classmethod
+    def get_backend(cls):
+        """
+            Get the storage backend of the process, it's created on first use.
+        """
+        if cls.Backend is None:
+            with cls.PoolLock:
+                if cls.Backend is None:
+                    backend = get_backend()
+                    backend.check_environment()
+                    cls.Backend = backend
+        return cls.Backend
+
+    @classmethod
+    def get_pool(cls):
+        """
+            Get the connection pool of the process, it's created on first use.
+        """
+        if cls.Pool is None:
+            backend = cls.get_backend()
+            with cls.PoolLock:
+                if cls.Pool is None:
+                    cls.Pool = ConnectionPool(
+                        Metrics.timed("scheduler_connect_seconds", backend.connect),
+                        max_size=int(os.getenv("POOLSIZE", "8")),
+                        idle_timeout=float(os.getenv("POOLIDLETIMEOUT", "300")),
+                        on_close=backend.forget,
+                        health_check_idle=float(os.getenv("POOLHEALTHCHECKIDLE", "30"))
+                    )
+        return cls.Pool
+
+    @classmethod
+    def close_pool(cls):
+        """
+            Close all idle pooled connections, e.g: when the scheduler shuts down.
+        """
+        if cls.Pool is not None:
+            cls.Pool.close_all()
+        return None
+
+    @property
+    def backend(self):
+        return ConnectionManager.get_backend()
+
     def create_connection(self, autocommit=False):
         """
             Get a SQL connection object, which is commonly refers to as the cursor.
+            * The connection is checked out from the pool, give it back with close_connection.
             Exception:
-                * Exists the program whenever a database connection error is encountered.
+                * Database errors are reported and raised again, the caller gives up the command.
         """
         try:
-            AnyProblem = False
-            if self.server_name is None:
-                warnings.warn("SERVER Env Var is None.")
-                AnyProblem = True
-            if self.db_name is None:
-                warnings.warn("DBNAME Env Var is None.")
-                AnyProblem = True
-            if self.user is None:
-                warnings.warn("USERID Env Var is None.")
-                AnyProblem = True
-            if self.password is None:
-                warnings.warn("PASSWORD Env Var is None.")
-                AnyProblem = True
-            if AnyProblem:
-                print("Problems with environmental variables, please make sure they are all capitalized. I added this thing" + \
-                      "so that it's compatible with my system, which is not original present in the original assignment code. ")
-
-            self.conn = pymssql.connect(
-                server=self.server_name,
-                user=self.user,
-                password=self.password,
-                database=self.db_name,
-                autocommit=autocommit
-            )
-        except pymssql.Error as db_err:
-            print("Database Programming Error in SQL connection processing! The program will be terminated immediately.")
+            Start = time.perf_counter()
+            self.conn = ConnectionManager.get_pool().acquire()
+            Metrics.observe("scheduler_checkout_seconds", time.perf_counter() - Start)
+            self.backend.set_autocommit(self.conn, autocommit)
+        except DatabaseError as db_err:
+            print("Database Programming Error in SQL connection processing! ")
             print(db_err)
-            quit()  # KILL the program if such an error occurred. Oof might not be a good move but whatever.
+            raise
         return self.conn
 
+    def cursor(self, as_dict=False):
+        """
+            Get a cursor of the current connection that accepts the queries of the models, whatever the
+            backend is.
+        """
+        return Metrics.cursor(SlowQueryLog.cursor(self.backend.cursor(self.conn, as_dict=as_dict)))
+
     def __enter__(self):
         """
             Enter with Block. Directly get the cursor for MSSQL under the with
@@ -57,26 +102,35 @@ class ConnectionManager:
             auto-commit is enabled.
         """
         self.create_connection(autocommit=True)
-        return self.conn.cursor(as_dict=True)
+        return self.cursor(as_dict=True)
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """
             Close it when existing the with block.
             All errors and exceptions are the responsibility of the caller of the with context.
         """
-        self.close_connection()
+        self.close_connection(broken=isinstance(exc_val, DatabaseError))
         return False
 
-    def close_connection(self):
+    def close_connection(self, broken=False):
         """
-            Close the current database connection session.
+            Give the current database connection session back to the pool. Uncommitted work is rolled back.
+            * Calling it more than once is fine, only the first call releases the connection.
             Exception:
-                * It will quit the program if there is a database connection error.
+                * Database errors are reported and raised again.
         """
-
+        if self.conn is None:
+            return None
+        conn, self.conn = self.conn, None
+        try:
+            if not broken:
+                conn.rollback()
+        except DatabaseError:
+            broken = True  # the session is gone, don't let anyone else check it out.
         try:
-            self.conn.close()
-        except pymssql.Error as db_err:
+            ConnectionManager.get_pool().release(conn, broken=broken)
+        except DatabaseError as db_err:
             print("Database Programming Error in SQL connection processing! ")
             print(db_err)
-            quit()
+            raise
+        return None
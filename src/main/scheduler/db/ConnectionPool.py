@@ -0,0 +1,156 @@
+import threading
+import time
+import collections
+
+
+class PoolTimeout(TimeoutError):
+    """
+        No pooled connection became free in time.
+    """
+    pass
+
+
+class ConnectionPool:
+    """
+        A bounded pool of database connections shared by every ConnectionManager in the process.
+        Overview:
+            * At most `max_size` connections are ever open at the same time, callers block when all of
+            them are checked out.
+            * A connection that sat idle for longer than `health_check_idle` seconds is health checked with a
+            trivial query before it's handed out again, broken connections are thrown away and replaced. Warm
+            connections skip the extra round trip, the ones that failed a statement are released as broken and
+            never come back.
+            * Connections sitting idle for longer than `idle_timeout` seconds are closed.
+    """
+
+    HealthCheck = "SELECT 1"
+
+    def __init__(self, factory, max_size=8, idle_timeout=300, checkout_timeout=30, on_close=None,
+                 health_check_idle=30):
+        """
+            factory:
+                A callable with no arguments that opens a new raw database connection.
+            on_close:
+                A callable called with every connection the pool closes, None for nothing.
+            max_size:
+                The maximal number of connections, checked out or idle.
+            idle_timeout:
+                Seconds an idle connection is kept before it's closed, None to keep them forever.
+            checkout_timeout:
+                Seconds to wait for a free connection before giving up, None to wait forever.
+            health_check_idle:
+                Seconds of idleness after which a connection is health checked on checkout, 0 to check them all.
+        """
+        if max_size < 1:
+            raise ValueError("The pool needs room for at least one connection. ")
+        self.factory = factory
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.on_close = on_close
+        self.health_check_idle = health_check_idle
+        self.idle = collections.deque()  # (connection, time released), most recent on the right.
+        self.size = 0  # connections opened by the pool that are not closed yet.
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        """
+            Check out a healthy connection, open a new one if there is still room for it.
+            Exception:
+                * PoolTimeout when no connection becomes free within the checkout timeout, it's one of the
+                db.Backend.DatabaseError classes.
+                * Whatever the factory raises when a new connection can't be opened.
+        """
+        while True:
+            conn = None
+            with self.condition:
+                self._evict_idle()
+                deadline = None if self.checkout_timeout is None else time.monotonic() + self.checkout_timeout
+                while not self.idle and self.size >= self.max_size:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout(f"No database connection became free within {self.checkout_timeout}s. ")
+                    self.condition.wait(remaining)
+                if self.idle:
+                    conn, released = self.idle.pop()  # LIFO, the warmest connection is the least likely to be stale.
+                else:
+                    self.size += 1  # reserve the room before connecting outside the lock.
+            if conn is None:
+                try:
+                    return self.factory()
+                except BaseException:
+                    self._forget()
+                    raise
+            if time.monotonic() - released < self.health_check_idle or self._is_healthy(conn):
+                return conn
+            self._discard(conn)
+
+    def release(self, conn, broken=False):
+        """
+            Give a connection back to the pool, a broken connection is closed instead of being reused.
+        """
+        if conn is None:
+            return None
+        if broken:
+            self._discard(conn)
+            return None
+        with self.condition:
+            self.idle.append((conn, time.monotonic()))
+            self.condition.notify()
+        return None
+
+    def close_all(self):
+        """
+            Close every idle connection, connections that are checked out are closed when they are released
+            as broken, or reused otherwise.
+        """
+        with self.condition:
+            while self.idle:
+                conn, _ = self.idle.popleft()
+                self._close_quietly(conn)
+                self.size -= 1
+            self.condition.notify_all()
+        return None
+
+    def _evict_idle(self):
+        """
+            Close connections that have been idle for too long, the caller must hold the lock.
+        """
+        if self.idle_timeout is None:
+            return None
+        cutoff = time.monotonic() - self.idle_timeout
+        while self.idle and self.idle[0][1] < cutoff:
+            conn, _ = self.idle.popleft()
+            self._close_quietly(conn)
+            self.size -= 1
+        return None
+
+    def _is_healthy(self, conn):
+        try:
+            cursor = conn.cursor()
+            cursor.execute(ConnectionPool.HealthCheck)
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        self._close_quietly(conn)
+        self._forget()
+        return None
+
+    def _forget(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+        return None
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+        if self.on_close is not None:
+            self.on_close(conn)
+        return None
@@ -0,0 +1,338 @@
+import os
+import warnings
+import itertools
+import threading
+from db.Backend import Backend, pymssql
+from db.Queries import Queries, Query
+
+
+class MSSQLCursor:
+    """
+        A pymssql cursor that runs the registered queries by the handle of their prepared statement, the text of
+        any other statement is sent as it is.
+    """
+
+    def __init__(self, backend, conn, cursor):
+        self.backend = backend
+        self.conn = conn
+        self.cursor = cursor
+
+    def execute(self, sql, params=None):
+        Queries.count(sql)
+        if not (self.backend.Prepare and isinstance(sql, Query) and sql.Preparable):
+            return self.cursor.execute(sql) if params is None else self.cursor.execute(sql, params)
+        if params is None:
+            params = ()
+        elif not isinstance(params, (tuple, list)):
+            params = (params, )
+        Handle = self.backend.prepare(self.conn, sql, params)
+        return self.cursor.execute("EXEC sp_execute " + ", ".join(["%d"] + ["%s"]*len(params)), (Handle, *params))
+
+    def executemany(self, sql, seq_of_params):
+        Queries.count(sql)
+        return self.cursor.executemany(sql, seq_of_params)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+class MSSQLBackend(Backend):
+    """
+        Microsoft SQL Server through pymssql, the queries of the models are already in its dialect.
+    """
+
+    Name = "mssql"
+    # Registered queries are prepared once per connection and executed by handle, unless PREPARE=0.
+    Prepare = os.getenv("PREPARE", "1") != "0"
+    PrepareStatement = "DECLARE @Handle INT; EXEC sp_prepare @Handle OUTPUT, %s, %s; SELECT @Handle AS Handle"
+
+    # HOLDLOCK keeps the range of the name locked from the match to the insert, a new vaccine is inserted once.
+    MergeDoses = Queries.register(
+        "vaccine.merge_doses",
+        "MERGE Vaccines WITH (HOLDLOCK) AS v USING (SELECT %s AS Name, %d AS Doses) AS d ON v.Name = d.Name " +
+        "WHEN MATCHED THEN UPDATE SET Doses = v.Doses + d.Doses " +
+        "WHEN NOT MATCHED THEN INSERT (Name, Doses) VALUES (d.Name, d.Doses);")
+
+    # One round trip: the whole reservation is a single batch in a single transaction.
+    # The caregiver picked by the SlotIndex of the scheduler is a primary key seek, when they're still free. The
+    # fallback, the caregiver with the most remaining capacity and the least booked, reads the slots of the date
+    # from IX_Availabilities_Time_Capacity, the ties are broken by the Booked count of the Caregivers rows.
+    # READPAST lets concurrent reservations skip slots other transactions are claiming. The slot loses one
+    # capacity, a full slot is kept with no capacity left so the date can't be uploaded again, and the caregiver
+    # counts one more appointment.
+    ReserveAppointment = Queries.register("appointment.reserve", """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @Patient VARCHAR(255) = %s, @Vaccine VARCHAR(255) = %s, @Date DATE = %s, @Preferred VARCHAR(255) = %s;
+DECLARE @Status VARCHAR(16) = 'OK', @Caregiver VARCHAR(255) = NULL, @Id INT = NULL;
+BEGIN TRANSACTION;
+IF NOT EXISTS (SELECT 1 FROM Vaccines WITH (UPDLOCK) WHERE Name = @Vaccine)
+    SET @Status = 'NO_VACCINE';
+ELSE
+BEGIN
+    UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = @Vaccine AND Doses > 0;
+    IF @@ROWCOUNT = 0
+        SET @Status = 'NO_DOSES';
+    ELSE
+    BEGIN
+        SELECT @Caregiver = Username FROM Availabilities WITH (UPDLOCK, ROWLOCK, READPAST)
+            WHERE Time = @Date AND Username = @Preferred AND Capacity > 0;
+        IF @Caregiver IS NULL
+            SELECT TOP 1 @Caregiver = a.Username FROM Availabilities AS a WITH (UPDLOCK, ROWLOCK, READPAST)
+                JOIN Caregivers AS c ON c.Username = a.Username
+                WHERE a.Time = @Date AND a.Capacity > 0 ORDER BY a.Capacity DESC, c.Booked, a.Username;
+        IF @Caregiver IS NULL
+            SET @Status = 'NO_CAREGIVER';
+        ELSE
+        BEGIN
+            UPDATE Availabilities SET Capacity = Capacity - 1 WHERE Time = @Date AND Username = @Caregiver;
+            UPDATE Caregivers SET Booked = Booked + 1 WHERE Username = @Caregiver;
+            INSERT INTO Appointments (PatientName, CareGiverName, AppointmentDate, VaccineType)
+                VALUES (@Patient, @Caregiver, @Date, @Vaccine);
+            SET @Id = SCOPE_IDENTITY();
+            DELETE FROM Waitlist WHERE PatientName = @Patient AND VaccineType = @Vaccine;
+        END
+    END
+END
+IF @Status = 'OK' COMMIT TRANSACTION; ELSE ROLLBACK TRANSACTION;
+SELECT @Status AS Status, @Id AS Id, @Caregiver AS Caregiver;
+""")
+
+    # The cancelled appointments are collected by the DELETE, the doses and the bookings are given back by
+    # vaccine and by caregiver with one statement each, whatever the number of appointments.
+    CancelReturns = """
+UPDATE Vaccines SET Doses = Doses + Returned.Doses
+    FROM Vaccines JOIN (SELECT VaccineType, COUNT(*) AS Doses FROM @Cancelled GROUP BY VaccineType) AS Returned
+    ON Vaccines.Name = Returned.VaccineType;
+UPDATE Caregivers SET Booked = Booked - Freed.Appointments
+    FROM Caregivers
+    JOIN (SELECT CareGiverName, COUNT(*) AS Appointments FROM @Cancelled GROUP BY CareGiverName) AS Freed
+    ON Caregivers.Username = Freed.CareGiverName;
+"""
+    CancelResult = """
+COMMIT TRANSACTION;
+SELECT VaccineType, COUNT(*) AS Doses, @Slots AS Slots, MIN(AppointmentDate) AS FirstDate,
+    MAX(AppointmentDate) AS LastDate
+    FROM @Cancelled GROUP BY VaccineType;
+"""
+    CancelAppointment = Queries.register("appointment.cancel", """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @Id INT = %d, @Patient VARCHAR(255) = %s, @Caregiver VARCHAR(255) = %s, @Slots INT = 0;
+DECLARE @Cancelled TABLE (CareGiverName VARCHAR(255), AppointmentDate DATE, VaccineType VARCHAR(255));
+BEGIN TRANSACTION;
+DELETE FROM Appointments
+    OUTPUT deleted.CareGiverName, deleted.AppointmentDate, deleted.VaccineType INTO @Cancelled
+    WHERE Id = @Id AND (PatientName = @Patient OR CareGiverName = @Caregiver);
+""" + CancelReturns + """
+UPDATE a SET Capacity = Capacity + 1 FROM Availabilities AS a
+    JOIN @Cancelled AS c ON a.Time = c.AppointmentDate AND a.Username = c.CareGiverName;
+SET @Slots = @@ROWCOUNT;
+INSERT INTO Availabilities (Time, Username, Capacity)
+    SELECT c.AppointmentDate, c.CareGiverName, 1
+    FROM @Cancelled AS c
+    WHERE NOT EXISTS (SELECT 1 FROM Availabilities WHERE Time = c.AppointmentDate AND Username = c.CareGiverName);
+SET @Slots = @Slots + @@ROWCOUNT;
+""" + CancelResult)
+    CancelCaregiverDay = Queries.register("appointment.cancel_caregiver_day", """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @Caregiver VARCHAR(255) = %s, @Date DATE = %s, @Slots INT = 0;
+DECLARE @Cancelled TABLE (CareGiverName VARCHAR(255), AppointmentDate DATE, VaccineType VARCHAR(255));
+BEGIN TRANSACTION;
+DELETE FROM Appointments
+    OUTPUT deleted.CareGiverName, deleted.AppointmentDate, deleted.VaccineType INTO @Cancelled
+    WHERE CareGiverName = @Caregiver AND AppointmentDate = @Date;
+DELETE FROM Availabilities WHERE Username = @Caregiver AND Time = @Date;
+""" + CancelReturns + CancelResult)
+
+    # Rounds of set based matching: in every round, the waiting patients whose date has a free slot and whose
+    # vaccine has a dose left for them are ranked by arrival on their date and paired with the caregivers ranked
+    # like reserve does, one patient per caregiver and date. A patient waiting for a vaccine on several dates is
+    # a candidate once per round, on their first date with a free slot, and leaves the waitlist of the vaccine on
+    # every date once booked. Patients left over by a round, because of the doses or the slots, get another
+    # chance in the next one on what is still free, until a round books nobody. The locks on the slots and the
+    # doses are held until the commit, so reserve can't claim them meanwhile. The first and the last date booked
+    # are returned for the SlotIndex.
+    MatchWaitlist = Queries.register("waitlist.match", """
+SET NOCOUNT ON;
+SET XACT_ABORT ON;
+DECLARE @Today DATE = %s, @Matched INT = 0, @Booked INT = 0, @First DATE = NULL, @Last DATE = NULL;
+DECLARE @Round TABLE (
+    WaitId INT PRIMARY KEY, PatientName VARCHAR(255), CareGiverName VARCHAR(255), AppointmentDate DATE,
+    VaccineType VARCHAR(255)
+);
+BEGIN TRANSACTION;
+DELETE FROM Waitlist WHERE AppointmentDate < @Today;
+WHILE 1 = 1
+BEGIN
+    DELETE FROM @Round;
+    WITH Candidates AS (
+        SELECT w.Id, w.PatientName, w.AppointmentDate, w.VaccineType,
+            ROW_NUMBER() OVER (PARTITION BY w.PatientName, w.VaccineType ORDER BY w.Id) AS PatientRank
+        FROM Waitlist AS w
+        WHERE EXISTS (
+            SELECT 1 FROM Availabilities AS a WITH (UPDLOCK, HOLDLOCK)
+            WHERE a.Time = w.AppointmentDate AND a.Capacity > 0)
+    ), Servable AS (
+        SELECT w.Id, w.PatientName, w.AppointmentDate, w.VaccineType, v.Doses,
+            ROW_NUMBER() OVER (PARTITION BY w.VaccineType ORDER BY w.Id) AS DoseRank
+        FROM Candidates AS w JOIN Vaccines AS v WITH (UPDLOCK, HOLDLOCK) ON v.Name = w.VaccineType
+        WHERE w.PatientRank = 1 AND v.Doses > 0
+    ), Queue AS (
+        SELECT Id, PatientName, AppointmentDate, VaccineType,
+            ROW_NUMBER() OVER (PARTITION BY AppointmentDate ORDER BY Id) AS SlotRank
+        FROM Servable WHERE DoseRank <= Doses
+    ), Slots AS (
+        SELECT a.Time, a.Username,
+            ROW_NUMBER() OVER (PARTITION BY a.Time ORDER BY a.Capacity DESC, c.Booked, a.Username) AS SlotRank
+        FROM Availabilities AS a WITH (UPDLOCK, HOLDLOCK) JOIN Caregivers AS c ON c.Username = a.Username
+        WHERE a.Time IN (SELECT AppointmentDate FROM Queue) AND a.Capacity > 0
+    )
+    INSERT INTO @Round (WaitId, PatientName, CareGiverName, AppointmentDate, VaccineType)
+        SELECT q.Id, q.PatientName, s.Username, q.AppointmentDate, q.VaccineType
+        FROM Queue AS q JOIN Slots AS s ON s.Time = q.AppointmentDate AND s.SlotRank = q.SlotRank;
+    SET @Booked = @@ROWCOUNT;
+    IF @Booked = 0 BREAK;
+    INSERT INTO Appointments (PatientName, CareGiverName, AppointmentDate, VaccineType)
+        SELECT PatientName, CareGiverName, AppointmentDate, VaccineType FROM @Round ORDER BY WaitId;
+    UPDATE a SET Capacity = Capacity - 1 FROM Availabilities AS a
+        JOIN @Round AS r ON a.Time = r.AppointmentDate AND a.Username = r.CareGiverName;
+    UPDATE c SET Booked = Booked + r.Appointments FROM Caregivers AS c
+        JOIN (SELECT CareGiverName, COUNT(*) AS Appointments FROM @Round GROUP BY CareGiverName) AS r
+        ON c.Username = r.CareGiverName;
+    UPDATE v SET Doses = Doses - r.Doses FROM Vaccines AS v
+        JOIN (SELECT VaccineType, COUNT(*) AS Doses FROM @Round GROUP BY VaccineType) AS r
+        ON v.Name = r.VaccineType;
+    DELETE w FROM Waitlist AS w
+        JOIN @Round AS r ON w.PatientName = r.PatientName AND w.VaccineType = r.VaccineType;
+    SELECT @First = MIN(Day), @Last = MAX(Day) FROM (
+        SELECT AppointmentDate AS Day FROM @Round UNION ALL SELECT @First UNION ALL SELECT @Last
+    ) AS Days;
+    SET @Matched = @Matched + @Booked;
+END
+COMMIT TRANSACTION;
+SELECT @Matched AS Matched, @First AS FirstDate, @Last AS LastDate;
+""")
+
+    def __init__(self):
+        if pymssql is None:
+            raise ImportError("pymssql is not installed, it's required by the mssql backend. ")
+        self.server_name = os.getenv("SERVER")
+        self.db_name = os.getenv("DBNAME")
+        self.user = os.getenv("USERID")
+        self.password = os.getenv("PASSWORD")
+        # id(connection) -> (connection, {query name: handle}), the handles only exist on their connection.
+        self.prepared = {}
+        self.prepared_lock = threading.Lock()
+
+    def check_environment(self):
+        AnyProblem = False
+        if self.server_name is None:
+            warnings.warn("SERVER Env Var is None.")
+            AnyProblem = True
+        if self.db_name is None:
+            warnings.warn("DBNAME Env Var is None.")
+            AnyProblem = True
+        if self.user is None:
+            warnings.warn("USERID Env Var is None.")
+            AnyProblem = True
+        if self.password is None:
+            warnings.warn("PASSWORD Env Var is None.")
+            AnyProblem = True
+        if AnyProblem:
+            print("Problems with environmental variables, please make sure they are all capitalized. I added this thing" + \
+                  "so that it's compatible with my system, which is not original present in the original assignment code. ")
+        return not AnyProblem
+
+    def connect(self):
+        return pymssql.connect(
+            server=self.server_name,
+            user=self.user,
+            password=self.password,
+            database=self.db_name,
+            autocommit=False
+        )
+
+    def set_autocommit(self, conn, autocommit):
+        conn.autocommit(autocommit)
+        return None
+
+    def cursor(self, conn, as_dict=False):
+        return MSSQLCursor(self, conn, conn.cursor(as_dict=as_dict))
+
+    def prepare(self, conn, query, params):
+        """
+            Get the handle of the query on the connection, it's prepared with sp_prepare on first use.
+            * The placeholders become parameters of the types declared with the query, see Queries.register.
+        """
+        with self.prepared_lock:
+            Entry = self.prepared.get(id(conn))
+            if Entry is None or Entry[0] is not conn:
+                Entry = self.prepared[id(conn)] = (conn, {})
+        Handles = Entry[1]
+        if query.name in Handles:
+            return Handles[query.name]
+        if len(query.types) != len(params):
+            raise ValueError(f"The statement {query.name} takes {len(query.types)} parameters, got {len(params)}. ")
+        Declarations = ", ".join(f"@P{i} {sql_type}" for i, sql_type in enumerate(query.types, start=1))
+        Numbers = itertools.count(1)
+        Text = Query.Placeholder.sub(lambda _: f"@P{next(Numbers)}", query)
+        cursor = conn.cursor()
+        try:
+            cursor.execute(MSSQLBackend.PrepareStatement, (Declarations, Text))
+            # sp_prepare describes the columns of a select as an empty result set first.
+            while cursor.description is None or cursor.description[0][0] != "Handle":
+                if not cursor.nextset():
+                    raise pymssql.DatabaseError(f"sp_prepare returned no handle for {query.name}. ")
+            Handles[query.name] = cursor.fetchone()[0]
+        finally:
+            cursor.close()
+        return Handles[query.name]
+
+    def forget(self, conn):
+        with self.prepared_lock:
+            Entry = self.prepared.get(id(conn))
+            if Entry is not None and Entry[0] is conn:
+                del self.prepared[id(conn)]
+        return None
+
+    def translate(self, sql):
+        return sql
+
+    def add_doses(self, cursor, vaccine, doses):
+        cursor.execute(MSSQLBackend.MergeDoses, (vaccine, doses))
+        return None
+
+    def reserve_appointment(self, cursor, patient_name, vaccine, date, preferred=None):
+        cursor.execute(MSSQLBackend.ReserveAppointment, (patient_name, vaccine, date, preferred))
+        return cursor.fetchone()
+
+    def cancel_appointment(self, cursor, appointment_id, patient_name=None, caregiver_name=None):
+        cursor.execute(MSSQLBackend.CancelAppointment, (appointment_id, patient_name, caregiver_name))
+        return MSSQLBackend.cancel_result(cursor.fetchall())
+
+    def cancel_caregiver_day(self, cursor, caregiver_name, date):
+        cursor.execute(MSSQLBackend.CancelCaregiverDay, (caregiver_name, date))
+        return MSSQLBackend.cancel_result(cursor.fetchall())
+
+    def match_waitlist(self, cursor, today):
+        cursor.execute(MSSQLBackend.MatchWaitlist, (today, ))
+        Row = cursor.fetchone()
+        return {"Matched": Row["Matched"], "Dates": (Row["FirstDate"], Row["LastDate"]) if Row["Matched"] else None}
+
+    @staticmethod
+    def cancel_result(rows):
+        """
+            Sum up the rows of a cancel batch, one per vaccine.
+        """
+        Doses = {row["VaccineType"]: row["Doses"] for row in rows}
+        return {
+            "Cancelled": sum(Doses.values()),
+            "Doses": Doses,
+            "Slots": rows[0]["Slots"] if rows else 0,
+            "Dates": (min(row["FirstDate"] for row in rows), max(row["LastDate"] for row in rows)) if rows else None
+        }
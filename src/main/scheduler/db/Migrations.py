@@ -0,0 +1,123 @@
+import os
+import re
+import sys
+import argparse
+
+
+class Migrations:
+    """
+        Evolves the schema with the numbered scripts of resources/migrations, on top of resources/create.sql.
+        Overview:
+            * A migration is a file named NNNN_description.sql, they are applied in the order of their numbers.
+            * The versions applied are recorded in the SchemaVersion table, a migration is applied once and only
+            once, running the migrations again does nothing.
+            * Every migration runs in its own transaction together with its SchemaVersion row. A failed migration
+            leaves the schema at the version before it.
+            * Scripts are written in T-SQL, batches are separated by GO lines. The backends translate them, see
+            Backend.split_script.
+            * The migration 0000 takes the tables of create.sql, which is the original schema, to the one the other
+            migrations build on. The SCHEMAVERSION Env Var stops the migrations at a version, e.g: 0 for the
+            schema before the covering indexes, -1 for the bare create.sql.
+        Usage, from src/main/scheduler:
+            python -m db.Migrations             # apply the pending migrations
+            python -m db.Migrations --status    # list the migrations and whether they are applied
+    """
+
+    Directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "migrations")
+    FilePattern = re.compile(r"^(\d{4})_(\w+)\.sql$")
+    CreateVersionTable = \
+        "IF OBJECT_ID('SchemaVersion') IS NULL CREATE TABLE SchemaVersion (" + \
+        "Version INT NOT NULL PRIMARY KEY, Name VARCHAR(255) NOT NULL, " + \
+        "AppliedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)"
+    SelectApplied = "SELECT Version FROM SchemaVersion"
+    RecordVersion = "INSERT INTO SchemaVersion (Version, Name) VALUES (%d, %s)"
+
+    @staticmethod
+    def target():
+        Version = os.getenv("SCHEMAVERSION")
+        return None if Version is None else int(Version)
+
+    @staticmethod
+    def available():
+        """
+            Return:
+                The migrations as (version, name, path), by version.
+            Exception:
+                ValueError when two migrations have the same version.
+        """
+        Found = {}
+        for file_name in sorted(os.listdir(Migrations.Directory)) if os.path.isdir(Migrations.Directory) else []:
+            Matched = Migrations.FilePattern.match(file_name)
+            if Matched is None:
+                continue
+            Version = int(Matched.group(1))
+            if Version in Found:
+                raise ValueError(f"Migrations {Found[Version][1]} and {file_name} have the same version. ")
+            Found[Version] = (Version, Matched.group(2), os.path.join(Migrations.Directory, file_name))
+        return [Found[v] for v in sorted(Found)]
+
+    @staticmethod
+    def applied(cursor):
+        cursor.execute(Migrations.CreateVersionTable)
+        cursor.execute(Migrations.SelectApplied)
+        return {row[0] for row in cursor.fetchall()}
+
+    @staticmethod
+    def migrate(backend, conn, target=None):
+        """
+            Apply the pending migrations up to the target version, the latest one when None.
+            conn:
+                A raw connection of the backend, it's switched to auto commit, transactions are explicit.
+            Return:
+                The (version, name) of the migrations applied.
+            Exceptions:
+                The caller's responsibility, the failed migration is rolled back.
+        """
+        target = Migrations.target() if target is None else target
+        backend.set_autocommit(conn, True)
+        cursor = backend.cursor(conn)
+        Applied = Migrations.applied(cursor)
+        Done = []
+        for version, name, path in Migrations.available():
+            if version in Applied or (target is not None and version > target):
+                continue
+            with open(path) as f:
+                Statements = backend.split_script(f.read())
+            cursor.execute("BEGIN TRANSACTION")
+            try:
+                for statement in Statements:
+                    cursor.execute(statement)
+                cursor.execute(Migrations.RecordVersion, (version, name))
+            except BaseException:
+                cursor.execute("ROLLBACK TRANSACTION")
+                raise
+            cursor.execute("COMMIT TRANSACTION")
+            Done.append((version, name))
+        return Done
+
+
+def main():
+    Parser = argparse.ArgumentParser(description="Apply the schema migrations of resources/migrations.")
+    Parser.add_argument("--status", action="store_true", help="list the migrations instead of applying them.")
+    Parser.add_argument("--target", type=int, default=None, help="the version to stop at, the latest by default.")
+    Args = Parser.parse_args()
+    from db.ConnectionManager import ConnectionManager
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    try:
+        if Args.status:
+            Applied = Migrations.applied(cm.backend.cursor(conn))
+            for version, name, _ in Migrations.available():
+                print(f"{version:04d}  {name:<40}{'applied' if version in Applied else 'pending'}")
+            return 0
+        Done = Migrations.migrate(cm.backend, conn, Args.target)
+        for version, name in Done:
+            print(f"Applied {version:04d} {name}")
+        print("The schema is up to date. " if not Done else f"{len(Done)} migration(s) applied. ")
+    finally:
+        cm.close_connection()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
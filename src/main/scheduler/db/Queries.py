@@ -0,0 +1,93 @@
+import re
+import threading
+import collections
+
+
+class Query(str):
+    """
+        A named statement of the registry. It is its own T-SQL text, so it runs on any cursor as it is, the
+        backends recognize it to prepare it and count its executions.
+        * types are the T-SQL types of its %s and %d placeholders, in order, e.g: ("VARCHAR(255)", "DATE").
+    """
+
+    Placeholder = re.compile(r"%[sd]")
+
+    def __new__(cls, name, sql, types=None):
+        query = super().__new__(cls, sql)
+        query.name = name
+        query.types = None if types is None else tuple(types)
+        if query.types is not None and len(query.types) != len(Query.Placeholder.findall(sql)):
+            raise ValueError(
+                f"The statement {name} takes {len(Query.Placeholder.findall(sql))} parameters, " +
+                f"{len(query.types)} types are declared. "
+            )
+        return query
+
+    @property
+    def Preparable(self):
+        """
+            Only the queries with declared types are prepared. They are the selects, the rows affected by a
+            statement run through sp_execute are not reported reliably, and the models check them.
+        """
+        return self.types is not None
+
+
+class Queries:
+    """
+        The registry of the named statements of the scheduler.
+        Overview:
+            * The models and the backends register their statements when they are imported, e.g:
+            GetPatientDetails = Queries.register("patient.details", "SELECT ... WHERE Username = %s",
+            types=("VARCHAR(255)", )).
+            * Backends prepare a registered query with declared types once per pooled connection and then execute
+            it by handle, see MSSQLBackend. SQLite keeps the compiled statements in the statement cache of each
+            connection.
+            * The executions of every statement are counted, see stats(). Statements that are built on the fly,
+            like IN lists of any length, are not registered and run as plain text.
+    """
+
+    Registry = {}  # name -> Query
+    Executions = collections.Counter()
+    Lock = threading.Lock()
+
+    @classmethod
+    def register(cls, name, sql, types=None):
+        """
+            Register a statement, registering the same name, text and types again returns the registered query.
+            types:
+                The T-SQL types of the parameters, the statement is never prepared when None.
+            Exception:
+                ValueError when the name is registered with another text or other types, or the number of types
+                isn't the number of parameters.
+        """
+        types = None if types is None else tuple(types)
+        with cls.Lock:
+            Found = cls.Registry.get(name)
+            if Found is None:
+                Found = cls.Registry[name] = Query(name, sql, types)
+            elif str(Found) != sql or Found.types != types:
+                raise ValueError(f"The statement {name} is already registered with another text or types. ")
+        return Found
+
+    @classmethod
+    def get(cls, name):
+        return cls.Registry[name]
+
+    @classmethod
+    def count(cls, sql):
+        """
+            Count one execution of the statement when it is a registered query.
+        """
+        if isinstance(sql, Query):
+            with cls.Lock:
+                cls.Executions[sql.name] += 1
+        return None
+
+    @classmethod
+    def stats(cls):
+        """
+            Return:
+                (name, executions) of the registered statements, the most executed first.
+        """
+        with cls.Lock:
+            return sorted(((name, cls.Executions[name]) for name in cls.Registry), key=lambda s: (-s[1], s[0]))
@@ -0,0 +1,456 @@
+import os
+import re
+import sqlite3
+import datetime
+import heapq
+import functools
+import collections
+from db.Backend import Backend
+from db.Migrations import Migrations
+from db.Queries import Queries
+
+
+def _adapt_date(value):
+    return value.strftime("%Y-%m-%d")
+
+
+def _convert_date(value):
+    return datetime.date.fromisoformat(value.decode())
+
+
+# DATE columns hold ISO strings in SQLite, map them to the same python types pymssql gives us.
+sqlite3.register_adapter(datetime.date, _adapt_date)
+sqlite3.register_adapter(datetime.datetime, _adapt_date)
+sqlite3.register_converter("DATE", _convert_date)
+
+
+# The models run a fixed set of queries, each is translated once. The cache is keyed by the query only, a
+# cached method would keep every backend and its connection alive.
+@functools.lru_cache(maxsize=256)
+def _translate(sql):
+    sql = re.sub(r"%[sd]", "?", sql)
+    sql = re.sub(r"\b(RAND|NEWID)\(\)", "RANDOM()", sql, flags=re.I)
+    sql = re.sub(r"\bMIN_ACTIVE_ROWVERSION\(\)", "9223372036854775807", sql, flags=re.I)
+    sql = re.sub(r"\s+WITH\s*\(\s*(?:UPDLOCK|HOLDLOCK|ROWLOCK|READPAST|NOLOCK)\b[\w\s,]*\)", "", sql, flags=re.I)
+    sql = re.sub(r"\bOFFSET\s+(\?|\d+)\s+ROWS?\s+FETCH\s+(?:NEXT|FIRST)\s+(\?|\d+)\s+ROWS?\s+ONLY\b",
+                 r"LIMIT \1, \2", sql, flags=re.I)
+    Top = re.match(r"^(\s*SELECT\s+)TOP\s*\(?\s*(\d+)\s*\)?\s+", sql, flags=re.I)
+    if Top is not None:
+        sql = Top.group(1) + sql[Top.end():].rstrip().rstrip(";") + f" LIMIT {Top.group(2)}"
+    return sql
+
+
+class SQLiteCursor:
+    """
+        Wraps a sqlite3 cursor so it can run the T-SQL queries of the models, the same way as a pymssql
+        cursor.
+        * Parameters can be a single value, as pymssql allows.
+        * Dates with single digit months or days are zero padded, SQL Server parses them as dates but SQLite
+        compares them as strings.
+    """
+
+    DatePattern = re.compile(r"^(\d{4})-(\d{1,2})-(\d{1,2})$")
+
+    def __init__(self, backend, cursor, as_dict=False):
+        self.backend = backend
+        self.cursor = cursor
+        if as_dict:
+            self.cursor.row_factory = SQLiteCursor.dict_row
+
+    @staticmethod
+    def dict_row(cursor, row):
+        return {column[0]: value for column, value in zip(cursor.description, row)}
+
+    @staticmethod
+    def adapt(params):
+        if params is None:
+            return ()
+        if not isinstance(params, (tuple, list, dict)):
+            params = (params, )
+        if isinstance(params, dict):
+            return params
+        return tuple(SQLiteCursor.adapt_value(value) for value in params)
+
+    @staticmethod
+    def adapt_value(value):
+        if isinstance(value, str):
+            matched = SQLiteCursor.DatePattern.match(value)
+            if matched is not None:
+                return f"{matched.group(1)}-{int(matched.group(2)):02d}-{int(matched.group(3)):02d}"
+        return value
+
+    def execute(self, sql, params=None):
+        Queries.count(sql)
+        self.cursor.execute(self.backend.translate(sql), SQLiteCursor.adapt(params))
+        return None
+
+    def executemany(self, sql, seq_of_params):
+        Queries.count(sql)
+        self.cursor.executemany(self.backend.translate(sql), (SQLiteCursor.adapt(p) for p in seq_of_params))
+        return None
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self.cursor.fetchmany(self.cursor.arraysize if size is None else size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    def close(self):
+        self.cursor.close()
+        return None
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self.cursor.lastrowid
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+class SQLiteBackend(Backend):
+    """
+        An embedded SQLite engine, the schema is loaded from resources/create.sql on first use.
+        * DBNAME Env Var is the path of the database file, it defaults to an in-memory database shared by every
+        connection of the process.
+        * The in-memory database uses a shared cache, which locks whole tables. Use a file for heavily
+        concurrent workloads.
+    """
+
+    Name = "sqlite"
+    UpsertDoses = Queries.register(
+        "vaccine.upsert_doses",
+        "INSERT INTO Vaccines (Name, Doses) VALUES (%s, %d) " +
+        "ON CONFLICT (Name) DO UPDATE SET Doses = Doses + excluded.Doses")
+    SelectDoses = Queries.register("reserve.select_doses", "SELECT Doses FROM Vaccines WHERE Name = %s")
+    TakeDose = Queries.register(
+        "reserve.take_dose", "UPDATE Vaccines SET Doses = Doses - 1 WHERE Name = %s AND Doses > 0")
+    SelectPreferred = Queries.register(
+        "reserve.select_preferred",
+        "SELECT Username FROM Availabilities WHERE Time = %s AND Username = %s AND Capacity > 0")
+    SelectCaregiver = Queries.register(
+        "reserve.select_caregiver",
+        "SELECT TOP 1 a.Username FROM Availabilities AS a JOIN Caregivers AS c ON c.Username = a.Username " +
+        "WHERE a.Time = %s AND a.Capacity > 0 ORDER BY a.Capacity DESC, c.Booked, a.Username")
+    ClaimSlot = Queries.register(
+        "reserve.claim_slot", "UPDATE Availabilities SET Capacity = Capacity - 1 WHERE Time = %s AND Username = %s")
+    CountBooking = Queries.register(
+        "reserve.count_booking", "UPDATE Caregivers SET Booked = Booked + 1 WHERE Username = %s")
+    InsertAppointment = Queries.register(
+        "reserve.insert_appointment",
+        "INSERT INTO Appointments (PatientName, CareGiverName, AppointmentDate, VaccineType) VALUES (%s, %s, %s, %s)")
+    LeaveWaitlist = Queries.register(
+        "reserve.leave_waitlist", "DELETE FROM Waitlist WHERE PatientName = %s AND VaccineType = %s")
+    SelectCancelled = Queries.register(
+        "cancel.select",
+        "SELECT CareGiverName, AppointmentDate, VaccineType FROM Appointments " +
+        "WHERE Id = %d AND (PatientName = %s OR CareGiverName = %s)")
+    DeleteCancelled = Queries.register(
+        "cancel.delete", "DELETE FROM Appointments WHERE Id = %d AND (PatientName = %s OR CareGiverName = %s)")
+    SelectCaregiverDay = Queries.register(
+        "cancel.select_caregiver_day",
+        "SELECT CareGiverName, AppointmentDate, VaccineType FROM Appointments " +
+        "WHERE CareGiverName = %s AND AppointmentDate = %s")
+    DeleteCaregiverDay = Queries.register(
+        "cancel.delete_caregiver_day", "DELETE FROM Appointments WHERE CareGiverName = %s AND AppointmentDate = %s")
+    RemoveSlot = Queries.register(
+        "cancel.remove_slot", "DELETE FROM Availabilities WHERE Username = %s AND Time = %s")
+    ReturnDoses = Queries.register(
+        "cancel.return_doses", "UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s")
+    UncountBookings = Queries.register(
+        "cancel.uncount_bookings", "UPDATE Caregivers SET Booked = Booked - %d WHERE Username = %s")
+    RestoreCapacity = Queries.register(
+        "cancel.restore_capacity",
+        "UPDATE Availabilities SET Capacity = Capacity + 1 WHERE Time = %s AND Username = %s")
+    RestoreSlot = Queries.register(
+        "cancel.restore_slot",
+        "INSERT INTO Availabilities (Time, Username, Capacity) SELECT %s, %s, 1 " +
+        "WHERE NOT EXISTS (SELECT 1 FROM Availabilities WHERE Time = %s AND Username = %s)")
+    DropExpiredWaits = Queries.register("waitlist.drop_expired", "DELETE FROM Waitlist WHERE AppointmentDate < %s")
+    SelectWaiting = Queries.register(
+        "waitlist.waiting", "SELECT Id, PatientName, AppointmentDate, VaccineType FROM Waitlist ORDER BY Id")
+    SelectDosesLeft = Queries.register(
+        "waitlist.doses",
+        "SELECT Name, Doses FROM Vaccines WHERE Doses > 0 AND Name IN (SELECT VaccineType FROM Waitlist)")
+    SelectFreeSlots = Queries.register(
+        "waitlist.slots",
+        "SELECT a.Time, a.Username, a.Capacity, c.Booked FROM Availabilities AS a " +
+        "JOIN Caregivers AS c ON c.Username = a.Username " +
+        "WHERE a.Time IN (SELECT AppointmentDate FROM Waitlist) AND a.Capacity > 0")
+    CountBookings = Queries.register(
+        "waitlist.count_bookings", "UPDATE Caregivers SET Booked = Booked + %d WHERE Username = %s")
+    TakeDoses = Queries.register("waitlist.take_doses", "UPDATE Vaccines SET Doses = Doses - %d WHERE Name = %s")
+    Statements = {
+        Migrations.CreateVersionTable:
+            "CREATE TABLE IF NOT EXISTS SchemaVersion (" +
+            "Version INT NOT NULL PRIMARY KEY, Name VARCHAR(255) NOT NULL, " +
+            "AppliedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP)",
+    }
+    CachedStatements = 256
+    SchemaPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "resources", "create.sql")
+    MemoryURI = "file:scheduler-{pid}?mode=memory&cache=shared"
+
+    def __init__(self):
+        path = os.getenv("DBNAME")
+        if path is None or path == ":memory:":
+            self.database = SQLiteBackend.MemoryURI.format(pid=os.getpid())
+        else:
+            self.database = "file:" + os.path.abspath(path)
+        # An in-memory database lives as long as one connection to it is open, this one keeps it alive.
+        self.keeper = None
+        self.keeper = self.connect()
+
+    def connect(self):
+        conn = sqlite3.connect(
+            self.database,
+            uri=True,
+            detect_types=sqlite3.PARSE_DECLTYPES,
+            check_same_thread=False,  # the pool moves connections between threads.
+            timeout=30,
+            cached_statements=SQLiteBackend.CachedStatements  # compiled once per connection, see db.Queries.
+        )
+        conn.execute("PRAGMA foreign_keys = ON")
+        if self.keeper is None:
+            self.load_schema(conn)
+        return conn
+
+    def load_schema(self, conn):
+        """
+            Create the tables from create.sql unless they are already there, then apply the pending migrations.
+        """
+        Exists = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = 'Caregivers'")
+        if Exists.fetchone()[0] == 0:
+            with open(SQLiteBackend.SchemaPath) as f:
+                script = f.read()
+            conn.executescript(SQLiteBackend.translate_ddl(script))
+        Migrations.migrate(self, conn)
+        return None
+
+    def split_script(self, script):
+        """
+            Translate a T-SQL script and split it into statements, a trigger body is part of its statement.
+        """
+        Statements, Current = [], ""
+        for batch in super().split_script(script):
+            for line in SQLiteBackend.translate_ddl(batch).splitlines(keepends=True):
+                Current += line
+                if sqlite3.complete_statement(Current):
+                    Statements.append(Current.strip())
+                    Current = ""
+        if Current.strip() != "":
+            Statements.append(Current.strip())
+        return Statements
+
+    # SQLite has no rowversion, these triggers bump the column past the largest version of the table instead.
+    RowVersionTriggers = """
+CREATE TRIGGER {table}_{column}_Insert AFTER INSERT ON {table} BEGIN
+    UPDATE {table} SET {column} = (SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}) WHERE rowid = NEW.rowid;
+END;
+CREATE TRIGGER {table}_{column}_Update AFTER UPDATE ON {table} WHEN NEW.{column} = OLD.{column} BEGIN
+    UPDATE {table} SET {column} = (SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}) WHERE rowid = NEW.rowid;
+END;
+"""
+
+    @staticmethod
+    def translate_ddl(script):
+        """
+            Rewrite the T-SQL create table statements for SQLite.
+            * An IDENTITY column becomes an INTEGER PRIMARY KEY, which is how SQLite auto increments.
+            * A ROWVERSION column becomes an INTEGER maintained by triggers, whether the table is created with it
+            or it's added by ALTER TABLE.
+            * The INCLUDE columns of an index are appended to its key, SQLite has no included columns.
+            * DROP INDEX name ON table loses its table, index names are unique in the whole database.
+        """
+        for column in re.findall(r"(\w+)\s+INT\s+NOT\s+NULL\s+IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)", script, re.I):
+            script = re.sub(rf"{column}\s+INT\s+NOT\s+NULL\s+IDENTITY\s*\(\s*\d+\s*,\s*\d+\s*\)",
+                            f"{column} INTEGER PRIMARY KEY AUTOINCREMENT", script, flags=re.I)
+            script = re.sub(rf",\s*PRIMARY\s+KEY\s*\(\s*{column}\s*\)", "", script, flags=re.I)
+        Triggers = ""
+        for table, body in re.findall(r"CREATE\s+TABLE\s+(\w+)\s*\((.*?)\);", script, flags=re.I | re.S):
+            for column in re.findall(r"(\w+)\s+ROWVERSION\b", body, flags=re.I):
+                Triggers += SQLiteBackend.RowVersionTriggers.format(table=table, column=column)
+        for table, column in re.findall(r"ALTER\s+TABLE\s+(\w+)\s+ADD\s+(\w+)\s+ROWVERSION\b", script, flags=re.I):
+            Triggers += SQLiteBackend.RowVersionTriggers.format(table=table, column=column)
+        script = re.sub(r"\bROWVERSION\b", "INTEGER NOT NULL DEFAULT 0", script, flags=re.I)
+        script = re.sub(r"\)\s*INCLUDE\s*\(([^)]*)\)", r", \1)", script, flags=re.I)
+        script = re.sub(r"\b(DROP\s+INDEX\s+\w+)\s+ON\s+\w+", r"\1", script, flags=re.I)
+        return script + "\n" + Triggers
+
+    def set_autocommit(self, conn, autocommit):
+        conn.isolation_level = None if autocommit else ""
+        return None
+
+    def cursor(self, conn, as_dict=False):
+        return SQLiteCursor(self, conn.cursor(), as_dict=as_dict)
+
+    def add_doses(self, cursor, vaccine, doses):
+        cursor.execute(SQLiteBackend.UpsertDoses, (vaccine, doses))
+        return None
+
+    def reserve_appointment(self, cursor, patient_name, vaccine, date, preferred=None):
+        """
+            The same steps as the T-SQL batch of the MSSQL backend, in process they cost no round trip.
+            * BEGIN IMMEDIATE takes the write lock upfront, so two reservations can't claim the same slot.
+        """
+        Result = {"Status": "OK", "Id": None, "Caregiver": None}
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(SQLiteBackend.SelectDoses, (vaccine, ))
+            Row = cursor.fetchone()
+            if Row is None:
+                Result["Status"] = "NO_VACCINE"
+            elif Row["Doses"] is None or Row["Doses"] <= 0:
+                Result["Status"] = "NO_DOSES"
+            else:
+                Row = None
+                if preferred is not None:
+                    cursor.execute(SQLiteBackend.SelectPreferred, (date, preferred))
+                    Row = cursor.fetchone()
+                if Row is None:
+                    cursor.execute(SQLiteBackend.SelectCaregiver, (date, ))
+                    Row = cursor.fetchone()
+                if Row is None:
+                    Result["Status"] = "NO_CAREGIVER"
+                else:
+                    Result["Caregiver"] = Row["Username"]
+                    cursor.execute(SQLiteBackend.ClaimSlot, (date, Result["Caregiver"]))
+                    cursor.execute(SQLiteBackend.CountBooking, (Result["Caregiver"], ))
+                    cursor.execute(SQLiteBackend.InsertAppointment, (patient_name, Result["Caregiver"], date, vaccine))
+                    Result["Id"] = cursor.lastrowid
+                    cursor.execute(SQLiteBackend.TakeDose, (vaccine, ))
+                    cursor.execute(SQLiteBackend.LeaveWaitlist, (patient_name, vaccine))
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT" if Result["Status"] == "OK" else "ROLLBACK")
+        if Result["Status"] != "OK":
+            Result["Caregiver"] = None
+        return Result
+
+    def cancel_appointment(self, cursor, appointment_id, patient_name=None, caregiver_name=None):
+        Params = (appointment_id, patient_name, caregiver_name)
+        return self.cancel_appointments(
+            cursor, SQLiteBackend.SelectCancelled, SQLiteBackend.DeleteCancelled, Params
+        )
+
+    def cancel_caregiver_day(self, cursor, caregiver_name, date):
+        return self.cancel_appointments(
+            cursor, SQLiteBackend.SelectCaregiverDay, SQLiteBackend.DeleteCaregiverDay, (caregiver_name, date),
+            remove_slot=(caregiver_name, date)
+        )
+
+    def cancel_appointments(self, cursor, select, delete, params, remove_slot=None):
+        """
+            The same steps as the T-SQL batches of the MSSQL backend: the appointments selected are deleted,
+            then the doses and the bookings are given back with one update per vaccine and per caregiver.
+            remove_slot:
+                (caregiver, date) of a slot to remove instead of restoring the slots of the appointments.
+        """
+        Result = {"Cancelled": 0, "Doses": {}, "Slots": 0, "Dates": None}
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(select, params)
+            Cancelled = cursor.fetchall()
+            cursor.execute(delete, params)
+            Doses, Bookings = collections.Counter(), collections.Counter()
+            for row in Cancelled:
+                Doses[row["VaccineType"]] += 1
+                Bookings[row["CareGiverName"]] += 1
+            cursor.executemany(SQLiteBackend.ReturnDoses, [(count, name) for name, count in Doses.items()])
+            cursor.executemany(SQLiteBackend.UncountBookings, [(count, name) for name, count in Bookings.items()])
+            if remove_slot is not None:
+                cursor.execute(SQLiteBackend.RemoveSlot, remove_slot)
+            else:
+                for row in Cancelled:
+                    day, caregiver = row["AppointmentDate"], row["CareGiverName"]
+                    cursor.execute(SQLiteBackend.RestoreCapacity, (day, caregiver))
+                    if cursor.rowcount == 0:
+                        cursor.execute(SQLiteBackend.RestoreSlot, (day, caregiver, day, caregiver))
+                    Result["Slots"] += 1
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+        Result["Cancelled"], Result["Doses"] = len(Cancelled), dict(Doses)
+        if len(Cancelled) > 0:
+            Days = [row["AppointmentDate"] for row in Cancelled]
+            Result["Dates"] = (min(Days), max(Days))
+        return Result
+
+    def match_waitlist(self, cursor, today):
+        """
+            The queue, the doses and the free slots are read once, the patients are matched one by one in the
+            order they arrived, then the bookings are written with one statement per table.
+            * A patient booked for a vaccine leaves its waitlist on the other dates, like reserve does.
+        """
+        Matches, Served = [], set()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            cursor.execute(SQLiteBackend.DropExpiredWaits, (today, ))
+            cursor.execute(SQLiteBackend.SelectWaiting)
+            Waiting = cursor.fetchall()
+            if len(Waiting) > 0:
+                cursor.execute(SQLiteBackend.SelectDosesLeft)
+                Doses = {row["Name"]: row["Doses"] for row in cursor.fetchall()}
+                cursor.execute(SQLiteBackend.SelectFreeSlots)
+                # date -> heap of (-capacity, booked, caregiver), in the allocation order of reserve. A caregiver
+                # booked on another date meanwhile has an outdated count, it's updated when it reaches the top.
+                Slots, Booked = collections.defaultdict(list), {}
+                for row in cursor.fetchall():
+                    Slots[row["Time"]].append((-row["Capacity"], row["Booked"], row["Username"]))
+                    Booked[row["Username"]] = row["Booked"]
+                for heap in Slots.values():
+                    heapq.heapify(heap)
+                for row in Waiting:
+                    Heap, Patient = Slots[row["AppointmentDate"]], (row["PatientName"], row["VaccineType"])
+                    if Patient not in Served and Doses.get(row["VaccineType"], 0) > 0 and len(Heap) > 0:
+                        while Heap[0][1] != Booked[Heap[0][2]]:
+                            heapq.heapreplace(Heap, (Heap[0][0], Booked[Heap[0][2]], Heap[0][2]))
+                        Doses[row["VaccineType"]] -= 1
+                        Capacity, _, Caregiver = heapq.heappop(Heap)
+                        Booked[Caregiver] += 1
+                        if Capacity < -1:
+                            heapq.heappush(Heap, (Capacity + 1, Booked[Caregiver], Caregiver))
+                        Matches.append((row, Caregiver))
+                        Served.add(Patient)
+            cursor.executemany(SQLiteBackend.InsertAppointment, [
+                (row["PatientName"], caregiver, row["AppointmentDate"], row["VaccineType"]) for row, caregiver in Matches
+            ])
+            Claimed = [(row["AppointmentDate"], caregiver) for row, caregiver in Matches]
+            cursor.executemany(SQLiteBackend.ClaimSlot, Claimed)
+            Bookings = collections.Counter(caregiver for _, caregiver in Matches)
+            cursor.executemany(SQLiteBackend.CountBookings, [(count, name) for name, count in Bookings.items()])
+            Taken = collections.Counter(row["VaccineType"] for row, _ in Matches)
+            cursor.executemany(SQLiteBackend.TakeDoses, [(count, name) for name, count in Taken.items()])
+            cursor.executemany(SQLiteBackend.LeaveWaitlist, Served)
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+        Days = [row["AppointmentDate"] for row, _ in Matches]
+        return {"Matched": len(Matches), "Dates": (min(Days), max(Days)) if Days else None}
+
+    def translate(self, sql):
+        """
+            Rewrite a T-SQL query of the models for SQLite.
+            * %s and %d placeholders become ?.
+            * SELECT TOP n becomes a trailing LIMIT n.
+            * OFFSET o ROWS FETCH NEXT n ROWS ONLY becomes LIMIT o, n, which keeps the order of the parameters.
+            * RAND() and NEWID() become RANDOM().
+            * MIN_ACTIVE_ROWVERSION() becomes the largest integer, SQLite never exposes uncommitted versions.
+            * Table hints such as WITH (UPDLOCK, HOLDLOCK) are dropped, a SQLite transaction has the whole database
+            to itself once it writes.
+        """
+        if sql in self.Statements:
+            return self.Statements[sql]
+        return _translate(sql)
@@ -0,0 +1,160 @@
+import os
+import re
+import sys
+import time
+import threading
+import functools
+
+
+class QueryStats:
+    """
+        What the statements of one fingerprint cost so far.
+    """
+
+    __slots__ = ("fingerprint", "count", "total", "max", "slow")
+
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+
+    def as_dict(self):
+        return {
+            "fingerprint": self.fingerprint,
+            "count": self.count,
+            "total_ms": round(self.total*1000, 3),
+            "mean_ms": round(self.total*1000/self.count, 3) if self.count else None,
+            "max_ms": round(self.max*1000, 3),
+            "slow": self.slow,
+        }
+
+
+class SlowQueryLog:
+    """
+        Times every statement sent through the ConnectionManager cursors and groups them by fingerprint, the
+        statement text with its literals and placeholders replaced by ?, so the same query with other values is
+        counted once.
+        Overview:
+            * Enabled by the SLOWQUERYMS Env Var, the threshold in milliseconds. Unset, the cursors are not
+            wrapped at all.
+            * Statements slower than the threshold are logged with their parameters redacted to their types,
+            to stderr or to the SLOWQUERYFILE Env Var file.
+            * report() gives the count, total and max time of every fingerprint, the most expensive first.
+    """
+
+    Threshold = None if os.getenv("SLOWQUERYMS") is None else float(os.getenv("SLOWQUERYMS"))/1000
+    LogPath = os.getenv("SLOWQUERYFILE")
+    Stats = {}  # fingerprint -> QueryStats
+    StatsLock = threading.Lock()
+
+    @classmethod
+    def enabled(cls):
+        return cls.Threshold is not None
+
+    @classmethod
+    def cursor(cls, cursor):
+        """
+            Wrap a cursor so its statements are timed, the cursor itself when disabled.
+        """
+        return LoggedCursor(cursor) if cls.enabled() else cursor
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def fingerprint(sql):
+        """
+            Normalize a statement: the literals and placeholders become ?, IN lists collapse to IN (...) and the
+            whitespace to single spaces.
+        """
+        sql = re.sub(r"'(?:[^']|'')*'", "?", sql)
+        sql = re.sub(r"%[sd]|\b\d+(?:\.\d+)?\b", "?", sql)
+        sql = re.sub(r"\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)", "IN (...)", sql, flags=re.I)
+        return " ".join(sql.split())
+
+    @staticmethod
+    def redact(params):
+        """
+            Replace the parameter values by their types, passwords hashes and names never reach the log.
+        """
+        if params is None:
+            return "()"
+        if not isinstance(params, (tuple, list)):
+            params = (params, )
+        return "(" + ", ".join(type(value).__name__ for value in params) + ")"
+
+    @classmethod
+    def record(cls, sql, params, elapsed, rows_of_batch=None):
+        Fingerprint = cls.fingerprint(sql)
+        with cls.StatsLock:
+            Stats = cls.Stats.get(Fingerprint)
+            if Stats is None:
+                Stats = cls.Stats[Fingerprint] = QueryStats(Fingerprint)
+            Stats.count += 1
+            Stats.total += elapsed
+            Stats.max = max(Stats.max, elapsed)
+            if elapsed >= cls.Threshold:
+                Stats.slow += 1
+        if elapsed >= cls.Threshold:
+            Params = f"{rows_of_batch} rows of {cls.redact(params)}" if rows_of_batch is not None \
+                else cls.redact(params)
+            cls.write(f"[slow query] {elapsed*1000:.3f}ms {Fingerprint} params={Params}")
+        return None
+
+    @classmethod
+    def write(cls, line):
+        Line = f"{time.strftime('%Y-%m-%d %H:%M:%S')} {line}\n"
+        if cls.LogPath is None:
+            sys.stderr.write(Line)
+        else:
+            with open(cls.LogPath, "a") as f:
+                f.write(Line)
+        return None
+
+    @classmethod
+    def report(cls, limit=None):
+        """
+            Return:
+                The stats of the fingerprints as dicts, by total time spent, the most expensive first.
+        """
+        with cls.StatsLock:
+            Stats = sorted(cls.Stats.values(), key=lambda s: s.total, reverse=True)
+            return [s.as_dict() for s in Stats[:limit]]
+
+    @classmethod
+    def reset(cls):
+        with cls.StatsLock:
+            cls.Stats = {}
+        return None
+
+
+class LoggedCursor:
+    """
+        A database cursor that reports the time of its statements to the SlowQueryLog.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def execute(self, sql, params=None):
+        Start = time.perf_counter()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            SlowQueryLog.record(sql, params, time.perf_counter() - Start)
+
+    def executemany(self, sql, seq_of_params):
+        seq_of_params = list(seq_of_params)
+        Start = time.perf_counter()
+        try:
+            return self.cursor.executemany(sql, seq_of_params)
+        finally:
+            SlowQueryLog.record(
+                sql, seq_of_params[0] if seq_of_params else None, time.perf_counter() - Start, len(seq_of_params)
+            )
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
@@ -3,47 +3,48 @@ from model.Caregiver import Caregiver
 from model.Patient import Patient
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
 import datetime
 
+from util.Session import Session
 import Scheduler
 
+SESSION = Session()
+
 def CreateLoginTestPatientUser():
-    Scheduler.logout([''])
-    Scheduler.CURRENT_PATIENT = None
-    Scheduler.CURRENT_CAREGIVER = None
-    Scheduler.create_patient(["", "test", "test"])
-    Scheduler.login_patient(["", "test", "test"])
+    Scheduler.logout([''], SESSION)
+    Scheduler.create_patient(["", "test", "test"], SESSION)
+    Scheduler.login_patient(["", "test", "test"], SESSION)
     return None
 
 
 def CreateLoginTestCaregiver():
-    Scheduler.logout([''])
-    Scheduler.create_caregiver(['', "test", "test"])
-    Scheduler.logout([''])
-    Scheduler.login_caregiver(['', "test", "test"])
+    Scheduler.logout([''], SESSION)
+    Scheduler.create_caregiver(['', "test", "test"], SESSION)
+    Scheduler.logout([''], SESSION)
+    Scheduler.login_caregiver(['', "test", "test"], SESSION)
     return None
 
 
 def CheckAvailability():
-    Scheduler.search_caregiver_schedule(['', "2222-02-22"])
+    Scheduler.search_caregiver_schedule(['', "2222-02-22"], SESSION)
     return None
 
 def CheckAppointmentsListing():
-    Scheduler.show_appointments([])
+    Scheduler.show_appointments([], SESSION)
     return None
 
 
 def TryToReserve():
-    Scheduler.reserve([''])
+    Scheduler.reserve([''], SESSION)
     print("Expect Token Error Message")
-    Scheduler.reserve(['', '', ''])
+    Scheduler.reserve(['', '', ''], SESSION)
     print("Expect Error Message")
-    Scheduler.reserve(['', 'p', '2222-02-22'])
+    Scheduler.reserve(['', 'p', '2222-02-22'], SESSION)
     print("Expect Error Message")
-    Scheduler.reserve(['', 'Pfzer', '2002-02-02'])
+    Scheduler.reserve(['', 'Pfzer', '2002-02-02'], SESSION)
     print("Expect Error Message")
-    Scheduler.reserve(['', 'Pfzer', '2222-02-22'])
+    Scheduler.reserve(['', 'Pfzer', '2222-02-22'], SESSION)
     print("Expect no Error Message")
     return None
 
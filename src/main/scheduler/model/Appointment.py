@@ -3,6 +3,11 @@ sys.path.append("../util/*")
 sys.path.append("../db/*")
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
+from db.Queries import Queries
+from model.VaccineCatalog import VaccineCatalog
+from model.Waitlist import Waitlist
+from model.SlotIndex import SlotIndex
+from model.Rows import AppointmentRow, stream_rows
 import datetime
 
 
@@ -12,16 +17,27 @@ class Appointment:
         at certain date.
 
     """
-    VaccineExists = "SELECT COUNT(*) AS C FROM Vaccines WHERE Name = %s"
-    CareGiverScheduleExists = "SELECT COUNT(*) AS C FROM Availabilities WHERE Time = %s"
-    InsertAppointment = "INSERT INTO Appointments VALUES(%s, %s, %s, %s)"
-    GetRandomCaregiver = "SELECT TOP 1 Username FROM Availabilities WHERE Time = %s ORDER BY RAND()"
-    SelectAppointmentsForPatient = \
-        "SELECT id, PatientName, CareGiverName, AppointmentDate, VaccineType FROM Appointments" + \
-        " WHERE PatientName = %s"
-    SelectAppointmentsForCaregiver = \
-        "SELECT id, PatientName, CareGiverName, AppointmentDate, VaccineType FROM Appointments" + \
-        " WHERE CareGiverName = %s"
+    SelectAppointmentsForPatient = Queries.register(
+        "appointments.patient",
+        "SELECT Id AS id, PatientName, CareGiverName, AppointmentDate, VaccineType FROM Appointments" +
+        " WHERE PatientName = %s", types=("VARCHAR(255)", ))
+    SelectAppointmentsForCaregiver = Queries.register(
+        "appointments.caregiver",
+        "SELECT Id AS id, PatientName, CareGiverName, AppointmentDate, VaccineType FROM Appointments" +
+        " WHERE CareGiverName = %s", types=("VARCHAR(255)", ))
+    # Keyset pagination: a page starts right after the appointment with the given id, in the order of the page.
+    AfterId = " AND Id > %d"
+    AfterDate = \
+        " AND (AppointmentDate > (SELECT AppointmentDate FROM Appointments WHERE Id = %d)" + \
+        " OR (AppointmentDate = (SELECT AppointmentDate FROM Appointments WHERE Id = %d) AND Id > %d))"
+    OrderById = " ORDER BY Id"
+    OrderByDate = " ORDER BY AppointmentDate, Id"
+    FetchPage = " OFFSET 0 ROWS FETCH NEXT %d ROWS ONLY"
+    # Rows fetched from the database at a time while streaming.
+    FetchSize = 500
+
+    __slots__ = ("patient_instance", "caregiver_instance", "patient_name", "caregiver_name", "date",
+                 "appointment_id", "vaccine", "is_validated")
 
     def __init__(self, vaccine:str=None, date:str=None, appointment_id=None, patient_instance=None, caregiver_instance=None):
         """
@@ -49,19 +65,20 @@ class Appointment:
     def AppointmentID(self):
         return self.appointment_id
 
+    @property
+    def CaregiverName(self):
+        return self.caregiver_name
+
     def validate_appointment(self):
         """
-            Checks the appointment for the patience.
+            Checks the appointment for the patience, without touching the database.
             None will be returned if appointment it's successfully validated. If there is something
             wrong while validating the given appointment, Error messages will be returned to the caller for
             processing.
             * no need to validate user because it already exists in the database.
-            * validate vaccine to see if it's actually there.
             * validate date and check if it's legit.
             * validate if the date is in the future.
-            * validate if any caregiver is available at the given date.
-            Exceptions:
-                Handle by the caller.
+            * The vaccine and the caregivers are validated by reserve, in the same transaction that books it.
         """
         if self.appointment_id is not None:
             # this is already a validated appointment if this field exists.
@@ -83,54 +100,114 @@ class Appointment:
             return f"The appointment date comes before today's day. " + \
                   f"Appointment date is: {AppointmentDate.strftime('%Y-%m-%d')}" + \
                   f" Today's date is: {TodayDateTime.strftime('%Y-%m-%d')}"
+        self.is_validated = True
+        return None
 
-        # ------ validate vaccine, care giver -----
+    def reserve(self, wait=False):
+        """
+            Validate and book the appointment in a single transaction, which is a single round trip to
+            the database: the vaccine must have doses left, the availability slot of a caregiver on the date is
+            claimed, the appointment is inserted and one dose is taken from the vaccine. The caregiver is picked
+            by the SlotIndex, the database allocates another one when the index is out of date.
+            None will be returned if the appointment is booked, AppointmentID and CaregiverName are set then.
+            Otherwise, the error message is returned and nothing is changed in the database. When there is no
+            caregiver or no dose left, the patient joins the waitlist if they asked to, see wait().
+            * A booked patient leaves the waitlist of the vaccine, in the same transaction, so the waitlist doesn't
+            book them a second time.
+            wait:
+                Whether to join the waitlist when the appointment can't be booked.
+            Exceptions:
+                The caller's responsibility.
+        """
+        ValidationResults = self.validate_appointment()
+        if ValidationResults is not None:
+            return ValidationResults
+        if self.appointment_id is not None:
+            return "The appointment has already been booked. "
+        if not VaccineCatalog.get().exists(self.vaccine):
+            return f"Vaccine: \"{self.vaccine}\" doesn't exist in the database."
+        Day, Slots = Util.ParseDate(self.date), SlotIndex.get()
+        Preferred = Slots.best(Day)
         cm = ConnectionManager()
         with cm as cursor:
-            cursor.execute(Appointment.VaccineExists, (self.vaccine, ))
-            Flag = None
-            for row in cursor:
-                # vaccine exists.
-                Flag = row["C"]
-            if Flag != 1:
-                return f"Vaccine: \"{self.vaccine}\" doesn't exist in the database."
-            cursor.execute(Appointment.CareGiverScheduleExists, (self.date, ))
-            Flag = None
-            for row in cursor:
-                # caregiver exists
-                Flag = row["C"]
-            if Flag < 1:
-                return f"Current, No caregiver is available for the date: {self.date} " + \
-                        "try another date please. "
-        self.is_validated = True
+            Result = cm.backend.reserve_appointment(cursor, self.patient_name, self.vaccine, self.date, Preferred)
+        if Result["Status"] == "OK" and Result["Caregiver"] == Preferred:
+            Slots.take(Day, Preferred)
+        elif Result["Status"] == "OK" or Result["Status"] == "NO_CAREGIVER" and Preferred is not None:
+            Slots.invalidate([Day])  # another process changed the slots of the date since the index was loaded.
+        if Result["Status"] == "NO_VACCINE":
+            return f"Vaccine: \"{self.vaccine}\" doesn't exist in the database."
+        if Result["Status"] == "NO_DOSES":
+            return f"Vaccine: \"{self.vaccine}\" has no doses left, try another vaccine please. " + \
+                (self.wait() if wait else self.wait_hint())
+        if Result["Status"] == "NO_CAREGIVER":
+            Earliest = Slots.earliest(Day)
+            return f"Current, No caregiver is available for the date: {self.date} " + \
+                    "try another date please. " + \
+                    ("" if Earliest is None else f"The earliest date with a free caregiver is {Earliest}. ") + \
+                    (self.wait() if wait else self.wait_hint())
+        self.appointment_id = Result["Id"]
+        self.caregiver_name = Result["Caregiver"]
         return None
 
-    def add_appointment(self):
+    def wait(self):
+        """
+            Put the patient on the waitlist of the vaccine and date of the appointment, when it couldn't be booked.
+            Return:
+                The message about their place in the queue, or that the waitlist is disabled.
+        """
+        if not Waitlist.enabled():
+            return "\nThe waitlist is not available. "
+        Position = Waitlist.enqueue(self.patient_name, self.vaccine, self.date)
+        return f"\nYou are number {Position} on the waitlist for {self.vaccine} on {self.date}, the appointment " + \
+            "is booked for you as soon as a caregiver or a dose is available. Leave it with: " + \
+            f"leave_waitlist {self.vaccine} {self.date}"
+
+    def wait_hint(self):
+        """
+            The message telling how to join the waitlist, empty when the waitlist is disabled.
         """
-            Always validate the appointment before adding it.
+        if not Waitlist.enabled():
+            return ""
+        return "\nTo be booked as soon as a caregiver or a dose is available: " + \
+            f"reserve {self.vaccine} {self.date} --wait"
+
+    def cancel(self):
+        """
+            Cancel the appointment of appointment_id in a single transaction, when it belongs to the patient or the
+            caregiver instance: the dose goes back to the vaccine and the slot of the caregiver is restored.
+            Return:
+                The dictionary of Backend.cancel_appointment, "Cancelled" is 0 when there is no such appointment.
             Exceptions:
                 The caller's responsibility.
         """
-        if not self.is_validated:
-            raise Exception("Can't add appointment to database when it's not validated yet. ")
-        if self.patient_instance is None:
-            raise Exception("The appointment must be made for patience to be added to the database. ")
         cm = ConnectionManager()
-
         with cm as cursor:
-            cursor.execute(Appointment.GetRandomCaregiver, (self.date, ))
-            CareGiverName = None
-            for row in cursor:
-                CareGiverName = row["Username"]
-            cursor.execute(Appointment.InsertAppointment, (self.patient_name, CareGiverName, self.date, self.vaccine))
-        return None
+            return cm.backend.cancel_appointment(cursor, self.appointment_id, self.patient_name, self.caregiver_name)
 
-    def show_appointments_patient(self):
+    @staticmethod
+    def cancel_caregiver_day(caregiver_name, date):
         """
-            Returns the query results for an instance of patient. The results will be returned as a list of
-            dictionary.
+            Cancel all the appointments of a caregiver on a date in a single transaction, see
+            Backend.cancel_caregiver_day. The caregiver is not available on the date anymore.
             Return:
-                The dictionary ready to be printed.
+                The dictionary of Backend.cancel_caregiver_day.
+        """
+        cm = ConnectionManager()
+        with cm as cursor:
+            return cm.backend.cancel_caregiver_day(cursor, caregiver_name, date)
+
+    def show_appointments_patient(self, after=None, limit=None, order="id"):
+        """
+            Returns the appointments of the patient instance, as a generator of AppointmentRow. The rows are
+            streamed from the database as they are consumed, the connection is held until the generator is
+            exhausted or closed.
+            after:
+                The id of the last appointment of the previous page, None to start from the first one.
+            limit:
+                The maximal number of appointments, None for all of them.
+            order:
+                "id" or "date", the appointments of a date are ordered by id.
             Exceptions:
                 Responsibility of the callers.
                 * If current patient instance is None, it will raise an exception about it.
@@ -140,18 +217,12 @@ class Appointment:
                 "Can't show the appointment for patient because an instance of patience is not passed in "+ \
                 "for the Appointment object instance. "
             )
-        cm = ConnectionManager()
-        with cm as cursor:
-            cursor.execute(Appointment.SelectAppointmentsForPatient, (self.patient_name,))
-            return list(cursor)
-        # Not sure if this statement get executed at all.
-        print("This print statement runs, I wonder why.")
-        return None
+        return Appointment.stream(Appointment.SelectAppointmentsForPatient, self.patient_name, after, limit, order)
 
-    def show_appointments_caregiver(self):
+    def show_appointments_caregiver(self, after=None, limit=None, order="id"):
         """
-            Returns the query results for an instance of caregiver. The results will be returned as a list
-            of dictionary.
+            Returns the appointments of the caregiver instance, as a generator of AppointmentRow, see
+            show_appointments_patient.
             Exceptions:
                 Responsibility of the callers:
                 * if current caregiver instance is None, it will rase an exception about it.
@@ -159,15 +230,41 @@ class Appointment:
         if self.caregiver_name is None:
             raise Exception("Can't show the appointment for the caregiver because an instance of caregiver is not" +\
                             " passed in for the appointment instance.")
-        cm = ConnectionManager()
-        with cm as cursor:
-            cursor.execute(Appointment.SelectAppointmentsForCaregiver, (self.caregiver_name, ))
-            return list(cursor)
-        return None
-
-
-
-
-
+        return Appointment.stream(Appointment.SelectAppointmentsForCaregiver, self.caregiver_name, after, limit, order)
 
+    @staticmethod
+    def page_query(select, name, after=None, limit=None, order="id"):
+        """
+            Build one page of a select of appointments, the pages of every shape are registered queries.
+            Return:
+                The query and its parameters.
+        """
+        if order not in ("id", "date"):
+            raise ValueError(f"Appointments are ordered by id or date, not by: {order}")
+        Query, Params, Name = str(select), [name], f"{select.name}.by_{order}"
+        Types = list(select.types)
+        if after is not None:
+            Query += Appointment.AfterId if order == "id" else Appointment.AfterDate
+            Params += [after] if order == "id" else [after, after, after]
+            Types += ["INT"]*(len(Params) - len(Types))
+            Name += ".after"
+        Query += Appointment.OrderById if order == "id" else Appointment.OrderByDate
+        if limit is not None:
+            Query += Appointment.FetchPage
+            Params.append(limit)
+            Types.append("INT")
+            Name += ".limit"
+        return Queries.register(Name, Query, types=Types), tuple(Params)
 
+    @staticmethod
+    def stream(select, name, after=None, limit=None, order="id"):
+        Query, Params = Appointment.page_query(select, name, after, limit, order)
+        cm = ConnectionManager()
+        cm.create_connection(autocommit=True)
+        try:
+            cursor = cm.cursor()
+            cursor.execute(Query, Params)
+            yield from stream_rows(cursor, AppointmentRow, Appointment.FetchSize)
+        finally:
+            cm.close_connection()
+        return None
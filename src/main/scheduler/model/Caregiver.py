@@ -1,57 +1,87 @@
 import sys
+import datetime
 sys.path.append("../util/*")
 sys.path.append("../db/*")
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.Queries import Queries
 
 
 class Caregiver:
 
-    def __init__(self, username, password=None, salt=None, hash=None):
+    GetCaregiverDetails = Queries.register(
+        "caregiver.details", "SELECT Salt, Hash, Iterations FROM Caregivers WHERE Username = %s",
+        types=("VARCHAR(255)", ))
+    AddCaregiver = Queries.register(
+        "caregiver.add", "INSERT INTO Caregivers (Username, Salt, Hash, Iterations) VALUES (%s, %s, %s, %d)")
+    UpdateHash = Queries.register(
+        "caregiver.update_hash", "UPDATE Caregivers SET Salt = %s, Hash = %s, Iterations = %d WHERE Username = %s")
+    CaregiversExist = "SELECT Username FROM Caregivers WHERE Username IN ({})"
+    SelectExistingDates = Queries.register(
+        "caregiver.existing_dates",
+        "SELECT Time FROM Availabilities WHERE Username = %s AND Time BETWEEN %s AND %s",
+        types=("VARCHAR(255)", "DATE", "DATE"))
+    # the slot starts with the number of patients the caregiver takes on the date.
+    # UPDLOCK, HOLDLOCK keep the key range locked from the NOT EXISTS check to the insert, so the same dates
+    # uploaded concurrently are inserted once and the other upload skips them. SQLite has a single writer anyway.
+    AddAvailability = Queries.register(
+        "caregiver.add_availability",
+        "INSERT INTO Availabilities (Time, Username, Capacity) SELECT %s, %s, %d " +
+        "WHERE NOT EXISTS (SELECT 1 FROM Availabilities WITH (UPDLOCK, HOLDLOCK) WHERE Time = %s AND Username = %s)")
+
+    __slots__ = ("username", "password", "salt", "hash", "iterations")
+
+    def __init__(self, username, password=None, salt=None, hash=None, iterations=None):
         """
             Create a caregiver instance for the current login.
             Overview:
                 * Pass in the salt and hash when it's made to create an instance of caregiver in the
                 DB.
                 * Pass in the password if it's an login attempt of an existing caregiver in the database.
+                * iterations is the PBKDF2 cost of the hash, Util.HashIterations when None.
 
         """
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.iterations = Util.HashIterations if iterations is None else iterations
 
     def get(self):
         """
             Login the caregiver account.
+            * One query on one pooled connection fetches the salt, the hash and its cost.
         """
         cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor(as_dict=True)
-
-        get_caregiver_details = "SELECT Salt, Hash FROM Caregivers WHERE Username = %s"
         try:
-            cursor.execute(get_caregiver_details, self.username)
-            for row in cursor:
-                curr_salt = row['Salt']
-                curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
-                if not curr_hash == calculated_hash:
-                    print("Incorrect password")
-                    cm.close_connection()
-                    return None
+            with cm as cursor:
+                cursor.execute(Caregiver.GetCaregiverDetails, self.username)
+                for row in cursor:
+                    curr_salt = row['Salt']
+                    curr_hash = row['Hash']
+                    calculated_hash = Util.generate_hash(self.password, curr_salt, row['Iterations'])
+                    if not curr_hash == calculated_hash:
+                        print("Incorrect password")
+                        return None
+                    else:
+                        self.salt = curr_salt
+                        self.hash = calculated_hash
+                        self.iterations = row['Iterations']
+                        break
                 else:
-                    self.salt = curr_salt
-                    self.hash = calculated_hash
-                    cm.close_connection()
-                    return self
-        except pymssql.Error as e:
+                    print(f"Caregiver {self.username} doesn't exist. ")
+                    return None
+                # the hashing cost changed since the password was saved, upgrade it while we know the password.
+                if self.iterations != Util.HashIterations:
+                    self.salt = Util.generate_salt()
+                    self.hash = Util.generate_hash(self.password, self.salt)
+                    self.iterations = Util.HashIterations
+                    cursor.execute(Caregiver.UpdateHash, (self.salt, self.hash, self.iterations, self.username))
+            return self
+        except DatabaseError as e:
             print("Error occurred when fetching current caregiver")
             raise e
-        finally:
-            cm.close_connection()
-        return None
 
     def get_username(self):
         return self.username
@@ -77,15 +107,48 @@ class Caregiver:
     def save_to_db(self):
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_caregivers = "INSERT INTO Caregivers VALUES (%s, %s, %s)"
+        cursor = cm.cursor()
         try:
-            cursor.execute(add_caregivers, (self.username, self.salt, self.hash))
+            cursor.execute(Caregiver.AddCaregiver, (self.username, self.salt, self.hash, self.iterations))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
-            raise
+        finally:
+            cm.close_connection()
+
+    @staticmethod
+    def existing_usernames(usernames):
+        """
+            Find which of the usernames are already taken, with one query.
+            Return:
+                The set of the usernames that exist in the database.
+            Exception:
+                Handled by the caller.
+        """
+        usernames = list(usernames)
+        if len(usernames) == 0:
+            return set()
+        cm = ConnectionManager()
+        with cm as cursor:
+            cursor.execute(Caregiver.CaregiversExist.format(", ".join(["%s"]*len(usernames))), tuple(usernames))
+            return {row["Username"] for row in cursor}
+
+    @staticmethod
+    def save_many_to_db(caregivers):
+        """
+            Save a batch of caregivers with one multi-row insert, in one transaction.
+            * Either all of them are saved, or none of them.
+            Exception:
+                Handled by the caller.
+        """
+        caregivers = list(caregivers)
+        if len(caregivers) == 0:
+            return None
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        cursor = cm.cursor()
+        try:
+            cursor.executemany(Caregiver.AddCaregiver, [(c.username, c.salt, c.hash, c.iterations) for c in caregivers])
+            conn.commit()
         finally:
             cm.close_connection()
 
@@ -95,20 +158,43 @@ class Caregiver:
             Exception:
                 Handled by the caller.
         """
+        return self.upload_availabilities([d])
+
+    def upload_availabilities(self, dates, capacity=1):
+        """
+            Insert availabilities for many dates of the caregiver who is currently logged in, in one
+            transaction.
+            * capacity is the number of patients the caregiver takes on each of the dates.
+            * Dates the caregiver is already available for are skipped, uploading twice changes nothing.
+            Return:
+                The number of dates inserted.
+            Exception:
+                Handled by the caller.
+        """
+        if capacity < 1:
+            raise ValueError(f"A caregiver takes at least one patient a day, but the capacity is {capacity}. ")
+        dates = sorted(set(d.date() if isinstance(d, datetime.datetime) else d for d in dates))
+        if len(dates) == 0:
+            return 0
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        add_availability = "INSERT INTO Availabilities VALUES (%s , %s)"
+        cursor = cm.cursor()
         try:
-            cursor.execute(add_availability, (d, self.username))
+            cursor.execute(Caregiver.SelectExistingDates, (self.username, dates[0], dates[-1]))
+            existing = {row[0] for row in cursor.fetchall()}
+            new_dates = [d for d in dates if d not in existing]
+            cursor.executemany(
+                Caregiver.AddAvailability,
+                [(d, self.username, capacity, d, self.username) for d in new_dates]
+            )
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             print("Error occurred when updating caregiver availability")
             raise
         finally:
             cm.close_connection()
+        return len(new_dates)
 
     def __repr__(self):
         """
@@ -1,29 +1,39 @@
 import sys
-import warnings
 
 sys.path.append("../util/*")
 sys.path.append("../db/*")
 from util.Util import Util
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Queries import Queries
 
 
 class Patient:
 
-    GetPatientDetails = "SELECT Salt, Hash FROM Patients WHERE Username = %s"
-    PatientExists = "SELECT * FROM Patients WHERE Username = %s"
-    AddPatient = "INSERT INTO Patients VALUES(%s, %s, %s)"
+    GetPatientDetails = Queries.register(
+        "patient.details", "SELECT Salt, Hash, Iterations FROM Patients WHERE Username = %s",
+        types=("VARCHAR(255)", ))
+    PatientExists = Queries.register(
+        "patient.exists", "SELECT * FROM Patients WHERE Username = %s", types=("VARCHAR(255)", ))
+    AddPatient = Queries.register(
+        "patient.add", "INSERT INTO Patients (Username, Salt, Hash, Iterations) VALUES(%s, %s, %s, %d)")
+    UpdateHash = Queries.register(
+        "patient.update_hash", "UPDATE Patients SET Salt = %s, Hash = %s, Iterations = %d WHERE Username = %s")
+    PatientsExist = "SELECT Username FROM Patients WHERE Username IN ({})"
 
-    def __init__(self, username, password=None, salt=None, hash=None):
+    __slots__ = ("username", "password", "salt", "hash", "iterations")
+
+    def __init__(self, username, password=None, salt=None, hash=None, iterations=None):
         """
             Load in an instance of the Patient, completed with username password salt and hash.
             * When creating a new user, pass in the salt and hash.
             * when logging in existing user, pass in the password only.
+            * iterations is the PBKDF2 cost of the hash, Util.HashIterations when None.
         """
         self.username = username
         self.password = password
         self.salt = salt
         self.hash = hash
+        self.iterations = Util.HashIterations if iterations is None else iterations
         return
 
     def __call__(self):
@@ -32,23 +42,20 @@ class Patient:
     def get(self):
         """
             Makes connection to the database for the current user info.
+            * One query fetches the salt, the hash and its cost, a patient that doesn't exist has no row.
             Exceptions:
-                Database: pymssql.Error
+                Database: DatabaseError
             None:
                 When the patient doesn't exist in the database.
                 Incorrect password.
         """
         cm = ConnectionManager()
-        if not self.exists_in_db():
-            warnings.warn("patient doesn't exists in database but caller insists on getting it from database. ")
-            print("None is returned. ")
-            return None
         with cm as cursor:
             cursor.execute(Patient.GetPatientDetails, self.username)
             for row in cursor:
                 curr_salt = row['Salt']
                 curr_hash = row['Hash']
-                calculated_hash = Util.generate_hash(self.password, curr_salt)
+                calculated_hash = Util.generate_hash(self.password, curr_salt, row['Iterations'])
                 # password wrong.
                 if not curr_hash == calculated_hash:
                     print("Incorrect password")
@@ -57,8 +64,18 @@ class Patient:
                     # establish salt and hash from the db.
                     self.salt = curr_salt
                     self.hash = calculated_hash
-                    return self
-        return None
+                    self.iterations = row['Iterations']
+                    break
+            else:
+                print(f"Patient {self.username} doesn't exist. ")
+                return None
+            # the hashing cost changed since the password was saved, upgrade it while we know the password.
+            if self.iterations != Util.HashIterations:
+                self.salt = Util.generate_salt()
+                self.hash = Util.generate_hash(self.password, self.salt)
+                self.iterations = Util.HashIterations
+                cursor.execute(Patient.UpdateHash, (self.salt, self.hash, self.iterations, self.username))
+        return self
 
     def exists_in_db(self):
         """
@@ -107,16 +124,56 @@ class Patient:
             Save the current instance of patient into the table.
             Exception:
                 It might give database exceptions, this is the caller's responsibility.
-                pymssql.Error
+                DatabaseError
         """
         cm = ConnectionManager()
         if self.hash is None or self.salt is None:
             raise AssertionError("Unable to save patient database object because one of the salt or hash field is None.")
         with cm as cursor:
-            cursor.execute(Patient.AddPatient, (self.username, self.salt, self.hash))
+            cursor.execute(Patient.AddPatient, (self.username, self.salt, self.hash, self.iterations))
             # auto commit.
         return True
 
+    @staticmethod
+    def existing_usernames(usernames):
+        """
+            Find which of the usernames are already taken, with one query.
+            Return:
+                The set of the usernames that exist in the database.
+            Exception:
+                It might give database exceptions, this is the caller's responsibility.
+        """
+        usernames = list(usernames)
+        if len(usernames) == 0:
+            return set()
+        cm = ConnectionManager()
+        with cm as cursor:
+            cursor.execute(Patient.PatientsExist.format(", ".join(["%s"]*len(usernames))), tuple(usernames))
+            return {row["Username"] for row in cursor}
+
+    @staticmethod
+    def save_many_to_db(patients):
+        """
+            Save a batch of patients with one multi-row insert, in one transaction.
+            * Either all of them are saved, or none of them.
+            Exception:
+                It might give database exceptions, this is the caller's responsibility.
+        """
+        patients = list(patients)
+        if any(p.hash is None or p.salt is None for p in patients):
+            raise AssertionError("Unable to save patients because the salt or hash field of some of them is None.")
+        if len(patients) == 0:
+            return True
+        cm = ConnectionManager()
+        conn = cm.create_connection()
+        try:
+            cursor = cm.cursor()
+            cursor.executemany(Patient.AddPatient, [(p.username, p.salt, p.hash, p.iterations) for p in patients])
+            conn.commit()
+        finally:
+            cm.close_connection()
+        return True
+
     def __repr__(self):
         """
             Get representation for the instance.
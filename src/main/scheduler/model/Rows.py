@@ -0,0 +1,30 @@
+import collections
+
+
+'''
+Records for the rows of large result sets. They are tuples with named fields: no dictionary per row and no
+__dict__ per record, only the values themselves, and their fields are read as attributes: row.PatientName.
+Build them from the tuples of a cursor opened with as_dict=False, in the order of the columns of the query.
+'''
+
+
+class AppointmentRow(collections.namedtuple(
+        "AppointmentRow", ["Id", "PatientName", "CareGiverName", "AppointmentDate", "VaccineType"])):
+    """
+        One appointment, as selected by Appointment.SelectAppointmentsForPatient and
+        SelectAppointmentsForCaregiver.
+    """
+
+    __slots__ = ()
+
+
+def stream_rows(cursor, row_type, fetch_size=500):
+    """
+        Read the rows of the last query of a tuple cursor as records of row_type, fetch_size rows at a time.
+    """
+    while True:
+        Rows = cursor.fetchmany(fetch_size)
+        if not Rows:
+            break
+        yield from map(row_type._make, Rows)
+    return None
@@ -0,0 +1,210 @@
+import os
+import sys
+import time
+import heapq
+import bisect
+import datetime
+import threading
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Queries import Queries
+
+
+class SlotIndex:
+    """
+        A process wide, in-memory index of the free caregiver slots from today on, so reserve picks the caregiver
+        of a date without sorting the Availabilities of the date in the database.
+        Overview:
+            * Every date has a heap of its caregivers: the most remaining capacity first, then the least booked,
+            then the first username, which is the allocation order of reserve. An entry that changed is pushed
+            again instead of being updated, the outdated ones are dropped when they reach the top, so best() is
+            logarithmic in the number of caregivers of the date.
+            * The appointments of every caregiver are counted in one map, the entries of the heaps carry the count
+            they were pushed with. A booking only pushes the caregiver on the date booked, their entries on the
+            other dates are pushed again with the new count when they reach the top. A count can only be behind
+            in the heaps when it went up, the dates of a caregiver whose count went down are pushed at once.
+            * The dates with free capacity are kept sorted, earliest() is a bisect.
+            * It's reloaded from the database at most once per SLOTINDEXREFRESH seconds (default 30). Writers in
+            this process call invalidate with the dates they changed, only those are reloaded on the next lookup.
+            reserve applies its own bookings with take().
+            * It's a hint: reserve checks in the database that the caregiver picked is still free on the date, and
+            allocates another one otherwise.
+    """
+
+    Instance = None
+    InstanceLock = threading.Lock()
+    LoadSlots = Queries.register(
+        "slots.load",
+        "SELECT a.Time, a.Username, a.Capacity, c.Booked FROM Availabilities AS a " +
+        "JOIN Caregivers AS c ON c.Username = a.Username WHERE a.Time >= %s AND a.Capacity > 0", types=("DATE", ))
+    LoadRange = Queries.register(
+        "slots.load_range",
+        "SELECT a.Time, a.Username, a.Capacity, c.Booked FROM Availabilities AS a " +
+        "JOIN Caregivers AS c ON c.Username = a.Username WHERE a.Time BETWEEN %s AND %s AND a.Capacity > 0",
+        types=("DATE", "DATE"))
+
+    def __init__(self, refresh_interval=30.0):
+        self.refresh_interval = refresh_interval
+        self.capacity = {}  # date -> {username: remaining capacity}
+        self.dates_of = {}  # username -> dates the caregiver has a free slot on.
+        self.booked = {}  # username -> appointments of the caregiver.
+        self.heaps = {}  # date -> [(-capacity, booked, username)], outdated entries included.
+        self.dates = []  # dates with free capacity, sorted.
+        self.refreshed = None  # time.monotonic() of the last refresh, None when it's stale.
+        self.stale = []  # (first, last) ranges of dates to reload on the next lookup.
+        self.lock = threading.RLock()
+
+    @classmethod
+    def get(cls):
+        """
+            Get the index of the process, it's loaded on first use.
+        """
+        if cls.Instance is None:
+            with cls.InstanceLock:
+                if cls.Instance is None:
+                    cls.Instance = SlotIndex(float(os.getenv("SLOTINDEXREFRESH", "30")))
+        return cls.Instance
+
+    def refresh(self, force=False):
+        """
+            Reload the free slots, unless they were loaded less than refresh_interval seconds ago. Otherwise, only
+            the ranges of dates invalidated since are reloaded.
+            Exception:
+                Database errors are the caller's responsibility.
+        """
+        with self.lock:
+            if not force and self.refreshed is not None and \
+                    time.monotonic() - self.refreshed < self.refresh_interval:
+                Today = datetime.date.today()
+                while self.stale:
+                    First, Last = self.stale[-1]
+                    if Last >= Today:
+                        cm = ConnectionManager()
+                        with cm as cursor:
+                            cursor.execute(SlotIndex.LoadRange, (max(First, Today), Last))
+                            self.load_range(max(First, Today), Last, cursor.fetchall())
+                    self.stale.pop()
+                return None
+            cm = ConnectionManager()
+            with cm as cursor:
+                cursor.execute(SlotIndex.LoadSlots, (datetime.date.today(), ))
+                self.load(cursor.fetchall())
+            self.refreshed = time.monotonic()
+            self.stale = []
+        return None
+
+    def invalidate(self, dates=None):
+        """
+            Make the next lookup reload the index, call it after writing to the Availabilities table.
+            dates:
+                The dates written, only the range from the first to the last one is reloaded. The whole index is
+                when None.
+        """
+        with self.lock:
+            if dates is None:
+                self.refreshed = None
+            else:
+                dates = list(dates)
+                if len(dates) > 0:
+                    self.stale.append((min(dates), max(dates)))
+        return None
+
+    def load(self, rows):
+        """
+            Replace the slots of the index with rows of Time, Username, Capacity and Booked.
+        """
+        with self.lock:
+            self.capacity, self.dates_of, self.booked = {}, {}, {}
+            for row in rows:
+                if row["Capacity"] > 0:
+                    self.capacity.setdefault(row["Time"], {})[row["Username"]] = row["Capacity"]
+                    self.dates_of.setdefault(row["Username"], set()).add(row["Time"])
+                self.booked[row["Username"]] = row["Booked"]
+            self.heaps = {}
+            for day, caregivers in self.capacity.items():
+                self.heaps[day] = [(-capacity, self.booked[name], name) for name, capacity in caregivers.items()]
+                heapq.heapify(self.heaps[day])
+            self.dates = sorted(self.capacity)
+        return None
+
+    def load_range(self, first, last, rows):
+        """
+            Replace the slots of the dates from first to last with rows of Time, Username, Capacity and Booked,
+            the other dates are kept.
+        """
+        with self.lock:
+            Start, End = bisect.bisect_left(self.dates, first), bisect.bisect_right(self.dates, last)
+            for day in self.dates[Start:End]:
+                for name in self.capacity.pop(day):
+                    self.dates_of[name].discard(day)
+                del self.heaps[day]
+            del self.dates[Start:End]
+            Loaded, Fewer = {}, set()
+            for row in rows:
+                if row["Capacity"] > 0:
+                    Loaded.setdefault(row["Time"], {})[row["Username"]] = row["Capacity"]
+                    self.dates_of.setdefault(row["Username"], set()).add(row["Time"])
+                if row["Booked"] < self.booked.get(row["Username"], row["Booked"]):
+                    Fewer.add(row["Username"])
+                self.booked[row["Username"]] = row["Booked"]
+            for day, caregivers in Loaded.items():
+                self.capacity[day] = caregivers
+                self.heaps[day] = [(-capacity, self.booked[name], name) for name, capacity in caregivers.items()]
+                heapq.heapify(self.heaps[day])
+            # the entries of a caregiver with fewer appointments now come too late in the heaps of the other dates.
+            for name in Fewer:
+                for day in self.dates_of.get(name, ()):
+                    if day not in Loaded:
+                        heapq.heappush(self.heaps[day], (-self.capacity[day][name], self.booked[name], name))
+            self.dates[Start:Start] = sorted(Loaded)
+        return None
+
+    def best(self, day):
+        """
+            Get the caregiver with the most remaining capacity on a date, None when nobody is free.
+        """
+        self.refresh()
+        with self.lock:
+            Heap, Caregivers = self.heaps.get(day), self.capacity.get(day)
+            while Heap:
+                Capacity, Booked, Name = Heap[0]
+                Current = self.booked.get(Name, 0)
+                if Caregivers.get(Name) != -Capacity or Booked > Current:
+                    heapq.heappop(Heap)  # outdated, the up to date entry is in the heap as well.
+                elif Booked < Current:
+                    heapq.heapreplace(Heap, (Capacity, Current, Name))  # booked on another date meanwhile.
+                else:
+                    return Name
+            return None
+
+    def earliest(self, day):
+        """
+            Get the first date on or after the given one with a free slot, None when there is none.
+        """
+        self.refresh()
+        with self.lock:
+            Index = bisect.bisect_left(self.dates, day)
+            return self.dates[Index] if Index < len(self.dates) else None
+
+    def take(self, day, name):
+        """
+            Book one appointment of a caregiver on a date: the slot loses one capacity and the caregiver has one
+            more appointment. Only the heap of the date is updated, see best().
+        """
+        with self.lock:
+            Caregivers = self.capacity.get(day, {})
+            if name in Caregivers:
+                Caregivers[name] -= 1
+                if Caregivers[name] <= 0:
+                    del Caregivers[name]
+                    self.dates_of[name].discard(day)
+                if len(Caregivers) == 0:
+                    self.capacity.pop(day, None)
+                    self.heaps.pop(day, None)
+                    Index = bisect.bisect_left(self.dates, day)
+                    if Index < len(self.dates) and self.dates[Index] == day:
+                        del self.dates[Index]
+            self.booked[name] = self.booked.get(name, 0) + 1
+            if name in Caregivers:
+                heapq.heappush(self.heaps[day], (-Caregivers[name], self.booked[name], name))
+        return None
@@ -1,10 +1,18 @@
 import sys
 sys.path.append("../db/*")
 from db.ConnectionManager import ConnectionManager
-import pymssql
+from db.Backend import DatabaseError
+from db.Queries import Queries
 
 
 class Vaccine:
+
+    GetVaccine = Queries.register(
+        "vaccine.get", "SELECT Name, Doses FROM Vaccines WHERE Name = %s", types=("VARCHAR(255)", ))
+    AddVaccine = Queries.register("vaccine.add", "INSERT INTO Vaccines (Name, Doses) VALUES (%s, %d)")
+    AdjustDoses = Queries.register(
+        "vaccine.adjust_doses", "UPDATE Vaccines SET Doses = Doses + %d WHERE Name = %s AND Doses + %d >= 0")
+
     def __init__(self, vaccine_name, available_doses):
         self.vaccine_name = vaccine_name
         self.available_doses = available_doses
@@ -15,15 +23,13 @@ class Vaccine:
         """
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        get_vaccine = "SELECT Name, Doses FROM Vaccines WHERE Name = %s"
+        cursor = cm.cursor()
         try:
-            cursor.execute(get_vaccine, self.vaccine_name)
+            cursor.execute(Vaccine.GetVaccine, self.vaccine_name)
             for row in cursor:
                 self.available_doses = row[1]
                 return self
-        except pymssql.Error:
+        except DatabaseError:
             print("Error occurred when getting Vaccine")
             raise
         finally:
@@ -41,13 +47,12 @@ class Vaccine:
             raise ValueError("Argument cannot be negative!")
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
-        add_doses = "INSERT INTO VACCINES VALUES (%s, %d)"
+        cursor = cm.cursor()
         try:
-            cursor.execute(add_doses, (self.vaccine_name, self.available_doses))
+            cursor.execute(Vaccine.AddVaccine, (self.vaccine_name, self.available_doses))
             # you must call commit() to persist your data if you don't set autocommit to True
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             print("Error occurred when insert Vaccines")
             raise
         finally:
@@ -55,45 +60,81 @@ class Vaccine:
 
     # Increment the available doses
     def increase_available_doses(self, num):
+        """
+            Add doses to the vaccine in the database, with one atomic update that doesn't read them first.
+            Exception:
+                * ValueError when num is not positive, or the vaccine doesn't exist.
+                * Database errors are the caller's responsibility.
+        """
         if num <= 0:
             raise ValueError("Argument cannot be negative!")
-        self.available_doses += num
+        Vaccine.adjust_doses({self.vaccine_name: num})
+        if self.available_doses is not None:
+            self.available_doses += num
 
-        cm = ConnectionManager()
-        conn = cm.create_connection()
-        cursor = conn.cursor()
+    # Decrement the available doses
+    def decrease_available_doses(self, num):
+        """
+            Take doses from the vaccine in the database, with one atomic update guarded against going below zero.
+            Exception:
+                * ValueError when num is not positive, there are not enough doses, or the vaccine doesn't exist.
+                * Database errors are the caller's responsibility.
+        """
+        if num <= 0:
+            raise ValueError("Argument cannot be negative!")
+        Vaccine.adjust_doses({self.vaccine_name: -num})
+        if self.available_doses is not None:
+            self.available_doses -= num
 
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
+    def add_doses(self):
+        """
+            Add available_doses to the vaccine, the vaccine is inserted if it's not in the database yet.
+            * A single atomic upsert, see Backend.add_doses, concurrent adds of a new vaccine don't collide on its
+            primary key.
+            Exception:
+                * ValueError when available_doses is not positive.
+                * Database errors are the caller's responsibility.
+        """
+        if self.available_doses is None or self.available_doses <= 0:
+            raise ValueError("Argument cannot be negative!")
+        cm = ConnectionManager()
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
-            conn.commit()
-        except pymssql.Error:
-            print("Error occurred when updating vaccine availability")
+            with cm as cursor:
+                cm.backend.add_doses(cursor, self.vaccine_name, self.available_doses)
+        except DatabaseError:
+            print("Error occurred when adding doses to Vaccines")
             raise
-        finally:
-            cm.close_connection()
-
-    # Decrement the available doses
-    def decrease_available_doses(self, num):
-        if self.available_doses - num < 0:
-            ValueError("Not enough available doses!")
-        self.available_doses -= num
 
+    @staticmethod
+    def adjust_doses(deltas):
+        """
+            Change the doses of several vaccines at once, in one transaction.
+            deltas:
+                A dictionary of vaccine name -> doses to add, negative to take them.
+            * Each vaccine is updated atomically as Doses = Doses + delta, guarded against going below zero,
+            either all the changes are applied or none of them.
+            Exception:
+                * ValueError naming the first vaccine that doesn't exist or doesn't have enough doses.
+                * Database errors are the caller's responsibility.
+        """
+        if len(deltas) == 0:
+            return None
         cm = ConnectionManager()
         conn = cm.create_connection()
-        cursor = conn.cursor()
-
-        update_vaccine_availability = "UPDATE vaccines SET Doses = %d WHERE name = %s"
+        cursor = cm.cursor()
         try:
-            cursor.execute(update_vaccine_availability, (self.available_doses, self.vaccine_name))
-            # you must call commit() to persist your data if you don't set autocommit to True
+            # a fixed order, so two batches on the same vaccines can't deadlock each other.
+            for Name in sorted(deltas):
+                cursor.execute(Vaccine.AdjustDoses, (deltas[Name], Name, deltas[Name]))
+                if cursor.rowcount == 0:
+                    raise ValueError(f"Not enough available doses of \"{Name}\", or it doesn't exist!")
             conn.commit()
-        except pymssql.Error:
+        except DatabaseError:
             print("Error occurred when updating vaccine availability")
             raise
         finally:
-            cm.close_connection()
+            cm.close_connection()  # rolls back unless it's committed.
+        return None
 
     def __str__(self):
         return f"(Vaccine Name: {self.vaccine_name}, Available Doses: {self.available_doses})"
@@ -0,0 +1,104 @@
+import os
+import sys
+import time
+import threading
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Queries import Queries
+
+
+class VaccineCatalog:
+    """
+        A process wide, in-memory copy of the Vaccines table. Existence and doses lookups are answered from
+        memory, refreshed incrementally at most once per CATALOGREFRESH seconds (default 1).
+        Overview:
+            * A refresh reads only the rows whose Version is past the largest version seen so far, so writes
+            from other scheduler processes show up without reading the whole table again.
+            * Rows written by transactions still in flight are left for the next refresh, that's what the
+            MIN_ACTIVE_ROWVERSION bound is for: a version is never skipped because it committed late.
+            * Writers in this process call invalidate, the next lookup refreshes right away.
+            * Doses are a snapshot, reservations still check them in the database.
+    """
+
+    Instance = None
+    InstanceLock = threading.Lock()
+    LoadAll = Queries.register(
+        "catalog.load_all", "SELECT Name, Doses, Version FROM Vaccines WHERE Version < MIN_ACTIVE_ROWVERSION()",
+        types=())
+    LoadSince = Queries.register(
+        "catalog.load_since",
+        "SELECT Name, Doses, Version FROM Vaccines WHERE Version > %s AND Version < MIN_ACTIVE_ROWVERSION()",
+        types=("BINARY(8)", ))
+
+    def __init__(self, refresh_interval=1.0):
+        self.refresh_interval = refresh_interval
+        self.vaccines = {}  # name -> doses
+        self.version = None
+        self.refreshed = None  # time.monotonic() of the last refresh, None when it's stale.
+        self.lock = threading.Lock()
+
+    @classmethod
+    def get(cls):
+        """
+            Get the catalog of the process, it's loaded on first use.
+        """
+        if cls.Instance is None:
+            with cls.InstanceLock:
+                if cls.Instance is None:
+                    cls.Instance = VaccineCatalog(float(os.getenv("CATALOGREFRESH", "1")))
+        return cls.Instance
+
+    def refresh(self, force=False):
+        """
+            Load the rows changed since the last refresh, unless it was refreshed less than refresh_interval
+            seconds ago.
+            Exception:
+                Database errors are the caller's responsibility.
+        """
+        with self.lock:
+            if not force and self.refreshed is not None and \
+                    time.monotonic() - self.refreshed < self.refresh_interval:
+                return None
+            cm = ConnectionManager()
+            with cm as cursor:
+                if self.version is None:
+                    cursor.execute(VaccineCatalog.LoadAll)
+                else:
+                    cursor.execute(VaccineCatalog.LoadSince, (self.version, ))
+                for row in cursor:
+                    self.vaccines[row["Name"]] = row["Doses"]
+                    if self.version is None or row["Version"] > self.version:
+                        self.version = row["Version"]
+            self.refreshed = time.monotonic()
+        return None
+
+    def invalidate(self):
+        """
+            Make the next lookup refresh the catalog, call it after writing to the Vaccines table.
+        """
+        self.refreshed = None
+        return None
+
+    def exists(self, name):
+        """
+            Check whether the vaccine is in the catalog, a missing vaccine is looked up again in the database
+            before saying no, it might have just been added.
+        """
+        self.refresh()
+        if name not in self.vaccines:
+            self.refresh(force=True)
+        return name in self.vaccines
+
+    def doses(self, name):
+        """
+            Get the doses left of a vaccine, None if it doesn't exist.
+        """
+        self.refresh()
+        return self.vaccines.get(name)
+
+    def all(self):
+        """
+            Get the name and the doses of every vaccine, as a list of pairs sorted by the name.
+        """
+        self.refresh()
+        return sorted(self.vaccines.items())
@@ -0,0 +1,84 @@
+import sys
+import datetime
+sys.path.append("../db/*")
+from db.ConnectionManager import ConnectionManager
+from db.Migrations import Migrations
+from db.Queries import Queries
+
+
+class Waitlist:
+    """
+        The patients waiting for a vaccine on a date, when reserve found no caregiver or no doses for them.
+        Overview:
+            * A patient joins the queue with reserve --wait instead of retrying by hand, once per date and vaccine,
+            and leaves it with leave(). Booking the vaccine with reserve takes them off every date of it.
+            * match() books the queue first come first served on the capacity available, in one transaction. The
+            scheduler runs it whenever availabilities or doses are added, or appointments are cancelled.
+            * The Waitlist table comes with the migration 0002_waitlist, the waitlist is disabled when the
+            SCHEMAVERSION Env Var stops the migrations before it.
+    """
+
+    SchemaVersion = 2
+    Enqueue = Queries.register(
+        "waitlist.enqueue",
+        "INSERT INTO Waitlist (PatientName, AppointmentDate, VaccineType) SELECT %s, %s, %s WHERE NOT EXISTS " +
+        "(SELECT 1 FROM Waitlist WHERE AppointmentDate = %s AND VaccineType = %s AND PatientName = %s)")
+    # Patients ahead for the same vaccine on the same date, and the patient themselves.
+    Position = Queries.register(
+        "waitlist.position",
+        "SELECT COUNT(*) AS Position FROM Waitlist WHERE AppointmentDate = %s AND VaccineType = %s AND Id <= " +
+        "(SELECT Id FROM Waitlist WHERE AppointmentDate = %s AND VaccineType = %s AND PatientName = %s)",
+        types=("DATE", "VARCHAR(255)", "DATE", "VARCHAR(255)", "VARCHAR(255)"))
+
+    Leave = Queries.register(
+        "waitlist.leave",
+        "DELETE FROM Waitlist WHERE AppointmentDate = %s AND VaccineType = %s AND PatientName = %s")
+
+    @staticmethod
+    def enabled():
+        Target = Migrations.target()
+        return Target is None or Target >= Waitlist.SchemaVersion
+
+    @staticmethod
+    def enqueue(patient_name, vaccine, date):
+        """
+            Queue a patient for a vaccine on a date, a patient already queued keeps their place.
+            Return:
+                The position of the patient in the queue of the date and vaccine, 1 is the next one booked.
+            Exceptions:
+                The caller's responsibility.
+        """
+        cm = ConnectionManager()
+        with cm as cursor:
+            cursor.execute(Waitlist.Enqueue, (patient_name, date, vaccine, date, vaccine, patient_name))
+            cursor.execute(Waitlist.Position, (date, vaccine, date, vaccine, patient_name))
+            return cursor.fetchone()["Position"]
+
+    @staticmethod
+    def leave(patient_name, vaccine, date):
+        """
+            Take a patient off the queue of a vaccine on a date.
+            Return:
+                The number of entries removed, 0 when the patient wasn't queued.
+            Exceptions:
+                The caller's responsibility.
+        """
+        cm = ConnectionManager()
+        with cm as cursor:
+            cursor.execute(Waitlist.Leave, (date, vaccine, patient_name))
+            return cursor.rowcount
+
+    @staticmethod
+    def match():
+        """
+            Book the waiting patients on the free slots and doses, see Backend.match_waitlist.
+            Return:
+                The dictionary of Backend.match_waitlist, nobody is matched when the waitlist is disabled.
+            Exceptions:
+                The caller's responsibility.
+        """
+        if not Waitlist.enabled():
+            return {"Matched": 0, "Dates": None}
+        cm = ConnectionManager()
+        with cm as cursor:
+            return cm.backend.match_waitlist(cursor, datetime.date.today())
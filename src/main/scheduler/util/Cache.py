@@ -0,0 +1,118 @@
+import time
+import threading
+import collections
+
+
+class TTLCache:
+    """
+        A thread safe key value cache, entries expire after a time to live and the least recently used
+        entries are evicted when it's full.
+        * Counts the hits, misses and evictions so the caller can tell whether it's worth it.
+        * A value loaded by get_or_load is not cached when its key was invalidated, or the cache cleared, while it
+        was loading, it may be older than the write that invalidated it.
+    """
+
+    def __init__(self, maxsize=256, ttl=30):
+        """
+            maxsize:
+                The maximal number of entries.
+            ttl:
+                Seconds an entry stays valid after it's stored, None for no expiry.
+        """
+        if maxsize < 1:
+            raise ValueError("The cache needs room for at least one entry. ")
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()  # key -> (value, expiry), least recently used first.
+        self.loading = {}  # key -> [loads in flight, generation], the generation is bumped by invalidate.
+        self.epoch = 0  # bumped by clear.
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+            Get the value of a key, the default when it's not cached or it has expired.
+        """
+        with self.lock:
+            Entry = self.entries.get(key)
+            if Entry is not None and (Entry[1] is None or Entry[1] > time.monotonic()):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return Entry[0]
+            if Entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self.lock:
+            self._store(key, value)
+        return None
+
+    def _store(self, key, value):
+        """
+            Store a value, the caller must hold the lock.
+        """
+        self.entries[key] = (value, None if self.ttl is None else time.monotonic() + self.ttl)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+        return None
+
+    def get_or_load(self, key, loader):
+        """
+            Read through: get the value of a key, call the loader and cache what it returns when it's missing.
+            * The loader runs outside the lock, two threads missing the same key may both load it.
+            * What the loader returns is not cached when the key was invalidated or the cache cleared meanwhile,
+            the next call loads it again.
+        """
+        Missing = object()
+        Value = self.get(key, Missing)
+        if Value is not Missing:
+            return Value
+        with self.lock:
+            Loading = self.loading.setdefault(key, [0, 0])
+            Loading[0] += 1
+            Generation, Epoch = Loading[1], self.epoch
+        Value = Missing
+        try:
+            Value = loader()
+        finally:
+            with self.lock:
+                Loading[0] -= 1
+                if Loading[0] == 0:
+                    del self.loading[key]
+                if Value is not Missing and Loading[1] == Generation and self.epoch == Epoch:
+                    self._store(key, Value)
+        return Value
+
+    def invalidate(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+            if key in self.loading:
+                self.loading[key][1] += 1
+        return None
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.epoch += 1
+        return None
+
+    def stats(self):
+        """
+            Get the counters of the cache, as a dictionary.
+        """
+        with self.lock:
+            Total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits/Total if Total > 0 else 0.0
+            }
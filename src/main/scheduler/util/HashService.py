@@ -0,0 +1,72 @@
+import os
+import time
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from util.Util import Util
+from util.Metrics import Metrics
+
+
+def _hash(password, salt, iterations):
+    """
+        Runs in a worker process, returns the hash and the seconds it took.
+    """
+    Start = time.perf_counter()
+    Hash = Util.pbkdf2(password, salt, iterations)
+    return Hash, time.perf_counter() - Start
+
+
+class HashService:
+    """
+        Runs the PBKDF2 of Util.generate_hash on a pool of processes, so hashing many passwords at once scales
+        with the number of cores instead of blocking the calling thread for each of them.
+        * The number of worker processes is read from the HASHWORKERS Env Var, it defaults to the cores count.
+        * A single password is cheaper to hash inline with Util.generate_hash, use this for batches.
+        * The workers time every hash, the parent records the times into scheduler_hash_seconds.
+    """
+
+    Workers = int(os.getenv("HASHWORKERS", os.cpu_count() or 1))
+    Executor = None
+    ExecutorLock = threading.Lock()
+
+    @classmethod
+    def get_executor(cls):
+        """
+            Get the process pool of the service, it's started on first use.
+        """
+        if cls.Executor is None:
+            with cls.ExecutorLock:
+                if cls.Executor is None:
+                    cls.Executor = ProcessPoolExecutor(max_workers=cls.Workers)
+        return cls.Executor
+
+    @classmethod
+    def shutdown(cls):
+        if cls.Executor is not None:
+            cls.Executor.shutdown()
+            cls.Executor = None
+        return None
+
+    @classmethod
+    def chunksize(cls, count):
+        return max(1, count // (4*cls.Workers))
+
+    @classmethod
+    def hash_many(cls, passwords, salts, iterations=None):
+        """
+            Hash the passwords with their salts, in the same order.
+            iterations:
+                The PBKDF2 cost, Util.HashIterations when None.
+            Return:
+                The list of hashes.
+        """
+        iterations = Util.HashIterations if iterations is None else iterations
+        passwords, salts = list(passwords), list(salts)
+        if len(passwords) != len(salts):
+            raise ValueError("Every password needs exactly one salt. ")
+        Hashes = []
+        for Hash, Seconds in cls.get_executor().map(
+            _hash, passwords, salts, [iterations]*len(passwords), chunksize=cls.chunksize(len(passwords))
+        ):
+            Metrics.observe("scheduler_hash_seconds", Seconds)
+            Hashes.append(Hash)
+        return Hashes
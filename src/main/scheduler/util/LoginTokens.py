@@ -0,0 +1,107 @@
+import os
+import time
+import hmac
+import base64
+import hashlib
+from util.Cache import TTLCache
+
+
+class LoginTokens:
+    """
+        Short lived signed tokens for the verified logins, so logging in again does not repeat the database lookup
+        and the PBKDF2 of the password.
+        Overview:
+            * A token is the role, the username and the expiry time, signed with HMAC-SHA256. The key is read from
+            the LOGINSECRET Env Var, hex encoded, a random one is made at start otherwise, and the tokens are not
+            valid anymore after a restart.
+            * The tokens live for LOGINTOKENTTL seconds, 900 by default. The verified logins are kept in a TTLCache
+            of LOGINTOKENCACHESIZE entries, a token that was evicted or replaced by a newer login is refused even when
+            its signature is valid.
+            * The cache also keeps a keyed digest of the verified password of every login, a login of the same
+            user with the same password is checked against it instead of the database.
+            * logout revokes the token, the token and the digest are dropped so neither logs in again.
+    """
+
+    Secret = bytes.fromhex(os.getenv("LOGINSECRET")) if os.getenv("LOGINSECRET") else os.urandom(32)
+    TTL = float(os.getenv("LOGINTOKENTTL", "900"))
+    # (role, username) -> (token, digest of the password)
+    Verified = TTLCache(maxsize=int(os.getenv("LOGINTOKENCACHESIZE", "1024")), ttl=TTL)
+
+    @classmethod
+    def sign(cls, payload):
+        return hmac.new(cls.Secret, payload, hashlib.sha256).digest()
+
+    @classmethod
+    def digest(cls, password):
+        return hmac.new(cls.Secret, password.encode("utf-8"), hashlib.sha256).digest()
+
+    @staticmethod
+    def encode(data):
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+    @staticmethod
+    def decode(text):
+        return base64.urlsafe_b64decode(text + "="*(-len(text) % 4))
+
+    @classmethod
+    def issue(cls, role, username, password):
+        """
+            Make the token of a login whose password was just verified, and remember the login.
+            role:
+                "patient" or "caregiver".
+            Return:
+                The token, as text.
+        """
+        Payload = f"{role}\n{username}\n{int(time.time() + cls.TTL)}".encode("utf-8")
+        Token = f"{cls.encode(Payload)}.{cls.encode(cls.sign(Payload))}"
+        cls.Verified.put((role, username), (Token, cls.digest(password)))
+        return Token
+
+    @classmethod
+    def verify(cls, token):
+        """
+            Check a token.
+            Return:
+                (role, username) of the login, None when the token is malformed, forged, expired or revoked.
+        """
+        try:
+            Payload, Signature = token.split(".")
+            Payload, Signature = cls.decode(Payload), cls.decode(Signature)
+            role, username, expires = Payload.decode("utf-8").split("\n")
+            expires = int(expires)
+        except (ValueError, UnicodeDecodeError):
+            return None
+        if not hmac.compare_digest(cls.sign(Payload), Signature) or expires < time.time():
+            return None
+        Found = cls.Verified.get((role, username))
+        if Found is None or not hmac.compare_digest(Found[0], token):
+            return None
+        return role, username
+
+    @classmethod
+    def revoke(cls, token):
+        """
+            Forget the login of a token, it's refused from now on and the next login checks the password against
+            the database again. A token that is not valid anymore revokes nothing.
+            Return:
+                Whether a login was revoked.
+        """
+        Login = cls.verify(token)
+        if Login is None:
+            return False
+        cls.Verified.invalidate(Login)
+        return True
+
+    @classmethod
+    def check(cls, role, username, password):
+        """
+            Check a password against the verified login of the user, without the database.
+            Return:
+                The token of the login when the password is the verified one, None when there is no verified login
+                or the password differs, the caller checks it against the database then.
+        """
+        Found = cls.Verified.get((role, username))
+        if Found is None or not hmac.compare_digest(Found[1], cls.digest(password)):
+            return None
+        return Found[0] if cls.verify(Found[0]) is not None else None
+
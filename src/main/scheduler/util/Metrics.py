@@ -0,0 +1,232 @@
+import os
+import json
+import time
+import atexit
+import bisect
+import threading
+
+
+class Histogram:
+    """
+        Counts the observations of one metric in fixed buckets, the way Prometheus histograms do.
+        * Observing is a bisect and a few additions under a lock, nothing is allocated.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0]*(len(bounds) + 1)  # the last bucket is +Inf.
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        Index = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[Index] += 1
+            self.count += 1
+            self.sum += value
+            if self.max is None or value > self.max:
+                self.max = value
+        return None
+
+    def quantile(self, q):
+        """
+            Estimate a quantile from the buckets, the upper bound of the bucket it falls in.
+        """
+        if self.count == 0:
+            return None
+        Rank, Seen = q*self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            Seen += count
+            if Seen >= Rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "sum": self.sum,
+                "max": self.max,
+                "p50": self.quantile(0.5),
+                "p95": self.quantile(0.95),
+                "p99": self.quantile(0.99),
+                "buckets": dict(zip([*map(str, self.bounds), "+Inf"], self.counts)),
+            }
+
+
+class Metrics:
+    """
+        Latency and size histograms of the scheduler, keyed by metric name and label.
+        Overview:
+            * Enabled by the METRICS Env Var, e.g: METRICS=1. When disabled the hooks are not installed at all,
+            the handlers and cursors run as they are.
+            * Recorded: scheduler_command_seconds by command, scheduler_query_seconds and scheduler_query_rows by
+            statement kind, scheduler_connect_seconds, scheduler_checkout_seconds, scheduler_hash_seconds.
+            * Dumped as JSON or Prometheus text by the metrics command, and at exit into the METRICSFILE Env Var
+            file when it's set, as JSON when the file name ends with .json.
+    """
+
+    Enabled = os.getenv("METRICS", "0").lower() not in ("", "0", "false", "no")
+    # seconds, from 50us to 10s.
+    SecondsBounds = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                     0.5, 1.0, 2.5, 5.0, 10.0)
+    RowsBounds = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 5000, 10000)
+    LabelNames = {"scheduler_command_seconds": "command"}  # the label is the kind of statement otherwise.
+    Histograms = {}  # (name, label) -> Histogram
+    HistogramsLock = threading.Lock()
+
+    @classmethod
+    def histogram(cls, name, label=""):
+        Key = (name, label)
+        Found = cls.Histograms.get(Key)
+        if Found is None:
+            with cls.HistogramsLock:
+                Found = cls.Histograms.setdefault(
+                    Key, Histogram(cls.RowsBounds if name.endswith("_rows") else cls.SecondsBounds)
+                )
+        return Found
+
+    @classmethod
+    def observe(cls, name, value, label=""):
+        if cls.Enabled:
+            cls.histogram(name, label).observe(value)
+        return None
+
+    @classmethod
+    def timed(cls, name, function, label=""):
+        """
+            Wrap a function so every call is timed into a histogram, the function itself when disabled.
+        """
+        if not cls.Enabled:
+            return function
+        Target = cls.histogram(name, label)
+
+        def timed_function(*args, **kwargs):
+            Start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                Target.observe(time.perf_counter() - Start)
+        timed_function.__name__ = getattr(function, "__name__", name)
+        timed_function.__doc__ = getattr(function, "__doc__", None)
+        return timed_function
+
+    @classmethod
+    def cursor(cls, cursor):
+        """
+            Time the statements of a cursor and count the rows they return, the cursor itself when disabled.
+        """
+        return TimedCursor(cursor) if cls.Enabled else cursor
+
+    @classmethod
+    def reset(cls):
+        with cls.HistogramsLock:
+            cls.Histograms = {}
+        return None
+
+    @classmethod
+    def to_json(cls):
+        Result = {}
+        for (name, label), histogram in sorted(cls.Histograms.items()):
+            Result.setdefault(name, {})[label or "all"] = histogram.snapshot()
+        return json.dumps(Result, indent=2)
+
+    @classmethod
+    def to_prometheus(cls):
+        Lines, Typed = [], set()
+        for (name, label), histogram in sorted(cls.Histograms.items()):
+            if name not in Typed:
+                Lines.append(f"# TYPE {name} histogram")
+                Typed.add(name)
+            Snapshot = histogram.snapshot()
+            LabelName = cls.LabelNames.get(name, "kind")
+            Labels = "" if label == "" else f'{LabelName}="{label}",'
+            Cumulative = 0
+            for bound, count in Snapshot["buckets"].items():
+                Cumulative += count
+                Lines.append(f'{name}_bucket{{{Labels}le="{bound}"}} {Cumulative}')
+            Labels = "" if label == "" else f'{{{LabelName}="{label}"}}'
+            Lines.append(f"{name}_sum{Labels} {Snapshot['sum']}")
+            Lines.append(f"{name}_count{Labels} {Snapshot['count']}")
+        return "\n".join(Lines) + "\n"
+
+    @classmethod
+    def dump(cls, path):
+        with open(path, "w") as f:
+            f.write(cls.to_json() if path.endswith(".json") else cls.to_prometheus())
+        return None
+
+
+class TimedCursor:
+    """
+        A database cursor that records scheduler_query_seconds and scheduler_query_rows, by the first keyword of
+        the statements: select, insert, update, delete...
+        * The rows of a statement are observed when the next statement runs, or the cursor is closed or dropped.
+    """
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self.kind = None
+        self.rows = 0
+
+    def record(self, sql, started):
+        self.flush()
+        Words = sql.split(None, 1)
+        self.kind = Words[0].lower() if Words else "empty"
+        Metrics.histogram("scheduler_query_seconds", self.kind).observe(time.perf_counter() - started)
+        return None
+
+    def flush(self):
+        if self.kind is not None:
+            Metrics.histogram("scheduler_query_rows", self.kind).observe(self.rows)
+        self.kind, self.rows = None, 0
+        return None
+
+    def execute(self, sql, params=None):
+        Start = time.perf_counter()
+        Result = self.cursor.execute(sql, params)
+        self.record(sql, Start)
+        return Result
+
+    def executemany(self, sql, seq_of_params):
+        Start = time.perf_counter()
+        Result = self.cursor.executemany(sql, seq_of_params)
+        self.record(sql, Start)
+        return Result
+
+    def fetchone(self):
+        Row = self.cursor.fetchone()
+        self.rows += 0 if Row is None else 1
+        return Row
+
+    def fetchmany(self, size=None):
+        Rows = self.cursor.fetchmany() if size is None else self.cursor.fetchmany(size)
+        self.rows += len(Rows)
+        return Rows
+
+    def fetchall(self):
+        Rows = self.cursor.fetchall()
+        self.rows += len(Rows)
+        return Rows
+
+    def close(self):
+        self.flush()
+        return self.cursor.close()
+
+    def __del__(self):
+        self.flush()
+
+    def __iter__(self):
+        for row in self.cursor:
+            self.rows += 1
+            yield row
+        self.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+
+if Metrics.Enabled and os.getenv("METRICSFILE"):
+    atexit.register(Metrics.dump, os.getenv("METRICSFILE"))
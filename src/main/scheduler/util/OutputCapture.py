@@ -0,0 +1,54 @@
+import io
+import sys
+import threading
+import contextlib
+
+
+class ThreadLocalStdout:
+    """
+        Stands in for sys.stdout, what a thread prints goes to the buffer it's capturing into, or to the real
+        stdout when it's not capturing. The command handlers print their results, so this is how concurrent
+        commands get their own output.
+    """
+
+    def __init__(self, stdout):
+        self.stdout = stdout
+        self.local = threading.local()
+
+    def target(self):
+        Buffer = getattr(self.local, "buffer", None)
+        return self.stdout if Buffer is None else Buffer
+
+    def write(self, text):
+        return self.target().write(text)
+
+    def flush(self):
+        return self.target().flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stdout, name)
+
+
+InstallLock = threading.Lock()
+
+
+@contextlib.contextmanager
+def capture_output():
+    """
+        Capture what the current thread prints, other threads are not affected.
+        Usage:
+            with capture_output() as buffer:
+                ...
+            buffer.getvalue()
+    """
+    with InstallLock:
+        if not isinstance(sys.stdout, ThreadLocalStdout):
+            sys.stdout = ThreadLocalStdout(sys.stdout)
+    Proxy = sys.stdout
+    Previous = getattr(Proxy.local, "buffer", None)
+    Buffer = io.StringIO()
+    Proxy.local.buffer = Buffer
+    try:
+        yield Buffer
+    finally:
+        Proxy.local.buffer = Previous
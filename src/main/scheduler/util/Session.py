@@ -0,0 +1,107 @@
+import time
+import secrets
+import threading
+import collections
+
+
+class Session:
+    """
+        The login of one user of the scheduler, passed to every command handler.
+        Note: it is always true that at most one of caregiver and patient is not None, since only one user can
+        be logged-in in a session at a time.
+        * login_token is the LoginTokens token of the login, resume_login takes it to log in another session.
+        * lock makes the commands of one session run one at a time, commands of different sessions run in
+        parallel.
+    """
+
+    def __init__(self, token=None):
+        self.token = secrets.token_urlsafe(24) if token is None else token
+        self.patient = None
+        self.caregiver = None
+        self.login_token = None
+        self.last_seen = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def LoggedIn(self):
+        return self.patient is not None or self.caregiver is not None
+
+    def touch(self):
+        self.last_seen = time.monotonic()
+        return None
+
+    def logout(self):
+        self.patient = None
+        self.caregiver = None
+        self.login_token = None
+        return None
+
+    def __repr__(self):
+        return f"Session: {self.patient or self.caregiver or 'nobody'}"
+
+
+class SessionRegistry:
+    """
+        The sessions of a server, keyed by their tokens.
+        * A session expires when it's not used for `ttl` seconds.
+        * When there are more than `maxsize` sessions, the least recently used ones are evicted.
+    """
+
+    def __init__(self, ttl=1800, maxsize=10000):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.sessions = collections.OrderedDict()  # token -> Session, least recently used first.
+        self.lock = threading.Lock()
+
+    def create(self):
+        """
+            Start a new session, nobody is logged in yet.
+        """
+        session = Session()
+        with self.lock:
+            self.sessions[session.token] = session
+            while len(self.sessions) > self.maxsize:
+                self.sessions.popitem(last=False)
+        return session
+
+    def get(self, token):
+        """
+            Get the session of a token, None when it doesn't exist or it has expired.
+        """
+        with self.lock:
+            session = self.sessions.get(token)
+            if session is None:
+                return None
+            if self.expired(session):
+                del self.sessions[token]
+                return None
+            session.touch()
+            self.sessions.move_to_end(token)
+            return session
+
+    def remove(self, token):
+        with self.lock:
+            self.sessions.pop(token, None)
+        return None
+
+    def expired(self, session):
+        return self.ttl is not None and time.monotonic() - session.last_seen > self.ttl
+
+    def evict_expired(self):
+        """
+            Drop all the expired sessions.
+            Return:
+                The number of sessions dropped.
+        """
+        with self.lock:
+            Expired = []
+            for token, session in self.sessions.items():
+                if not self.expired(session):
+                    break  # the rest were used more recently.
+                Expired.append(token)
+            for token in Expired:
+                del self.sessions[token]
+        return len(Expired)
+
+    def __len__(self):
+        return len(self.sessions)
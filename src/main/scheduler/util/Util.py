@@ -1,23 +1,42 @@
 import hashlib
 import os
+import re
+import time
 import datetime
+from util.Metrics import Metrics
 
 class Util:
 
+    # PBKDF2 iterations for new hashes, passwords hashed with another cost are rehashed when they login.
+    HashIterations = int(os.getenv("HASHITERATIONS", "100000"))
+
     @staticmethod  # added later.
     def generate_salt():
         return os.urandom(16)
 
     @staticmethod
-    def generate_hash(password, salt):
-        key = hashlib.pbkdf2_hmac(
+    def generate_hash(password, salt, iterations=None):
+        """
+            Hash a password in this process, the time it took goes to scheduler_hash_seconds.
+        """
+        Start = time.perf_counter()
+        key = Util.pbkdf2(password, salt, iterations)
+        Metrics.observe("scheduler_hash_seconds", time.perf_counter() - Start)
+        return key
+
+    @staticmethod
+    def pbkdf2(password, salt, iterations=None):
+        """
+            The hash of generate_hash, untimed. The worker processes of HashService use it, the metrics they
+            would record are lost, they send the time back to the parent instead.
+        """
+        return hashlib.pbkdf2_hmac(
             'sha256',
             password.encode('utf-8'),
             salt,
-            100000,
+            Util.HashIterations if iterations is None else iterations,
             dklen=16
         )
-        return key
 
     @staticmethod
     def CheckDateCorrect(date_string):
@@ -40,6 +59,56 @@ class Util:
         # if other exception occurred here, then WTF I guess.
         return None
 
+    @staticmethod
+    def ParseDate(date_string):
+        """
+            Parse a date in the format of YYYY-MM-DD.
+            Returns:
+                The datetime.date, or None if the string is not a correct date.
+        """
+        if date_string is None or len(re.findall(r"^\d{4}-\d{1,2}-\d{1,2}$", date_string)) != 1:
+            return None
+        Year, Month, Day = (int(Part) for Part in date_string.split("-"))
+        try:
+            return datetime.date(Year, Month, Day)
+        except ValueError:
+            return None
+
+    # Recurrence rules of ExpandDates, as the weekdays they keep, Monday is 0.
+    Recurrences = {
+        "daily": {0, 1, 2, 3, 4, 5, 6},
+        "weekdays": {0, 1, 2, 3, 4},
+        "weekends": {5, 6}
+    }
+    WeekdayNames = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+    @staticmethod
+    def ExpandDates(start, end, rule="daily"):
+        """
+            List the dates from start to end, both included, that match the recurrence rule.
+            rule:
+                "daily", "weekdays", "weekends", or a comma separated list of days such as "tue" or "mon,wed,fri".
+            Returns:
+                The list of datetime.date in increasing order.
+            Exception:
+                ValueError when the rule is not understood or the range is backward.
+        """
+        if end < start:
+            raise ValueError(f"The range ends ({end}) before it starts ({start}). ")
+        rule = rule.lower()
+        if rule in Util.Recurrences:
+            Weekdays = Util.Recurrences[rule]
+        else:
+            Names = [Name.strip()[:3] for Name in rule.split(",")]
+            if any(Name not in Util.WeekdayNames for Name in Names):
+                raise ValueError(f"Unknown recurrence rule: \"{rule}\". ")
+            Weekdays = {Util.WeekdayNames.index(Name) for Name in Names}
+        Days = (end - start).days + 1
+        return [
+            start + datetime.timedelta(days=Offset) for Offset in range(Days)
+            if (start + datetime.timedelta(days=Offset)).weekday() in Weekdays
+        ]
+
     @staticmethod
     def CheckIfGoodPassword(password:str):
         """
@@ -0,0 +1,61 @@
+import os
+import sys
+
+# The scheduler reads its configuration when its modules are imported, set it before the first import.
+os.environ["BACKEND"] = "sqlite"
+os.environ.setdefault("HASHITERATIONS", "1000")
+os.environ.setdefault("HASHWORKERS", "1")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "main", "scheduler"))
+
+import pytest
+from db.ConnectionManager import ConnectionManager
+from model.SlotIndex import SlotIndex
+from model.VaccineCatalog import VaccineCatalog
+from util.LoginTokens import LoginTokens
+from util.OutputCapture import capture_output
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+        A brand-new SQLite database file for the test, with the process wide singletons reset around it. The
+        schema is loaded on first use. Yields the path of the file.
+    """
+    monkeypatch.setenv("DBNAME", str(tmp_path / "scheduler.db"))
+    monkeypatch.delenv("SCHEMAVERSION", raising=False)
+    reset()
+    yield tmp_path / "scheduler.db"
+    reset()
+
+
+@pytest.fixture
+def reopen():
+    """
+        Close the database of the test, the next use opens it again as a restarted scheduler would.
+    """
+    return reset
+
+
+def reset():
+    ConnectionManager.close_pool()
+    if ConnectionManager.Backend is not None and ConnectionManager.Backend.keeper is not None:
+        ConnectionManager.Backend.keeper.close()
+    ConnectionManager.Backend, ConnectionManager.Pool = None, None
+    SlotIndex.Instance, VaccineCatalog.Instance = None, None
+    LoginTokens.Verified.clear()
+    return None
+
+
+@pytest.fixture
+def command(database):
+    """
+        Run a command line of the scheduler for a session on the database of the test, returns what it printed.
+    """
+    import Scheduler
+
+    def run(session, line):
+        tokens = line.split(" ")
+        with capture_output() as Output:
+            Scheduler.COMMANDS[tokens[0]](tokens, session)
+        return Output.getvalue()
+    return run
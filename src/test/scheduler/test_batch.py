@@ -0,0 +1,57 @@
+import io
+import os
+import sys
+import json
+import sqlite3
+import subprocess
+import Scheduler
+from model.Caregiver import Caregiver
+from db.ConnectionManager import ConnectionManager
+
+
+def run(lines):
+    Out = io.StringIO()
+    Failed = Scheduler.run_batch(io.StringIO("\n".join(lines) + "\n"), out=Out)
+    Results = [json.loads(line) for line in Out.getvalue().splitlines()]
+    return Failed, Results[:-1], Results[-1]["summary"]
+
+
+def test_a_database_error_fails_the_command_and_the_batch_goes_on(database, monkeypatch):
+    def locked(self, dates, capacity=1):
+        raise sqlite3.OperationalError("database is locked")
+    monkeypatch.setattr(Caregiver, "upload_availabilities", locked)
+    Failed, Results, Summary = run([
+        "create_caregiver carol Passw0rd!",
+        "login_caregiver carol Passw0rd!",
+        "upload_availability 2099-01-05",
+        "add_doses Pfizer 10",
+    ])
+    assert Failed == 1
+    assert [r["ok"] for r in Results] == [True, True, False, True]
+    assert "database is locked" in Results[2]["output"]
+    assert "Doses updated!" in Results[3]["output"]
+    assert Summary["commands"] == 4 and Summary["failed"] == 1
+
+
+def test_unknown_commands_fail_and_quit_stops_the_batch(database):
+    Failed, Results, Summary = run(["# a comment", "", "bogus", "quit", "create_patient pat Passw0rd!"])
+    assert Failed == 1
+    assert [r["command"] for r in Results] == ["bogus"]
+    assert Summary["commands"] == 1
+
+
+def test_batch_on_stdin_survives_a_database_error(database, tmp_path):
+    with ConnectionManager() as cursor:
+        cursor.execute("DROP TABLE Availabilities")
+    ConnectionManager.close_pool()
+    Commands = "create_caregiver carol Passw0rd!\nlogin_caregiver carol Passw0rd!\n" + \
+        "upload_availability 2099-01-05\ncreate_patient pat Passw0rd!\n"
+    Done = subprocess.run(
+        [sys.executable, "Scheduler.py", "--batch"], input=Commands, capture_output=True, text=True,
+        cwd=os.path.dirname(Scheduler.__file__), env=dict(os.environ, DBNAME=str(tmp_path / "scheduler.db")),
+        timeout=60
+    )
+    Results = [json.loads(line) for line in Done.stdout.splitlines()]
+    assert Done.returncode == 1, Done.stderr
+    assert [r["ok"] for r in Results[:-1]] == [True, True, False, True]
+    assert Results[-1]["summary"]["failed"] == 1
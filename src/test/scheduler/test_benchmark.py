@@ -0,0 +1,18 @@
+import pytest
+import Benchmark
+
+SMALL = ["--caregivers", "5", "--patients", "20", "--days", "3", "--operations", "20"]
+
+
+@pytest.mark.parametrize("version", ["-1", "0", "2"])
+def test_benchmark_before_the_migrations(database, monkeypatch, capsys, version):
+    monkeypatch.setenv("SCHEMAVERSION", version)
+    assert Benchmark.main(["appointment_readers", "--schema-version", version] + SMALL) == 0
+    assert "show_appointments" in capsys.readouterr().out
+
+
+def test_benchmark_at_the_latest_schema(database, capsys):
+    assert Benchmark.main(SMALL) == 0
+    Output = capsys.readouterr().out
+    for command in ("create_patient", "reserve", "search_caregiver_schedule", "show_appointments"):
+        assert command in Output
@@ -0,0 +1,40 @@
+from util.Cache import TTLCache
+
+
+def test_get_or_load_caches_and_counts():
+    Cache, Loads = TTLCache(maxsize=2, ttl=None), []
+    assert Cache.get_or_load("a", lambda: Loads.append("a") or 1) == 1
+    assert Cache.get_or_load("a", lambda: Loads.append("a") or 2) == 1
+    Cache.put("b", 2)
+    Cache.put("c", 3)
+    assert Cache.get("a") is None and Loads == ["a"]
+    Stats = Cache.stats()
+    assert (Stats["hits"], Stats["evictions"], Stats["size"]) == (1, 1, 2)
+
+
+def test_a_value_invalidated_while_loading_is_not_cached():
+    Cache = TTLCache(ttl=None)
+
+    def stale():
+        Cache.invalidate("a")  # a writer changed the data behind the value being loaded.
+        return "stale"
+    assert Cache.get_or_load("a", stale) == "stale"
+    assert Cache.get_or_load("a", lambda: "fresh") == "fresh"
+    assert Cache.get("a") == "fresh"
+
+
+def test_a_value_loaded_across_a_clear_is_not_cached():
+    Cache = TTLCache(ttl=None)
+
+    def stale():
+        Cache.clear()
+        return "stale"
+    Cache.get_or_load("a", stale)
+    assert Cache.get("a") is None
+    assert Cache.loading == {}
+
+
+def test_expired_entries_are_loaded_again():
+    Cache = TTLCache(ttl=0)
+    Cache.put("a", 1)
+    assert Cache.get_or_load("a", lambda: 2) == 2
@@ -0,0 +1,52 @@
+import time
+import pytest
+from db.ConnectionPool import ConnectionPool, PoolTimeout
+from db.Backend import DatabaseError
+
+
+class FakeConnection:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.checks = 0
+        self.closed = False
+
+    def cursor(self):
+        return self
+
+    def execute(self, sql):
+        self.checks += 1
+        if not self.healthy:
+            raise OSError("gone")
+
+    def fetchall(self):
+        return [(1, )]
+
+    def close(self):
+        self.closed = True
+
+
+def test_warm_connection_skips_the_health_check():
+    Pool = ConnectionPool(FakeConnection, max_size=1, health_check_idle=60)
+    conn = Pool.acquire()
+    Pool.release(conn)
+    assert Pool.acquire() is conn
+    assert conn.checks == 0
+
+
+def test_idle_connection_is_health_checked_and_replaced_when_broken():
+    Pool = ConnectionPool(FakeConnection, max_size=1, health_check_idle=0)
+    conn = Pool.acquire()
+    conn.healthy = False
+    Pool.release(conn)
+    Fresh = Pool.acquire()
+    assert Fresh is not conn and conn.closed and conn.checks == 1
+
+
+def test_checkout_timeout_is_a_database_error():
+    Pool = ConnectionPool(FakeConnection, max_size=1, checkout_timeout=0.01)
+    Pool.acquire()
+    Start = time.monotonic()
+    with pytest.raises(DatabaseError):
+        Pool.acquire()
+    assert time.monotonic() - Start < 5
+    assert issubclass(PoolTimeout, DatabaseError)
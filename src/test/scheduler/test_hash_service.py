@@ -0,0 +1,24 @@
+from util.HashService import HashService
+from util.Util import Util
+from util.Metrics import Metrics
+
+
+def test_hash_many_matches_the_inline_hash():
+    Salts = [Util.generate_salt() for _ in range(3)]
+    Passwords = ["Passw0rd!", "0therPass!", "Thr33Pass?"]
+    try:
+        Hashes = HashService.hash_many(Passwords, Salts, iterations=1000)
+    finally:
+        HashService.shutdown()
+    assert Hashes == [Util.generate_hash(p, s, 1000) for p, s in zip(Passwords, Salts)]
+
+
+def test_hash_many_records_the_worker_times_in_the_parent(monkeypatch):
+    monkeypatch.setattr(Metrics, "Enabled", True)
+    Histogram = Metrics.histogram("scheduler_hash_seconds")
+    Before = Histogram.count
+    try:
+        HashService.hash_many(["Passw0rd!"]*4, [Util.generate_salt() for _ in range(4)], iterations=1000)
+    finally:
+        HashService.shutdown()
+    assert Histogram.count - Before == 4
@@ -0,0 +1,51 @@
+import time
+import re
+from util.LoginTokens import LoginTokens
+from util.Session import Session
+
+
+def test_issue_verify_and_check(database):
+    Token = LoginTokens.issue("patient", "pat", "Passw0rd!")
+    assert LoginTokens.verify(Token) == ("patient", "pat")
+    assert LoginTokens.check("patient", "pat", "Passw0rd!") == Token
+    assert LoginTokens.check("patient", "pat", "Wr0ngPass!") is None
+
+
+def test_forged_and_replaced_tokens_are_refused(database):
+    Token = LoginTokens.issue("patient", "pat", "Passw0rd!")
+    Payload, Signature = Token.split(".")
+    Forged = LoginTokens.encode(LoginTokens.decode(Payload).replace(b"pat", b"eve")) + "." + Signature
+    assert LoginTokens.verify(Forged) is None
+    assert LoginTokens.verify("garbage") is None
+    time.sleep(1)  # the expiry is in seconds, a newer login gets another token.
+    Newer = LoginTokens.issue("patient", "pat", "Passw0rd!")
+    assert LoginTokens.verify(Token) is None and LoginTokens.verify(Newer) == ("patient", "pat")
+
+
+def test_expired_tokens_are_refused(database, monkeypatch):
+    Token = LoginTokens.issue("caregiver", "carol", "Passw0rd!")
+    Now = time.time()
+    monkeypatch.setattr(time, "time", lambda: Now + LoginTokens.TTL + 1)
+    assert LoginTokens.verify(Token) is None
+    assert LoginTokens.check("caregiver", "carol", "Passw0rd!") is None
+
+
+def test_revoke(database):
+    Token = LoginTokens.issue("patient", "pat", "Passw0rd!")
+    assert LoginTokens.revoke(Token)
+    assert LoginTokens.verify(Token) is None
+    assert LoginTokens.check("patient", "pat", "Passw0rd!") is None
+    assert not LoginTokens.revoke(Token)
+
+
+def test_logout_revokes_the_login_token(command):
+    First, Second = Session(), Session()
+    command(First, "create_patient pat Passw0rd!")
+    Output = command(First, "login_patient pat Passw0rd!")
+    assert "Current login patient: pat" in Output and "token" not in Output.lower()
+    Token = re.search(r"Login token: (\S+)", command(First, "show_login_token")).group(1)
+    assert "Current login patient: pat" in command(Second, f"resume_login {Token}")
+    command(Second, "logout")
+    assert "invalid or has expired" in command(Session(), f"resume_login {Token}")
+    assert LoginTokens.Verified.get(("patient", "pat")) is None
+    assert "Please login first!" in command(Second, "show_login_token")
@@ -0,0 +1,73 @@
+from db.ConnectionManager import ConnectionManager
+from db.Migrations import Migrations
+from model.Caregiver import Caregiver
+from util.Util import Util
+
+
+def columns(cursor, table):
+    cursor.execute(f"PRAGMA table_info({table})")
+    return {row["name"] for row in cursor.fetchall()}
+
+
+def indexes(cursor, table):
+    cursor.execute(f"PRAGMA index_list({table})")
+    return {row["name"] for row in cursor.fetchall() if not row["name"].startswith("sqlite_")}
+
+
+def test_upgrade_from_the_original_schema(database, reopen, monkeypatch):
+    # a database made by the original create.sql, with the original 100000 iterations hashes.
+    monkeypatch.setenv("SCHEMAVERSION", "-1")
+    Salt = Util.generate_salt()
+    with ConnectionManager() as cursor:
+        assert "Iterations" not in columns(cursor, "Caregivers")
+        Hash = Util.generate_hash("Passw0rd!", Salt, 100000)
+        cursor.execute("INSERT INTO Caregivers VALUES (%s, %s, %s)", ("carol", Salt, Hash))
+        cursor.execute("INSERT INTO Patients VALUES (%s, %s, %s)", ("pat", Salt, Salt))
+        cursor.execute("INSERT INTO Vaccines VALUES (%s, %d)", ("Pfizer", 5))
+        cursor.execute("INSERT INTO Availabilities VALUES (%s, %s)", ("2099-01-05", "carol"))
+        cursor.execute("INSERT INTO Availabilities VALUES (%s, %s)", ("2099-01-06", "carol"))
+        cursor.execute("INSERT INTO Appointments (PatientName, CareGiverName, AppointmentDate, VaccineType) " +
+                       "VALUES (%s, %s, %s, %s)", ("pat", "carol", "2099-01-04", "Pfizer"))
+    reopen()
+    monkeypatch.delenv("SCHEMAVERSION")
+    with ConnectionManager() as cursor:
+        cursor.execute("SELECT Version FROM SchemaVersion ORDER BY Version")
+        assert [row["Version"] for row in cursor.fetchall()] == [v for v, _, _ in Migrations.available()]
+        assert {"Iterations"} <= columns(cursor, "Caregivers") & columns(cursor, "Patients")
+        assert {"Version"} <= columns(cursor, "Vaccines")
+        assert "IX_Vaccines_Version" in indexes(cursor, "Vaccines")
+        cursor.execute("SELECT Capacity FROM Availabilities WHERE Username = %s", "carol")
+        assert [row["Capacity"] for row in cursor.fetchall()] == [1, 1]
+        # the appointments are counted once per caregiver, not on every slot.
+        assert "Booked" not in columns(cursor, "Availabilities")
+        assert indexes(cursor, "Availabilities") == {"IX_Availabilities_Time_Capacity"}
+        cursor.execute("SELECT Booked FROM Caregivers WHERE Username = %s", "carol")
+        assert cursor.fetchone()["Booked"] == 1
+        # the rowversion triggers of the added column keep working.
+        cursor.execute("UPDATE Vaccines SET Doses = 6 WHERE Name = %s", "Pfizer")
+        cursor.execute("SELECT Version FROM Vaccines")
+        assert cursor.fetchone()["Version"] > 0
+    # the original hash is checked with the original cost.
+    assert Caregiver("carol", password="Passw0rd!").get() is not None
+
+
+def test_migrations_run_once(database, reopen):
+    with ConnectionManager() as cursor:
+        cursor.execute("SELECT COUNT(*) AS Applied FROM SchemaVersion")
+        Applied = cursor.fetchone()["Applied"]
+    reopen()
+    cm = ConnectionManager()
+    conn = cm.create_connection()
+    try:
+        assert Migrations.migrate(cm.backend, conn) == []
+    finally:
+        cm.close_connection()
+    assert Applied == len(Migrations.available())
+
+
+def test_bare_create_sql_has_no_migration(database, monkeypatch):
+    monkeypatch.setenv("SCHEMAVERSION", "-1")
+    with ConnectionManager() as cursor:
+        assert columns(cursor, "Availabilities") == {"Time", "Username"}
+        cursor.execute("SELECT COUNT(*) AS Applied FROM SchemaVersion")
+        assert cursor.fetchone()["Applied"] == 0
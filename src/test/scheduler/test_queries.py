@@ -0,0 +1,18 @@
+import pytest
+from db.Queries import Queries
+from model.Appointment import Appointment
+
+
+def test_a_query_is_prepared_only_with_declared_types():
+    assert Queries.register("test.typed", "SELECT 1 WHERE %s = %d", types=("DATE", "INT")).Preparable
+    assert not Queries.register("test.untyped", "SELECT 1 WHERE %s = %d").Preparable
+    with pytest.raises(ValueError):
+        Queries.register("test.typed", "SELECT 1 WHERE %s = %d", types=("DATE", "BIGINT"))
+    with pytest.raises(ValueError):
+        Queries.register("test.missing_type", "SELECT 1 WHERE %s = %d", types=("DATE", ))
+
+
+def test_the_pages_of_appointments_declare_their_types():
+    Query, Params = Appointment.page_query(Appointment.SelectAppointmentsForPatient, "alice", 7, 20, "date")
+    assert Params == ("alice", 7, 7, 7, 20)
+    assert Query.types == ("VARCHAR(255)", "INT", "INT", "INT", "INT")
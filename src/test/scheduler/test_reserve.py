@@ -0,0 +1,65 @@
+import re
+from util.Session import Session
+
+
+def caregiver(command, name, *uploads):
+    session = Session()
+    command(session, f"create_caregiver {name} Passw0rd!")
+    command(session, f"login_caregiver {name} Passw0rd!")
+    for upload in uploads:
+        assert "Availability uploaded!" in command(session, f"upload_availability {upload}")
+    return session
+
+
+def reserve(command, patient, vaccine, date):
+    session = Session()
+    command(session, f"create_patient {patient} Passw0rd!")
+    command(session, f"login_patient {patient} Passw0rd!")
+    Output = command(session, f"reserve {vaccine} {date}")
+    Booked = re.search(r"Caregiver: (\w+)", Output)
+    return Booked.group(1) if Booked else Output
+
+
+def test_most_capacity_then_least_booked_then_username(command):
+    Carol = caregiver(command, "carol", "2099-01-05 --capacity 1")
+    caregiver(command, "bob", "2099-01-05 --capacity 2", "2099-01-06")
+    caregiver(command, "alice", "2099-01-05 --capacity 2")
+    command(Carol, "add_doses Pfizer 10")
+    assert reserve(command, "p0", "Pfizer", "2099-01-06") == "bob"
+    Order = [reserve(command, f"p{i}", "Pfizer", "2099-01-05") for i in range(1, 6)]
+    # alice and bob take 2, but bob has one more appointment. Then everybody has 1 left, carol has none booked.
+    assert Order == ["alice", "bob", "carol", "alice", "bob"]
+    assert "No caregiver is available" in reserve(command, "p6", "Pfizer", "2099-01-05")
+
+
+def test_the_booked_count_is_kept_on_the_caregiver(command):
+    from db.ConnectionManager import ConnectionManager
+    Carol = caregiver(command, "carol", "2099-01-05 2099-01-09 --capacity 3")
+    command(Carol, "add_doses Pfizer 10")
+    for i in range(3):
+        assert reserve(command, f"p{i}", "Pfizer", f"2099-01-0{5 + i}") == "carol"
+    assert "1 Appointment(s) Cancelled" in command(Carol, "cancel --caregiver carol --date 2099-01-05")
+    with ConnectionManager() as cursor:
+        cursor.execute("SELECT Booked FROM Caregivers WHERE Username = %s", "carol")
+        assert cursor.fetchone()["Booked"] == 2
+        cursor.execute("SELECT Time, Capacity FROM Availabilities WHERE Username = %s ORDER BY Time", "carol")
+        assert [(str(row["Time"]), row["Capacity"]) for row in cursor.fetchall()] == [
+            ("2099-01-06", 2), ("2099-01-07", 2), ("2099-01-08", 3), ("2099-01-09", 3)
+        ]
+
+
+def test_upload_rejects_ranges_longer_than_the_cap(command):
+    Carol = caregiver(command, "carol")
+    assert "Upload at most 366 days at once" in command(Carol, "upload_availability 2099-01-01 2100-01-02")
+    assert "366 new date(s)" in command(Carol, "upload_availability 2099-01-01 2100-01-01 daily --capacity 2")
+    assert "0 new date(s), 5 already uploaded" in command(Carol, "upload_availability 2099-01-01 2099-01-05")
+
+
+def test_a_full_slot_is_kept_so_the_date_is_not_uploaded_again(command):
+    Carol = caregiver(command, "carol", "2099-01-05")
+    command(Carol, "add_doses Pfizer 10")
+    assert reserve(command, "p0", "Pfizer", "2099-01-05") == "carol"
+    assert "0 new date(s), 1 already uploaded" in command(Carol, "upload_availability 2099-01-05")
+    assert "No caregiver is available" in reserve(command, "p1", "Pfizer", "2099-01-05")
+    assert "- carol" not in command(Carol, "search_caregiver_schedule 2099-01-05")
+    assert "2099-01-05 Mon  |    0" in command(Carol, "search_caregiver_schedule 2099-01-04 2099-01-06")
@@ -0,0 +1,48 @@
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import SchedulerServer
+from util.Session import Session
+
+
+def test_admin_and_file_commands_are_not_served(database):
+    for name in ("import_users", "metrics", "slow_queries", "query_stats", "show_cache_stats"):
+        assert name not in SchedulerServer.COMMANDS
+        assert SchedulerServer.run_command(Session(), [name]) == ("Invalid Argument\n", None)
+
+
+def test_patient_commands_are_served(database):
+    session = Session()
+    Output, Error = SchedulerServer.run_command(session, ["create_patient", "alice", "Passw0rd!"])
+    assert "Account Registered" in Output and Error is None
+    Output, Error = SchedulerServer.run_command(session, ["login_patient", "alice", "Passw0rd!"])
+    assert "Current login patient: alice" in Output and Error is None
+
+
+def test_a_failing_command_or_request_keeps_the_connection(database, monkeypatch):
+    def broken(tokens, session):
+        raise TypeError("broken handler")
+    monkeypatch.setitem(SchedulerServer.COMMANDS, "logout", broken)
+
+    async def scenario():
+        executor = ThreadPoolExecutor(max_workers=2)
+        server = await asyncio.start_server(
+            lambda r, w: SchedulerServer.handle_client(r, w, executor), "127.0.0.1", 0)
+        reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+        Responses = [json.loads(await reader.readline())]
+        for request in (b"[1]\n", b"logout\n", b'{"command": "create_patient alice Passw0rd!"}\n'):
+            writer.write(request)
+            await writer.drain()
+            Responses.append(json.loads(await reader.readline()))
+        writer.write(b"quit\n")
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        executor.shutdown()
+        return Responses
+
+    Greeting, NotAnObject, Broken, Created = asyncio.run(scenario())
+    assert "session" in Greeting
+    assert "Malformed request" in NotAnObject["error"]
+    assert Broken["error"] == "TypeError" and "broken handler" in Broken["output"]
+    assert "error" not in Created and "Account Registered" in Created["output"]
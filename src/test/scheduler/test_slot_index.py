@@ -0,0 +1,62 @@
+import time
+import datetime
+from model.SlotIndex import SlotIndex
+from util.Session import Session
+from test_reserve import caregiver, reserve
+
+Monday, Tuesday = datetime.date(2099, 1, 5), datetime.date(2099, 1, 6)
+
+
+def index(*rows):
+    Slots = SlotIndex(refresh_interval=3600)
+    Slots.load([{"Time": day, "Username": name, "Capacity": capacity, "Booked": booked}
+                for day, name, capacity, booked in rows])
+    Slots.refreshed = time.monotonic()
+    return Slots
+
+
+def test_take_only_pushes_on_the_date_booked():
+    Slots = index((Monday, "bob", 2, 0), (Monday, "carol", 2, 0), (Tuesday, "bob", 1, 0), (Tuesday, "carol", 1, 0))
+    assert Slots.best(Monday) == "bob"
+    Slots.take(Monday, "bob")
+    assert len(Slots.heaps[Tuesday]) == 2
+    # bob's entry of Tuesday is outdated, it's pushed again behind carol when it reaches the top.
+    assert Slots.best(Tuesday) == "carol"
+    assert Slots.best(Monday) == "carol"
+    Slots.take(Monday, "carol")
+    assert Slots.best(Tuesday) == "bob"
+
+
+def test_load_range_keeps_the_other_dates():
+    Slots = index((Monday, "bob", 1, 3), (Tuesday, "bob", 1, 3), (Tuesday, "carol", 1, 2))
+    assert Slots.best(Tuesday) == "carol"
+    # bob's appointment of Monday was cancelled and carol booked Monday.
+    Slots.load_range(Monday, Monday, [
+        {"Time": Monday, "Username": "bob", "Capacity": 2, "Booked": 2},
+        {"Time": Monday, "Username": "carol", "Capacity": 1, "Booked": 3},
+    ])
+    assert Slots.dates == [Monday, Tuesday]
+    assert Slots.capacity[Tuesday] == {"bob": 1, "carol": 1}
+    assert Slots.best(Tuesday) == "bob"
+    Slots.load_range(Monday, Monday, [])
+    assert Slots.dates == [Tuesday] and Slots.earliest(Monday) == Tuesday
+    assert Slots.dates_of == {"bob": {Tuesday}, "carol": {Tuesday}}
+
+
+def test_invalidate_reloads_the_dates_written_only(command, monkeypatch):
+    Carol = caregiver(command, "carol", "2099-01-05 --capacity 2")
+    command(Carol, "add_doses Pfizer 10")
+    assert SlotIndex.get().best(Monday) == "carol"
+
+    def load(rows):
+        raise AssertionError("The whole index was reloaded. ")
+    monkeypatch.setattr(SlotIndex.get(), "load", load)
+    caregiver(command, "bob", "2099-01-06")
+    assert SlotIndex.get().earliest(Tuesday) == Tuesday
+    assert reserve(command, "alice", "Pfizer", "2099-01-05") == "carol"
+    assert SlotIndex.get().capacity[Monday] == {"carol": 1}
+    Alice = Session()
+    command(Alice, "login_patient alice Passw0rd!")
+    assert "1 Appointment(s) Cancelled" in command(Alice, "cancel 1")
+    assert SlotIndex.get().best(Monday) == "carol"
+    assert SlotIndex.get().capacity[Monday] == {"carol": 2}
@@ -0,0 +1,35 @@
+import gc
+import weakref
+from db.SQLiteBackend import SQLiteBackend
+
+
+def translate(sql):
+    return SQLiteBackend.__new__(SQLiteBackend).translate(sql)
+
+
+def test_translate_placeholders_top_and_paging():
+    assert translate("SELECT TOP 1 Name FROM Vaccines WHERE Doses > %d ORDER BY Name") == \
+        "SELECT Name FROM Vaccines WHERE Doses > ? ORDER BY Name LIMIT 1"
+    assert translate("SELECT Id FROM Appointments ORDER BY Id OFFSET %d ROWS FETCH NEXT %d ROWS ONLY") == \
+        "SELECT Id FROM Appointments ORDER BY Id LIMIT ?, ?"
+
+
+def test_translate_drops_table_hints():
+    assert translate("SELECT 1 FROM Availabilities WITH (UPDLOCK, HOLDLOCK) WHERE Time = %s") == \
+        "SELECT 1 FROM Availabilities WHERE Time = ?"
+
+
+def test_translate_ddl_alter_table():
+    Script = SQLiteBackend.translate_ddl("ALTER TABLE Vaccines ADD Version ROWVERSION;")
+    assert "ADD Version INTEGER NOT NULL DEFAULT 0;" in Script
+    assert "CREATE TRIGGER Vaccines_Version_Update" in Script
+
+
+def test_translating_keeps_no_backend_alive(database):
+    Backend = SQLiteBackend()
+    Backend.translate("SELECT TOP 1 Name FROM Vaccines")
+    Reference = weakref.ref(Backend)
+    Backend.keeper.close()
+    del Backend
+    gc.collect()
+    assert Reference() is None
@@ -0,0 +1,25 @@
+import threading
+from model.Vaccine import Vaccine
+
+
+def test_add_doses_inserts_then_adds(database):
+    Vaccine("Pfizer", 3).add_doses()
+    Vaccine("Pfizer", 4).add_doses()
+    assert Vaccine("Pfizer", None).get().get_available_doses() == 7
+
+
+def test_concurrent_adds_of_a_new_vaccine_all_count(database):
+    Errors = []
+
+    def add():
+        try:
+            Vaccine("Moderna", 1).add_doses()
+        except Exception as e:
+            Errors.append(e)
+    Threads = [threading.Thread(target=add) for _ in range(8)]
+    for thread in Threads:
+        thread.start()
+    for thread in Threads:
+        thread.join()
+    assert Errors == []
+    assert Vaccine("Moderna", None).get().get_available_doses() == 8
@@ -0,0 +1,84 @@
+from db.ConnectionManager import ConnectionManager
+from util.Session import Session
+from test_reserve import caregiver
+
+
+def patient(command, name):
+    session = Session()
+    command(session, f"create_patient {name} Passw0rd!")
+    command(session, f"login_patient {name} Passw0rd!")
+    return session
+
+
+def waiting():
+    with ConnectionManager() as cursor:
+        cursor.execute("SELECT PatientName, AppointmentDate, VaccineType FROM Waitlist ORDER BY Id")
+        return [(row["PatientName"], str(row["AppointmentDate"]), row["VaccineType"]) for row in cursor.fetchall()]
+
+
+def appointments(name):
+    with ConnectionManager() as cursor:
+        cursor.execute("SELECT AppointmentDate FROM Appointments WHERE PatientName = %s ORDER BY Id", name)
+        return [str(row["AppointmentDate"]) for row in cursor.fetchall()]
+
+
+def test_reserve_joins_the_waitlist_only_with_wait(command):
+    Carol = caregiver(command, "carol")
+    command(Carol, "add_doses Pfizer 10")
+    Alice, Bob = patient(command, "alice"), patient(command, "bob")
+    Output = command(Alice, "reserve Pfizer 2099-01-05")
+    assert "reserve Pfizer 2099-01-05 --wait" in Output
+    assert waiting() == []
+    assert "You are number 1 on the waitlist" in command(Alice, "reserve Pfizer 2099-01-05 --wait")
+    assert "You are number 2 on the waitlist" in command(Bob, "reserve Pfizer 2099-01-05 --wait")
+    assert "You are number 1 on the waitlist" in command(Alice, "reserve Pfizer 2099-01-05 --wait")
+
+
+def test_the_waitlist_is_booked_first_come_first_served(command):
+    Carol = caregiver(command, "carol")
+    command(Carol, "add_doses Pfizer 10")
+    for name in ("alice", "bob", "dave"):
+        command(patient(command, name), "reserve Pfizer 2099-01-05 --wait")
+    assert "2 waiting patient(s) booked" in command(Carol, "upload_availability 2099-01-05 --capacity 2")
+    assert appointments("alice") == appointments("bob") == ["2099-01-05"]
+    assert appointments("dave") == []
+    assert waiting() == [("dave", "2099-01-05", "Pfizer")]
+
+
+def test_leave_waitlist(command):
+    Carol = caregiver(command, "carol")
+    command(Carol, "add_doses Pfizer 10")
+    Alice = patient(command, "alice")
+    assert "not on the waitlist" in command(Alice, "leave_waitlist Pfizer 2099-01-05")
+    command(Alice, "reserve Pfizer 2099-01-05 --wait")
+    assert "You left the waitlist" in command(Alice, "leave_waitlist Pfizer 2099-01-05")
+    assert waiting() == []
+    assert "0 waiting patient(s) booked" in command(Carol, "upload_availability 2099-01-05")
+    assert appointments("alice") == []
+
+
+def test_reserving_directly_leaves_the_waitlist(command):
+    Carol = caregiver(command, "carol", "2099-01-06")
+    command(Carol, "add_doses Pfizer 10")
+    command(Carol, "add_doses Moderna 10")
+    Alice = patient(command, "alice")
+    command(Alice, "reserve Pfizer 2099-01-05 --wait")
+    command(Alice, "reserve Moderna 2099-01-07 --wait")
+    assert "Appointment Added" in command(Alice, "reserve Pfizer 2099-01-06")
+    assert waiting() == [("alice", "2099-01-07", "Moderna")]
+    # the slot of 2099-01-05 doesn't book alice a second time.
+    assert "0 waiting patient(s) booked" in command(Carol, "upload_availability 2099-01-05")
+    assert appointments("alice") == ["2099-01-06"]
+
+
+def test_a_patient_waiting_on_several_dates_is_booked_once(command):
+    Carol = caregiver(command, "carol")
+    command(Carol, "add_doses Pfizer 10")
+    Alice, Bob = patient(command, "alice"), patient(command, "bob")
+    command(Alice, "reserve Pfizer 2099-01-05 --wait")
+    command(Alice, "reserve Pfizer 2099-01-06 --wait")
+    command(Bob, "reserve Pfizer 2099-01-06 --wait")
+    assert "2 waiting patient(s) booked" in command(Carol, "upload_availability 2099-01-05 2099-01-06")
+    assert appointments("alice") == ["2099-01-05"]
+    assert appointments("bob") == ["2099-01-06"]
+    assert waiting() == []